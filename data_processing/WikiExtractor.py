@@ -673,14 +673,15 @@ class Extractor(object):
         @see https://www.mediawiki.org/wiki/Help:Formatting
         """
         # look for matching <nowiki>...</nowiki>
-        res = ''
+        res = []
         cur = 0
         for m in nowiki.finditer(wikitext, cur):
-            res += self.transform1(wikitext[cur:m.start()]) + wikitext[m.start():m.end()]
+            res.append(self.transform1(wikitext[cur:m.start()]))
+            res.append(wikitext[m.start():m.end()])
             cur = m.end()
         # leftover
-        res += self.transform1(wikitext[cur:])
-        return res
+        res.append(self.transform1(wikitext[cur:]))
+        return ''.join(res)
 
 
     def transform1(self, text):
@@ -712,8 +713,7 @@ class Extractor(object):
         # Drop tables
         # first drop residual templates, or else empty parameter |} might look like end of table.
         if not options.keep_tables:
-            text = dropNested(text, r'{{', r'}}')
-            text = dropNested(text, r'{\|', r'\|}')
+            text = dropAllNested(text, templatesAndTables)
 
         # Handle bold/italic/quote
         if options.toHTML:
@@ -741,13 +741,14 @@ class Extractor(object):
         # ############### Process HTML ###############
 
         # turn into HTML, except for the content of <syntaxhighlight>
-        res = ''
+        res = []
         cur = 0
         for m in syntaxhighlight.finditer(text):
-            res += unescape(text[cur:m.start()]) + m.group(1)
+            res.append(unescape(text[cur:m.start()]))
+            res.append(m.group(1))
             cur = m.end()
-        text = res + unescape(text[cur:])
-        return text
+        res.append(unescape(text[cur:]))
+        return ''.join(res)
 
 
     def clean(self, text):
@@ -777,8 +778,7 @@ class Extractor(object):
         text = dropSpans(spans, text)
 
         # Drop discarded elements
-        for tag in options.discardElements:
-            text = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+        text = dropAllNested(text, discardedElementDelimiters(options.discardElements))
 
         if not options.toHTML:
             # Turn into text what is left (&amp;nbsp;) and <syntaxhighlight>
@@ -1294,6 +1294,22 @@ def findMatchingBraces(text, ldelim=0):
                 cur = end
 
 
+def balancedPatterns(openDelim, closeDelim):
+    """
+    :return: the pattern of the opening delimiters, and for each opening delimiter the pattern
+    of the delimiters expected after it, compiled on first use.
+    """
+    patterns = balancedPatternsCache.get((openDelim, closeDelim))
+    if patterns is None:
+        openPat = '|'.join([re.escape(x) for x in openDelim])
+        # pattern for delimiters expected after each opening delimiter
+        afterPat = {o: re.compile(openPat + '|' + c, re.DOTALL) for o, c in zip(openDelim, closeDelim)}
+        patterns = balancedPatternsCache[(openDelim, closeDelim)] = (re.compile(openPat), afterPat)
+    return patterns
+
+balancedPatternsCache = {}
+
+
 def findBalanced(text, openDelim=['[['], closeDelim=[']]']):
     """
     Assuming that text contains a properly balanced expression using
@@ -1302,15 +1318,12 @@ def findBalanced(text, openDelim=['[['], closeDelim=[']]']):
     :return: an iterator producing pairs (start, end) of start and end
     positions in text containing a balanced expression.
     """
-    openPat = '|'.join([re.escape(x) for x in openDelim])
-    # pattern for delimiters expected after each opening delimiter
-    afterPat = {o: re.compile(openPat + '|' + c, re.DOTALL) for o, c in zip(openDelim, closeDelim)}
+    startPat, afterPat = balancedPatterns(tuple(openDelim), tuple(closeDelim))
     stack = []
     start = 0
     cur = 0
     # end = len(text)
     startSet = False
-    startPat = re.compile(openPat)
     nextPat = startPat
     while True:
         next = nextPat.search(text, cur)
@@ -2034,14 +2047,68 @@ def dropNested(text, openDelim, closeDelim):
     """
     A matching function for nested expressions, e.g. namespaces and tables.
     """
-    openRE = re.compile(openDelim, re.IGNORECASE)
-    closeRE = re.compile(closeDelim, re.IGNORECASE)
+    return nestedDelimiters(((openDelim, closeDelim),)).drop(text)
+
+
+def dropAllNested(text, delimiters):
+    """
+    Same as calling dropNested(text, openDelim, closeDelim) for every pair of :param delimiters:
+    in turn.
+    """
+    return nestedDelimiters(delimiters).drop(text)
+
+
+def nestedDelimiters(delimiters):
+    """
+    :return: the NestedDelimiters for the sequence of (openDelim, closeDelim) pairs, compiled
+    on first use.
+    """
+    delimiters = tuple(delimiters)
+    engine = nestedDelimitersCache.get(delimiters)
+    if engine is None:
+        engine = nestedDelimitersCache[delimiters] = NestedDelimiters(delimiters)
+    return engine
+
+nestedDelimitersCache = {}
+
+templatesAndTables = ((r'{{', r'}}'), (r'{\|', r'\|}'))
+
+
+def discardedElementDelimiters(tags):
+    """
+    :return: the (openDelim, closeDelim) pairs of the elements dropped with their content.
+    """
+    return tuple((r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag) for tag in tags)
+
+
+class NestedDelimiters(object):
+    """
+    dropNested for a sequence of (openDelim, closeDelim) pairs, with the regexes compiled once.
+    """
+
+    def __init__(self, delimiters):
+        self.patterns = [(re.compile(openDelim, re.IGNORECASE), re.compile(closeDelim, re.IGNORECASE))
+                         for openDelim, closeDelim in delimiters]
+
+    def drop(self, text):
+        for openRE, closeRE in self.patterns:
+            spans = nestedSpans(text, openRE, closeRE)
+            if spans:
+                text = dropSpans(spans, text)
+        return text
+
+
+def nestedSpans(text, openRE, closeRE):
+    """
+    :return: the (start, end) spans of the nested expressions between the matches of
+    :param openRE: and :param closeRE: in text.
+    """
     # partition text in separate blocks { } { }
     spans = []                  # pairs (s, e) for each partition
     nest = 0                    # nesting level
     start = openRE.search(text, 0)
     if not start:
-        return text
+        return spans
     end = closeRE.search(text, start.end())
     next = start
     while end:
@@ -2079,8 +2146,7 @@ def dropNested(text, openDelim, closeDelim):
         if next != start:
             # { { }
             nest += 1
-    # collect text outside partitions
-    return dropSpans(spans, text)
+    return spans
 
 
 def dropSpans(spans, text):
@@ -2088,15 +2154,15 @@ def dropSpans(spans, text):
     Drop from text the blocks identified in :param spans:, possibly nested.
     """
     spans.sort()
-    res = ''
+    res = []
     offset = 0
     for s, e in spans:
         if offset <= s:         # handle nesting
             if offset < s:
-                res += text[offset:s]
+                res.append(text[offset:s])
             offset = e
-    res += text[offset:]
-    return res
+    res.append(text[offset:])
+    return ''.join(res)
 
 # ----------------------------------------------------------------------
 # WikiLinks
@@ -2117,7 +2183,7 @@ def replaceInternalLinks(text):
     # call this after removal of external links, so we need not worry about
     # triple closing ]]].
     cur = 0
-    res = ''
+    res = []
     for s, e in findBalanced(text):
         m = tailRE.match(text, e)
         if m:
@@ -2142,9 +2208,12 @@ def replaceInternalLinks(text):
                     pipe = last  # advance
                 curp = e1
             label = inner[pipe + 1:].strip()
-        res += text[cur:s] + makeInternalLink(title, label) + trail
+        res.append(text[cur:s])
+        res.append(makeInternalLink(title, label))
+        res.append(trail)
         cur = end
-    return res + text[cur:]
+    res.append(text[cur:])
+    return ''.join(res)
 
 
 # the official version is a method in class Parser, similar to this:
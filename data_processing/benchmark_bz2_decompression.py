@@ -0,0 +1,44 @@
+"""
+Measures the decompression throughput (MB/s of decompressed XML) of a bz2 dump file with plain
+bz2.open and with the block-parallel reader for a growing number of worker processes.
+"""
+
+import time
+import argparse
+import logging
+
+from dump_io import open_dump
+
+READ_SIZE = 1024 * 1024
+
+
+def measure(dump_file, workers, max_mb=None):
+    """Returns (decompressed bytes, seconds) for reading dump_file with the given number of workers"""
+    max_bytes = max_mb and max_mb * 1024 * 1024
+    total = 0
+    start_time = time.perf_counter()
+    with open_dump(dump_file, workers=workers) as stream:
+        while not max_bytes or total < max_bytes:
+            data = stream.read(READ_SIZE)
+            if not data:
+                break
+            total += len(data)
+    return total, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dump_file', type=str, required=True, help='the .bz2 dump file to decompress')
+    parser.add_argument('--workers', type=str, default='1,2,4,8', help='comma separated worker counts to measure [default: 1,2,4,8], 1 uses plain bz2.open')
+    parser.add_argument('--max_mb', type=int, default=None, help='if given, stops after max_mb MByte of decompressed data')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    baseline = None
+    print("{:>8} {:>12} {:>10} {:>10} {:>8}".format("workers", "MB", "seconds", "MB/s", "speedup"))
+    for workers in (int(w) for w in args.workers.split(',')):
+        total, seconds = measure(args.dump_file, workers, args.max_mb)
+        mb_per_second = total / (1024 * 1024) / seconds
+        baseline = baseline or mb_per_second
+        print("{:>8} {:>12.1f} {:>10.2f} {:>10.1f} {:>7.2f}x".format(
+            workers, total / (1024 * 1024), seconds, mb_per_second, mb_per_second / baseline))
@@ -0,0 +1,37 @@
+"""
+Compares end-to-end throughput (revisions/sec through the base generator) of different dump
+formats of the same dump range, e.g. the .bz2 and .7z history dump of one file range and its
+transcoded .zst file.
+"""
+
+import time
+import argparse
+import logging
+
+from dump_io import open_dump
+from generic_extractor import generate_revision_pairs
+
+
+def measure(dump_file, workers=None, max_mb=None):
+    """Returns (revision pairs, decompressed bytes, seconds) for running the base generator over dump_file"""
+    max_bytes = max_mb and max_mb * 1024 * 1024
+    start_time = time.perf_counter()
+    with open_dump(dump_file, workers=workers) as stream:
+        revisions = sum(1 for _ in generate_revision_pairs(stream, max_bytes=max_bytes))
+        size = stream.tell()
+    return revisions, size, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('dump_files', nargs='+', help='dump files (.bz2, .7z or .zst) of the same dump range')
+    parser.add_argument('--workers', type=int, default=None, help='decompression processes for .bz2/.zst input')
+    parser.add_argument('--max_mb', type=int, default=None, help='if given, only processes the first max_mb MByte of XML of every file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='(%(threadName)s) %(message)s')
+
+    print("{:<60} {:>10} {:>10} {:>10} {:>12}".format("file", "revisions", "MB", "seconds", "revisions/s"))
+    for dump_file in args.dump_files:
+        revisions, size, seconds = measure(dump_file, args.workers, args.max_mb)
+        print("{:<60} {:>10} {:>10.1f} {:>10.2f} {:>12.1f}".format(
+            dump_file[-60:], revisions, size / (1024 * 1024), seconds, revisions / seconds))
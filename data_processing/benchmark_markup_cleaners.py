@@ -0,0 +1,156 @@
+"""
+Benchmark of the markup cleaner backends of markup_cleaners.py: samples pages of a dump file by their
+page id (see wiki_util.samplePage), takes the latest revision of every sampled page as the article
+corpus, and runs every backend on it. Reports per backend:
+
+  throughput     MByte of wikitext cleaned per second
+  p50/p99        latency per article
+  peak           the largest memory allocated while cleaning one article (traced in a separate pass)
+  precision/recall/F1 of the output tokens against the output of the reference backend
+
+Articles a backend fails on are counted, and left out of its timings and agreement.
+"""
+
+import re
+import sys
+import html
+import time
+import logging
+import argparse
+import tracemalloc
+from collections import Counter
+
+from dump_io import open_dump
+from dump_scanner import scan_page_histories
+from wiki_util import samplePage
+from markup_cleaners import MARKUP_CLEANERS, markup_cleaner, section_cache
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def sample_articles(dump_file, sample_ratio, seed='', max_mb=None, max_articles=None):
+    """[(page_id, text of the latest revision)] of the sampled pages"""
+    def page_filter(page_title, page_ns, page_id):
+        return None if samplePage(page_id, sample_ratio, seed) else 'not sampled'
+
+    articles = []
+    with open_dump(dump_file) as stream:
+        for history in scan_page_histories(stream, max_bytes=max_mb and max_mb * 1024 * 1024, page_filter=page_filter):
+            if len(history):
+                articles.append((history.page_id, history[-1].text))
+            if max_articles and len(articles) >= max_articles:
+                break
+    return articles
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+def run_cleaner(clean, articles):
+    """(outputs, latencies in seconds), with None for the articles the cleaner failed on"""
+    outputs, latencies = [], []
+    for page_id, text in articles:
+        section_cache.start_page(page_id)
+        start_time = time.perf_counter()
+        try:
+            outputs.append(clean(text))
+            latencies.append(time.perf_counter() - start_time)
+        except Exception as e:
+            logging.debug("Cleaner failed on page {}: {}".format(page_id, e))
+            outputs.append(None)
+            latencies.append(None)
+    return outputs, latencies
+
+
+def peak_memory(clean, articles):
+    """The largest memory in bytes allocated while cleaning a single article"""
+    peak = 0
+    tracemalloc.start()
+    try:
+        for page_id, text in articles:
+            section_cache.start_page(page_id)
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            try:
+                clean(text)
+            except Exception:
+                pass
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def token_agreement(outputs, reference_outputs):
+    """Micro averaged (precision, recall, F1) of the output tokens against the reference tokens"""
+    common = produced = expected = 0
+    for output, reference in zip(outputs, reference_outputs):
+        if output is None or reference is None:
+            continue
+        tokens, reference_tokens = Counter(TOKEN_PATTERN.findall(output)), Counter(TOKEN_PATTERN.findall(reference))
+        common += sum((tokens & reference_tokens).values())
+        produced += sum(tokens.values())
+        expected += sum(reference_tokens.values())
+    precision = common / produced if produced else float('nan')
+    recall = common / expected if expected else float('nan')
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else float('nan')
+    return precision, recall, f1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dump_file', type=str, required=True)
+    parser.add_argument('--max_mb', type=int, default=None, help='MByte of XML to sample pages from')
+    parser.add_argument('--sample_ratio', type=float, default=0.1, help='share of the pages sampled')
+    parser.add_argument('--seed', type=str, default='', help='seed of the page sampling')
+    parser.add_argument('--max_articles', type=int, default=500, help='number of sampled articles to clean')
+    parser.add_argument('--cleaners', type=str, default=",".join(MARKUP_CLEANERS), help='comma separated backends to benchmark')
+    parser.add_argument('--reference', type=str, default='mwparserfromhell', help='the backend the token agreement is measured against')
+    parser.add_argument('--unescape', action='store_true', help='unescape the XML entities of the texts first (the pipeline cleans them escaped)')
+    parser.add_argument('--no_memory', action='store_true', help='skip the traced pass measuring peak memory')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    articles = sample_articles(args.dump_file, args.sample_ratio, args.seed, args.max_mb, args.max_articles)
+    if args.unescape:
+        articles = [(page_id, html.unescape(text)) for page_id, text in articles]
+    if not articles:
+        sys.exit("No articles sampled from " + args.dump_file)
+    logging.info("Sampled {} articles, {:.1f} MB of wikitext".format(
+        len(articles), sum(len(text) for _, text in articles) / 1024**2))
+
+    names = args.cleaners.split(",")
+    if args.reference not in names:
+        names.insert(0, args.reference)
+    results = {}
+    for name in names:
+        try:
+            clean = markup_cleaner(name)
+        except Exception as e:
+            logging.error("Could not load the {} markup cleaner: {}".format(name, e))
+            continue
+        section_cache.clear()
+        outputs, latencies = run_cleaner(clean, articles)
+        peak = None if args.no_memory else peak_memory(clean, articles)
+        results[name] = outputs, latencies, peak
+        logging.info("Ran {}".format(name))
+
+    reference_outputs = results.get(args.reference, (None,))[0]
+    if reference_outputs is None:
+        logging.error("The reference {} could not be run, no agreement is reported".format(args.reference))
+
+    print("{:<18} {:>8} {:>10} {:>9} {:>9} {:>9} {:>9} {:>7} {:>7}".format(
+        "cleaner", "failures", "MB/s", "p50 ms", "p99 ms", "peak MB", "precision", "recall", "F1"))
+    for name, (outputs, latencies, peak) in results.items():
+        succeeded = [(latency, len(text)) for latency, (_, text) in zip(latencies, articles) if latency is not None]
+        seconds = sum(latency for latency, _ in succeeded)
+        sorted_latencies = sorted(latency for latency, _ in succeeded)
+        agreement = token_agreement(outputs, reference_outputs) if reference_outputs else (float('nan'),) * 3
+        print("{:<18} {:>8} {:>10.2f} {:>9.2f} {:>9.2f} {:>9} {:>9.3f} {:>7.3f} {:>7.3f}".format(
+            name, len(articles) - len(succeeded),
+            sum(size for _, size in succeeded) / 1024**2 / seconds if seconds else float('nan'),
+            1000 * percentile(sorted_latencies, 0.5), 1000 * percentile(sorted_latencies, 0.99),
+            "-" if peak is None else "{:.1f}".format(peak / 1024**2), *agreement))
@@ -0,0 +1,88 @@
+"""
+Benchmark of the nested delimiter handling of clean_wiki_text: takes the revision texts at the
+beginning of a dump file and times each nested drop (templates in transform, templates and tables in
+wiki2text, discarded elements in clean) with the delimiter regexes compiled on every call, as
+dropNested did before, and with the precompiled NestedDelimiters, checking that the outputs are the
+same. It also times replaceInternalLinks and the whole clean_wiki_text, for all texts and for the
+most heavily templated ones.
+"""
+
+import re
+import time
+import argparse
+import logging
+
+from dump_io import open_dump
+from dump_scanner import scan_revision_views
+from wikitext_processing import *
+
+
+def drop_compiling(text, delimiters):
+    """The nested drops with the regexes compiled on every call"""
+    for openDelim, closeDelim in delimiters:
+        spans = nestedSpans(text, re.compile(openDelim, re.IGNORECASE), re.compile(closeDelim, re.IGNORECASE))
+        if spans:
+            text = dropSpans(spans, text)
+    return text
+
+
+def stage_inputs(texts):
+    """(name, delimiters, texts) for each nested drop, with the texts clean_wiki_text passes to it"""
+    transformed = [transform(text) for text in texts]
+    wiki_texts = [wiki2text(text) for text in transformed]
+    return [
+        ("templates", ((r'{{', r'}}'),), texts),
+        ("templates and tables", templatesAndTables, transformed),
+        ("discarded elements", discardedElementDelimiters(options.discardElements), wiki_texts),
+    ]
+
+
+def compare(name, delimiters, texts):
+    timings = []
+    outputs = []
+    for drop in (drop_compiling, dropAllNested):
+        start_time = time.perf_counter()
+        outputs.append([drop(text, delimiters) for text in texts])
+        timings.append(time.perf_counter() - start_time)
+
+    mismatches = sum(1 for expected, dropped in zip(*outputs) if expected != dropped)
+    print("  {:<22} {} of {} texts differ, compiling {:.3f}s, precompiled {:.3f}s ({:.1f}x)".format(
+        name, mismatches, len(texts), timings[0], timings[1], timings[0] / timings[1]))
+
+
+def time_calls(name, function, texts):
+    start_time = time.perf_counter()
+    for text in texts:
+        function(text)
+    print("  {:<22} {:.3f}s".format(name, time.perf_counter() - start_time))
+
+
+def template_density(text):
+    return text.count("{{") / (len(text) + 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dump_file', type=str, required=True)
+    parser.add_argument('--max_mb', type=int, default=20, help='MByte of XML to read texts from')
+    parser.add_argument('--max_texts', type=int, default=1000, help='number of revision texts to compare')
+    parser.add_argument('--templated_share', type=float, default=0.1, help='share of the texts with the most templates per character reported separately')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='(%(threadName)s) %(message)s')
+
+    texts = []
+    with open_dump(args.dump_file) as stream:
+        for view in scan_revision_views(stream, max_bytes=args.max_mb * 1024 * 1024):
+            texts.append(view.text)
+            if len(texts) >= args.max_texts:
+                break
+    templated = sorted(texts, key=template_density, reverse=True)[:max(1, int(len(texts) * args.templated_share))]
+
+    for title, selection in (("all texts", texts), ("most templated texts", templated)):
+        print("{}: {} texts, {:.1f} MB, {:.1f} templates per KB".format(
+            title, len(selection), sum(map(len, selection)) / 1024**2,
+            1024 * sum(text.count("{{") for text in selection) / sum(map(len, selection))))
+        for name, delimiters, stage_texts in stage_inputs(selection):
+            compare(name, delimiters, stage_texts)
+        time_calls("replaceInternalLinks", replaceInternalLinks, selection)
+        time_calls("clean_wiki_text", clean_wiki_text, selection)
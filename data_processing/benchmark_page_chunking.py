@@ -0,0 +1,79 @@
+"""
+Measures how much intra-page chunking (page_parallel.map_pages with chunk_revisions) speeds up the
+processing of a single giant page, on a synthetic page with 50k revisions that each edit one line
+of the article.
+"""
+
+import io
+import time
+import random
+import hashlib
+import argparse
+import logging
+from xml.sax.saxutils import escape
+
+from wiki_util import split_page_histories
+from custom_filters import comment_length
+from generic_extractor import compute_diff
+from page_parallel import map_pages, page_processor
+from profiling import Profiled
+
+
+def synthetic_page(revisions, lines=50, seed=0):
+    """XML of a dump with a single page of the given number of revisions"""
+    rng = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta", "iota", "kappa"]
+    article = [" ".join(rng.choice(words) for _ in range(12)) for _ in range(lines)]
+
+    parts = ["<mediawiki>\n  <page>\n    <title>Synthetic</title>\n    <ns>0</ns>\n    <id>1</id>\n"]
+    for rev_id in range(1, revisions + 1):
+        article[rng.randrange(lines)] = " ".join(rng.choice(words) for _ in range(12))
+        text = "\n".join(article)
+        parts.append(
+            "    <revision>\n      <id>{}</id>\n      <parentid>{}</parentid>\n"
+            "      <timestamp>2020-01-01T00:00:00Z</timestamp>\n"
+            "      <contributor>\n        <username>Editor</username>\n        <id>1</id>\n      </contributor>\n"
+            "      <comment>edit number {}</comment>\n"
+            "      <text xml:space=\"preserve\">{}</text>\n      <sha1>{}</sha1>\n    </revision>\n".format(
+                rev_id, rev_id - 1, rev_id, escape(text), hashlib.sha1(text.encode('utf-8')).hexdigest()))
+    parts.append("  </page>\n</mediawiki>\n")
+    return "".join(parts).encode('utf-8')
+
+
+@Profiled.generator
+def split_tokens(instance):
+    instance['src_tokens'] = instance['src_text'].split()
+    instance['tgt_tokens'] = instance['tgt_text'].split()
+    yield instance
+
+
+def run(dump, processors, workers, chunk_revisions):
+    """Returns (number of results, seconds) for processing the dump with map_pages"""
+    start_time = time.perf_counter()
+    histories = split_page_histories(io.BytesIO(dump))
+    results = map_pages(page_processor(processors, duplicates='drop'), histories, workers,
+        chunk_revisions=chunk_revisions, with_sha1s=True)
+    count = sum(len(instances) for _, _, instances in results)
+    return count, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--revisions', type=int, default=50000, help='number of revisions of the synthetic page')
+    parser.add_argument('--workers', type=str, default='1,2,4,8', help='comma separated worker counts to measure')
+    parser.add_argument('--chunk-revisions', type=int, default=1000, help='revisions per chunk')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='(%(threadName)s) %(message)s')
+
+    dump = synthetic_page(args.revisions)
+    processors = [comment_length(5, 200), split_tokens, compute_diff]
+    print("synthetic page: {} revisions, {:.1f} MB".format(args.revisions, len(dump) / (1024 * 1024)))
+
+    count, baseline = run(dump, processors, 1, None)
+    print("{:>8} {:>10} {:>10} {:>8}".format("workers", "results", "seconds", "speedup"))
+    print("{:>8} {:>10} {:>10.2f} {:>7.2f}x".format("1 page", count, baseline, 1.0))
+    for workers in (int(w) for w in args.workers.split(',')):
+        chunked_count, seconds = run(dump, processors, workers, args.chunk_revisions)
+        if chunked_count != count:
+            logging.error("chunked processing produced {} instead of {} results".format(chunked_count, count))
+        print("{:>8} {:>10} {:>10.2f} {:>7.2f}x".format(workers, chunked_count, seconds, baseline / seconds))
@@ -0,0 +1,277 @@
+"""
+Random access to the blocks of a bz2 file.
+
+A bz2 stream is a sequence of independently compressed blocks, each starting with the 48-bit
+magic 0x314159265359 (and the stream ending with 0x177245385090) at an arbitrary *bit* offset.
+A single block can be decompressed on its own by wrapping its bits into a new one-block stream:
+'BZh' + level, the block, the end-of-stream magic and a combined CRC, which for a single block
+equals the block CRC stored right after the block magic.
+"""
+
+import os
+import bz2
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+CRC_BITS = 32
+
+BLOCK = 'block'
+EOS = 'eos'
+
+DEFAULT_SCAN_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _shifted_patterns(magic, kind):
+    """
+    For every bit shift 0..7, the byte pattern to search for and the masks verifying the partial
+    first and last bytes: the magic starting `shift` bits into a byte spans 7 bytes, of which only
+    bytes 1..5 are fully determined.
+    """
+    patterns = []
+    for shift in range(8):
+        if shift == 0:
+            key = magic.to_bytes(6, 'big')
+            patterns.append((shift, kind, key, 0, None))
+            continue
+
+        window = (magic << (8 - shift)).to_bytes(7, 'big')
+        head_mask = 0xFF >> shift
+        tail_mask = (0xFF << (8 - shift)) & 0xFF
+        check = (window[0] & head_mask, head_mask, window[6] & tail_mask, tail_mask)
+        patterns.append((shift, kind, window[1:6], 1, check))
+    return patterns
+
+_PATTERNS = _shifted_patterns(BLOCK_MAGIC, BLOCK) + _shifted_patterns(EOS_MAGIC, EOS)
+
+
+def find_markers(data, start=0):
+    """
+    Returns the sorted (bit_offset, kind) of all block and end-of-stream magics that lie
+    completely within data and start at or after byte `start`.
+    """
+    markers = []
+    for shift, kind, key, lead, check in _PATTERNS:
+        idx = data.find(key, start + lead)
+        while idx != -1:
+            window_start = idx - lead
+            if check is None:
+                markers.append((window_start * 8, kind))
+            elif window_start >= start and idx + 5 < len(data):
+                head, head_mask, tail, tail_mask = check
+                if data[window_start] & head_mask == head and data[idx + 5] & tail_mask == tail:
+                    markers.append((window_start * 8 + shift, kind))
+            idx = data.find(key, idx + 1)
+    markers.sort()
+    return markers
+
+
+def read_level(fileobj):
+    """Block size level ('1'..'9') from the bz2 stream header"""
+    fileobj.seek(0)
+    header = fileobj.read(4)
+    if len(header) < 4 or header[:3] != b'BZh':
+        raise ValueError("Not a bz2 file")
+    return header[3:4]
+
+
+def iter_block_ranges(fileobj, chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+    """
+    Scans a bz2 file for block boundaries. Yields (start_bit, end_bit, data, data_bit_offset, kind)
+    for the ranges between consecutive magics, where data holds the bytes covering the range and
+    starts at absolute bit data_bit_offset, and kind is that of the magic starting it. Works for
+    multistream files as well, since blocks end at the next block or end-of-stream magic. The
+    ranges are contiguous: a magic occurring by chance inside compressed data, of either kind,
+    shows up as a block that fails to decompress and is merged with the following ranges, see
+    iter_blocks. A range starting at a real end-of-stream magic holds the stream trailer and the
+    header of the next stream only.
+    """
+    fileobj.seek(0)
+    buffer = bytearray()
+    buffer_start = 0          # absolute byte offset of buffer[0]
+    scan_from = 0             # buffer index from which markers have not been searched yet
+    block_start = None        # absolute bit offset of the current range
+    block_kind = None         # kind of the magic starting it
+    last_marker = -1
+
+    while True:
+        chunk = fileobj.read(chunk_size)
+        buffer += chunk
+
+        for bit_offset, kind in find_markers(buffer, scan_from):
+            marker = buffer_start * 8 + bit_offset
+            if marker <= last_marker:
+                continue
+            last_marker = marker
+
+            if block_start is not None:
+                first_byte = block_start // 8 - buffer_start
+                last_byte = (marker + 7) // 8 - buffer_start
+                yield block_start, marker, bytes(buffer[first_byte:last_byte]), (buffer_start + first_byte) * 8, block_kind
+            block_start, block_kind = marker, kind
+
+        if not chunk:
+            return
+
+        # keep the current block and the last bytes that may hold the start of a magic
+        keep_from = len(buffer) - 7
+        if block_start is not None:
+            keep_from = min(keep_from, block_start // 8 - buffer_start)
+        keep_from = max(0, keep_from)
+        del buffer[:keep_from]
+        buffer_start += keep_from
+        scan_from = max(0, len(buffer) - 7 - 6)
+
+
+def decompress_block(data, start_bit, end_bit, level=b'9'):
+    """Decompresses the block occupying bits [start_bit, end_bit) of data"""
+    first_byte = start_bit // 8
+    last_byte = (end_bit + 7) // 8
+    bits = int.from_bytes(data[first_byte:last_byte], 'big')
+    trailing = last_byte * 8 - end_bit
+    n_bits = end_bit - start_bit
+    bits = (bits >> trailing) & ((1 << n_bits) - 1)
+
+    block_crc = (bits >> (n_bits - MAGIC_BITS - CRC_BITS)) & 0xFFFFFFFF
+    bits = (((bits << MAGIC_BITS) | EOS_MAGIC) << CRC_BITS) | block_crc
+    n_bits += MAGIC_BITS + CRC_BITS
+    padding = -n_bits % 8
+    stream = b'BZh' + level + (bits << padding).to_bytes((n_bits + padding) // 8, 'big')
+    return bz2.decompress(stream)
+
+
+def try_decompress_block(data, start_bit, end_bit, level=b'9'):
+    """Like decompress_block, but returns None for a range that is not a complete block"""
+    try:
+        return decompress_block(data, start_bit, end_bit, level)
+    except (OSError, ValueError, EOFError):
+        return None
+
+
+def iter_blocks(fileobj, chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+    """
+    Yields (start_bit, end_bit, decompressed_data) for every block of a bz2 file, in order.
+    Candidate ranges that don't decompress (a spurious magic inside compressed data) are merged
+    with the following range.
+    """
+    level = read_level(fileobj)
+    pending = None
+    for start_bit, end_bit, data, data_bit_offset, kind in iter_block_ranges(fileobj, chunk_size):
+        if pending is None and kind == EOS:
+            # the trailer of a stream whose blocks all decompressed, and the header of the next one
+            continue
+        if pending is not None:
+            # extend the previous, incomplete range up to the end of this one (they may share a byte)
+            pending_start, pending_data, pending_offset = pending
+            pending_end = pending_offset // 8 + len(pending_data)
+            data = pending_data + data[pending_end - data_bit_offset // 8:]
+            start_bit, data_bit_offset = pending_start, pending_offset
+
+        decompressed = try_decompress_block(data, start_bit - data_bit_offset, end_bit - data_bit_offset, level)
+        if decompressed is None:
+            pending = (start_bit, data, data_bit_offset)
+            continue
+
+        pending = None
+        yield start_bit, end_bit, decompressed
+
+    if pending is not None:
+        raise OSError("bz2 block at bit {} could not be decompressed".format(pending[0]))
+
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """
+    Read-only, forward-only stream of the decompressed contents of a bz2 file. Block boundaries are
+    located in this process, the blocks themselves are decompressed by a pool of worker processes
+    and handed out in order, as one continuous byte stream.
+    """
+    def __init__(self, filename, workers=None, prefetch=None, chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+        self.fileobj = open(filename, "rb")
+        self.level = read_level(self.fileobj)
+        workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.prefetch = prefetch or 4 * workers
+        self.ranges = iter_block_ranges(self.fileobj, chunk_size)
+        self.pending = deque()  # (range, future) in file order
+        self.current = b''
+        self.current_pos = 0
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def _submit(self):
+        while len(self.pending) < self.prefetch:
+            block_range = next(self.ranges, None)
+            if block_range is None:
+                return
+            start_bit, end_bit, data, data_bit_offset, kind = block_range
+            # ranges after an end-of-stream magic are only decompressed if merged with a failed block
+            future = None if kind == EOS else self.executor.submit(try_decompress_block, data,
+                start_bit - data_bit_offset, end_bit - data_bit_offset, self.level)
+            self.pending.append((block_range, future))
+
+    def _next_block(self):
+        while True:
+            self._submit()
+            if not self.pending:
+                return None
+            (start_bit, end_bit, data, data_bit_offset, _), future = self.pending.popleft()
+            if future is not None:
+                break
+
+        decompressed = future.result()
+        while decompressed is None:
+            # spurious magic: merge with the following range and decompress here
+            self._submit()
+            if not self.pending:
+                raise OSError("bz2 block at bit {} could not be decompressed".format(start_bit))
+            (_, end_bit, next_data, next_offset, _), next_future = self.pending.popleft()
+            if next_future is not None:
+                next_future.cancel()
+            data_end = data_bit_offset // 8 + len(data)
+            data = data + next_data[data_end - next_offset // 8:]
+            decompressed = try_decompress_block(data, start_bit - data_bit_offset, end_bit - data_bit_offset, self.level)
+        return decompressed
+
+    def read(self, size=-1):
+        while self.current_pos >= len(self.current):
+            block = self._next_block()
+            if block is None:
+                return b''
+            self.current, self.current_pos = block, 0
+
+        end = len(self.current) if size is None or size < 0 else self.current_pos + size
+        data = self.current[self.current_pos:end]
+        self.current_pos += len(data)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Only forward seeks are supported, by decompressing and discarding (e.g. to resume from a checkpoint)"""
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET or offset < self.position:
+            raise io.UnsupportedOperation("ParallelBZ2Reader can only seek forward")
+        while self.position < offset:
+            if not self.read(min(offset - self.position, DEFAULT_SCAN_CHUNK_SIZE)):
+                break
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            for _, future in self.pending:
+                if future is not None:
+                    future.cancel()
+            self.executor.shutdown(wait=True)
+            self.fileobj.close()
+        super().close()
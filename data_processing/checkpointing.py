@@ -0,0 +1,90 @@
+"""
+Periodic checkpoints for long running dump processing jobs, so that a killed job can be resumed
+"""
+
+import os
+import io
+import json
+import time
+import logging
+
+
+def load_checkpoint(checkpoint_file):
+    """Returns the last checkpoint written to checkpoint_file, or None if there is none"""
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, "r", encoding='utf-8') as f:
+        return json.load(f)
+
+
+def stream_position(stream):
+    """Current position of stream, or None if it can't tell"""
+    try:
+        return stream.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+class Checkpointer:
+    """
+    Records, at page boundaries and at most every interval_seconds, the last fully emitted page id,
+    the byte length of the output file and the input position of the next page: the uncompressed
+    offset (used to resume) and the compressed offset of the underlying file (for information).
+
+    page_boundary is called by the dump scanner right before it starts a new page. Since the
+    processor chain is pulled one instance at a time, all output of the earlier pages has been
+    written at that point, and the page watermarks recorded so far (see watermarks.py) are flushed.
+    """
+    def __init__(self, checkpoint_file, output_stream, compressed_stream=None, interval_seconds=60, watermarks=None):
+        self.checkpoint_file = checkpoint_file
+        self.output_stream = output_stream
+        self.compressed_stream = compressed_stream
+        self.watermarks = watermarks
+        self.interval_seconds = interval_seconds
+        self.last_write = time.time()
+        self.last_page_id = None
+
+    def page_boundary(self, page_offset, page_id):
+        if time.time() - self.last_write >= self.interval_seconds:
+            self.write(page_offset)
+        self.last_page_id = page_id
+
+    def write(self, page_offset, done=False):
+        self.output_stream.flush()
+        if self.watermarks is not None:
+            self.watermarks.flush()
+        checkpoint = {
+            "last_page_id": self.last_page_id,
+            "output_bytes": self.output_stream.tell(),
+            "page_offset": page_offset,
+            "compressed_offset": stream_position(self.compressed_stream) if self.compressed_stream else None,
+            "done": done
+        }
+
+        # write atomically, a job killed while checkpointing keeps the previous checkpoint
+        temp_file = self.checkpoint_file + ".tmp"
+        with open(temp_file, "w", encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_file, self.checkpoint_file)
+        self.last_write = time.time()
+        logging.debug("Checkpoint: {}".format(checkpoint))
+
+    def finish(self):
+        self.write(None, done=True)
+
+
+def resume_from_checkpoint(checkpoint, input_stream, output_file):
+    """
+    Truncates output_file to the last consistent record of checkpoint and positions input_stream
+    (a seekable decompressed stream, e.g. bz2.open(..., 'rb')) at the first page not yet emitted.
+    Seeking forward in a bz2 stream decompresses without scanning, so it is much faster than
+    reprocessing. Returns the output stream, opened for appending.
+    """
+    with open(output_file, "r+b") as f:
+        f.truncate(checkpoint["output_bytes"])
+
+    if checkpoint["page_offset"]:
+        input_stream.seek(checkpoint["page_offset"])
+    logging.info("Resuming after page {} at input offset {}, output truncated to {} bytes".format(
+        checkpoint["last_page_id"], checkpoint["page_offset"], checkpoint["output_bytes"]))
+    return open(output_file, "a", buffering=1, encoding='utf-8')
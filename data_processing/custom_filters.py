@@ -4,6 +4,7 @@ Contains self-contained isolated filters/processors implemented as python genera
 
 import logging, re
 from profiling import Profiled
+from revision_memo import revision_memo
 
 def page_id_filter(accepted_ids):
     def generate(meta):
@@ -14,29 +15,103 @@ def page_id_filter(accepted_ids):
 def has_comment(meta):
     if meta["comment_text"]: yield meta
 
+def pushdown(level, predicate):
+    """
+    Marks a metadata-only filter whose predicate can be evaluated by the dump scanner, either on the
+    page header (level 'page': page_title, page_ns, page_id) or on the revision header (level
+    'revision': additionally rev_id, parent_id, timestamp, comment_text, section_title, username, userip)
+    """
+    def decorate(filter_func):
+        filter_func.pushdown = (level, predicate)
+        return filter_func
+    return decorate
+
+def prefilter(predicate):
+    """
+    Declares an admissible pre-filter for an expensive filter: a cheap predicate on the instance as it
+    comes out of the base generator (see raw_field), that returns False only for instances the filter
+    is certain to reject later on. generic_extractor.insert_prefilters runs these right after the base
+    generator, so rejected pairs are never decoded, cleaned or tokenized.
+    """
+    def decorate(filter_func):
+        filter_func.prefilter = predicate
+        return filter_func
+    return decorate
+
+def raw_field(instance, key):
+    """A text field as generated, without decoding it: a RevisionView (or a str, e.g. a cached parent text)"""
+    return dict.get(instance, key)
+
+def raw_contains(text, pattern):
+    """Whether the raw text contains the bytes pattern"""
+    if text is None:
+        return False
+    if isinstance(text, str):
+        return pattern.decode('utf-8') in text
+    start, end = text.text_span
+    return text.buffer.find(pattern, start, end) != -1
+
+def raw_nonspace_length(text):
+    """
+    Upper bound of the number of non-whitespace characters of the text. Cleaning only removes characters
+    and every token holds at least one, so this also bounds the number of tokens of the cleaned text.
+    """
+    if text is None:
+        return 0
+    if isinstance(text, str):
+        return len(text) - sum(text.count(c) for c in " \n\t\r")
+    start, end = text.text_span
+    return end - start - sum(text.buffer.count(c, start, end) for c in (b" ", b"\n", b"\t", b"\r"))
+
+def raw_texts_differ(src_text, tgt_text):
+    """Whether two raw texts differ. Identical texts can't have a diff, however they are cleaned"""
+    if src_text is None or tgt_text is None:
+        return src_text is not tgt_text
+    if isinstance(src_text, str) or isinstance(tgt_text, str):
+        return str(src_text if isinstance(src_text, str) else src_text.text) != \
+            str(tgt_text if isinstance(tgt_text, str) else tgt_text.text)
+    if src_text.text_bytes != tgt_text.text_bytes:
+        return True
+    if src_text.sha1 and tgt_text.sha1:
+        return src_text.sha1 != tgt_text.sha1
+    with src_text.raw_text as src_raw, tgt_text.raw_text as tgt_raw:
+        return src_raw != tgt_raw
+
 def comment_length(min_len, max_len):
+    def accept(meta):
+        clen = len(meta["comment_text"])
+        return clen >= min_len and clen < max_len
+
+    @pushdown('revision', accept)
     @Profiled.generator
     def comment_length(meta):
-        clen = len(meta["comment_text"])
-        if clen >= min_len and clen < max_len:
+        if accept(meta):
             yield meta
     return comment_length
 
 def comment_token_length(min_len, max_len):
-    @Profiled.generator
-    def comment_token_length(meta):
+    def accept(meta):
         approx_tokens = meta["comment_text"].split(" ")
         clen = len(approx_tokens)
-        if clen >= min_len and clen < max_len:
+        return clen >= min_len and clen < max_len
+
+    @pushdown('revision', accept)
+    @Profiled.generator
+    def comment_token_length(meta):
+        if accept(meta):
             yield meta
     return comment_token_length
 
 
 def comment_blocklist_filter(exclude_words = ["[[Project:AWB|AWB]]", "[[Project:AutoWikiBrowser|AWB]]", "Undid revision"]):
+    def accept(meta):
+        comment = meta["comment_text"]
+        return not any(word in comment for word in exclude_words)
+
+    @pushdown('revision', accept)
     @Profiled.generator
     def comment_blocklist_filter(meta):
-        comment = meta["comment_text"]
-        if not any(word in comment for word in exclude_words):
+        if accept(meta):
             yield meta
     return comment_blocklist_filter
 
@@ -45,8 +120,8 @@ def clean_newlines(instance):
     def clean(text):
         return re.sub(r"[\r\n]+", "\n\n", text).strip().strip('\n')
 
-    instance["src_text"] = clean(instance["src_text"])
-    instance["tgt_text"] = clean(instance["tgt_text"])
+    instance["src_text"], instance["tgt_text"] = revision_memo.process_pair(
+        "clean_newlines", clean, instance["src_text"], instance["tgt_text"])
     yield instance
 
 def text_length(min_len, max_len):
@@ -59,13 +134,18 @@ def text_length(min_len, max_len):
     return text_length
 
 def exclude_page_types(excludes_prefixes = ["Talk:"]):
+    def accept(meta):
+        has_any_prefix = any(prefix in meta["page_title"] for prefix in excludes_prefixes)
+        return not has_any_prefix
+
+    @pushdown('page', accept)
     @Profiled.generator
     def exclude_page_types(meta):
-        has_any_prefix = any(prefix in meta["page_title"] for prefix in excludes_prefixes)
-        if not has_any_prefix:
+        if accept(meta):
             yield meta
     return exclude_page_types
 
+@pushdown('revision', lambda meta: bool(meta['section_title']))
 @Profiled.generator
 def has_section_title(instance):
     if instance['section_title']:
@@ -93,6 +173,12 @@ def canonize_grounding():
 def has_urls_in_text(look_in_src = True, look_in_tgt = True):
     """Filters instances to contain at least one url and extracts a preliminary 'grounding_urls' field"""
 
+    def may_have_urls(instance):
+        # clean_urls finds the urls with https?://
+        return (look_in_src and raw_contains(raw_field(instance, "src_text"), b"http")) or \
+            (look_in_tgt and raw_contains(raw_field(instance, "tgt_text"), b"http"))
+
+    @prefilter(may_have_urls)
     @Profiled.generator
     def has_urls_in_text(instance):
         url_set = set()
@@ -111,6 +197,12 @@ def has_urls_in_text(look_in_src = True, look_in_tgt = True):
 def has_grounding():
     """Filters instances that have a grounding_url set at this stage"""
 
+    def may_have_urls(instance):
+        # grounding urls are urls found in the source or target text
+        return raw_contains(raw_field(instance, "src_text"), b"http") or \
+            raw_contains(raw_field(instance, "tgt_text"), b"http")
+
+    @prefilter(may_have_urls)
     @Profiled.generator
     def has_grounding(instance):
         if instance.get("grounding_urls"):
@@ -139,8 +231,10 @@ def restrict_grounding_to_max_distance(max_token_distance, url_replacement_str =
             src_urls_with_dist = [(url_index, t_dist(token_index, src_edit_indices)) for url_index, token_index in enumerate(src_indices)]
             tgt_urls_with_dist = [(url_index, t_dist(token_index, tgt_edit_indices)) for url_index, token_index in enumerate(tgt_indices)]
 
-            tgt_url_respecting_dist = [instance["tgt_urls"][url_index] for url_index, token_dist in tgt_urls_with_dist if token_dist < max_token_distance]
-            src_url_respecting_dist = [instance["src_urls"][url_index] for url_index, token_dist in src_urls_with_dist if token_dist < max_token_distance]
+            # URLs before the edit window (see restrict_to_edit_window) have no token
+            tgt_offset, src_offset = instance.get("tgt_url_offset", 0), instance.get("src_url_offset", 0)
+            tgt_url_respecting_dist = [instance["tgt_urls"][tgt_offset + url_index] for url_index, token_dist in tgt_urls_with_dist if token_dist < max_token_distance]
+            src_url_respecting_dist = [instance["src_urls"][src_offset + url_index] for url_index, token_dist in src_urls_with_dist if token_dist < max_token_distance]
 
             grounding_set = set(tgt_url_respecting_dist).union(set(src_url_respecting_dist))
             instance["grounding_urls"] = list(grounding_set)
@@ -154,12 +248,13 @@ def clean_urls(replacement='URL'):
     """Replaces URLs in the text with replacement string, and keeps list of URLs seperately from text"""
     url_regex = re.compile(r"https?://[^\s|\]]+", flags=re.MULTILINE)
 
+    def clean(text):
+        return url_regex.findall(text), url_regex.sub(replacement, text)
+
     @Profiled.generator
     def clean_urls(instance):
-        instance["src_urls"] = url_regex.findall(instance["src_text"])
-        instance["tgt_urls"] = url_regex.findall(instance["tgt_text"])
-        instance["src_text"] = url_regex.sub(replacement, instance["src_text"])
-        instance["tgt_text"] = url_regex.sub(replacement, instance["tgt_text"])
+        (instance["src_urls"], instance["src_text"]), (instance["tgt_urls"], instance["tgt_text"]) = \
+            revision_memo.process_pair(("clean_urls", replacement), clean, instance["src_text"], instance["tgt_text"])
         yield instance
 
     return clean_urls
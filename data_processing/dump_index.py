@@ -0,0 +1,165 @@
+"""
+Page index over the original .bz2 history dump files, for random page access without decompressing
+the whole file. Unlike wikihelpers.WikiXmlIndex (uncompressed XML, one pickled object per page), the
+index stores the bit offset of every bz2 block and the page ids with their uncompressed offsets in
+flat arrays, and get_page only decompresses the blocks a page spans.
+"""
+
+import os
+import sys
+import struct
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+
+from bz2_blocks import iter_blocks, read_level, decompress_block
+from dump_scanner import PAGE_START, PAGE_END, decode_field
+
+INDEX_MAGIC = b'BZ2PIDX1'
+_HEADER = struct.Struct('<8sc3xQQ')
+
+
+def _write_array(f, values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def _read_array(f, count):
+    values = array('Q')
+    values.fromfile(f, count)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def index_pages_in_blocks(blocks):
+    """
+    Given (start_bit, end_bit, data) blocks, returns the block arrays and the (page_id, offset)
+    of every <page>, where offset is the uncompressed offset of the page start.
+    """
+    block_start_bits, block_end_bits, block_offsets = array('Q'), array('Q'), array('Q')
+    pages = []
+
+    offset = 0                # uncompressed offset of the current block
+    carry = b''               # unscanned tail of the previous blocks (an unresolved page header)
+    for start_bit, end_bit, data in blocks:
+        block_start_bits.append(start_bit)
+        block_end_bits.append(end_bit)
+        block_offsets.append(offset)
+
+        combined = carry + data
+        combined_offset = offset - len(carry)
+        pos = 0
+        while True:
+            page_start = combined.find(PAGE_START, pos)
+            if page_start == -1:
+                # keep a tail that could be the start of <page>
+                pos = max(pos, len(combined) - len(PAGE_START) + 1)
+                break
+            id_end = combined.find(b"</id>", page_start)
+            if id_end == -1:
+                # page header continues in the next block
+                pos = page_start
+                break
+            page_id = decode_field(combined, b"<id>", b"</id>", page_start, id_end + len(b"</id>"))
+            pages.append((int(page_id), combined_offset + page_start))
+            pos = id_end
+
+        carry = combined[pos:]
+        offset += len(data)
+
+    return block_start_bits, block_end_bits, block_offsets, pages
+
+
+class Bz2PageIndex:
+    """Maps page ids to the bz2 blocks of a (history) dump file they are stored in"""
+
+    def __init__(self, dump_file, index_file=None):
+        self.dump_file = dump_file
+        self.index_file = index_file or dump_file + ".pageindex"
+        self.bytes_decompressed = 0
+        self._cached_block = (None, None)
+        if os.path.exists(self.index_file):
+            self.load()
+        else:
+            logging.info("Did not find index file for {} in {}, creating index..".format(dump_file, self.index_file))
+            self.build()
+            self.save()
+
+    def build(self):
+        with open(self.dump_file, "rb") as f:
+            self.level = read_level(f)
+            self.block_start_bits, self.block_end_bits, self.block_offsets, pages = \
+                index_pages_in_blocks(iter_blocks(f))
+        pages.sort()
+        self.page_ids = array('Q', (page_id for page_id, _ in pages))
+        self.page_offsets = array('Q', (page_offset for _, page_offset in pages))
+
+    def save(self):
+        with open(self.index_file, "wb") as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, self.level, len(self.block_offsets), len(self.page_ids)))
+            for values in (self.block_start_bits, self.block_end_bits, self.block_offsets, self.page_ids, self.page_offsets):
+                _write_array(f, values)
+
+    def load(self):
+        with open(self.index_file, "rb") as f:
+            magic, self.level, n_blocks, n_pages = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError("{} is not a bz2 page index".format(self.index_file))
+            self.block_start_bits = _read_array(f, n_blocks)
+            self.block_end_bits = _read_array(f, n_blocks)
+            self.block_offsets = _read_array(f, n_blocks)
+            self.page_ids = _read_array(f, n_pages)
+            self.page_offsets = _read_array(f, n_pages)
+
+    def get_ids(self):
+        return self.page_ids
+
+    def __contains__(self, page_id):
+        idx = bisect_left(self.page_ids, int(page_id))
+        return idx < len(self.page_ids) and self.page_ids[idx] == int(page_id)
+
+    def page_offset(self, page_id):
+        """Uncompressed offset of the page's <page> tag"""
+        page_id = int(page_id)
+        idx = bisect_left(self.page_ids, page_id)
+        if idx == len(self.page_ids) or self.page_ids[idx] != page_id:
+            raise KeyError(page_id)
+        return self.page_offsets[idx]
+
+    def block_of(self, offset):
+        """Index of the block containing the uncompressed offset"""
+        return bisect_right(self.block_offsets, offset) - 1
+
+    def read_block(self, f, block):
+        """Decompresses a block, the last one is kept, so pages fetched in file order share their blocks"""
+        cached_block, cached_data = self._cached_block
+        if cached_block == block:
+            return cached_data
+        start_bit, end_bit = self.block_start_bits[block], self.block_end_bits[block]
+        first_byte = start_bit // 8
+        f.seek(first_byte)
+        data = f.read((end_bit + 7) // 8 - first_byte)
+        data = decompress_block(data, start_bit - first_byte * 8, end_bit - first_byte * 8, self.level)
+        self.bytes_decompressed += len(data)
+        self._cached_block = (block, data)
+        return data
+
+    def get_page(self, page_id):
+        """Returns the raw bytes of <page> ... </page>, decompressing only the blocks the page spans"""
+        offset = self.page_offset(page_id)
+        block = self.block_of(offset)
+        with open(self.dump_file, "rb") as f:
+            data = bytearray(self.read_block(f, block)[offset - self.block_offsets[block]:])
+            search_from = 0
+            while True:
+                page_end = data.find(PAGE_END, search_from)
+                if page_end != -1:
+                    return bytes(data[:page_end + len(PAGE_END)])
+                block += 1
+                if block >= len(self.block_offsets):
+                    raise EOFError("Page {} is truncated in {}".format(page_id, self.dump_file))
+                search_from = max(0, len(data) - len(PAGE_END) + 1)
+                data += self.read_block(f, block)
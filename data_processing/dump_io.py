@@ -0,0 +1,39 @@
+"""
+Opening of (compressed) dump files as a binary stream of the decompressed XML, as consumed by
+the dump scanner (wiki_util.split_records / split_revision_views / split_pages)
+"""
+
+import os
+import bz2
+import logging
+
+from bz2_blocks import ParallelBZ2Reader
+from zstd_dump import ZstdDumpReader, transcoded_file
+from sevenzip_stream import SevenZipStream
+
+
+def open_dump(dump_file, workers=None):
+    """
+    Opens dump_file for reading decompressed bytes. Transcoded .zst files (see
+    wiki_dump_transcode.py) are read through their frame index, .7z files are streamed from the
+    7z command line tool. For .bz2 files with workers > 1, the bz2 blocks are decompressed in
+    parallel by that many processes (see bz2_blocks.ParallelBZ2Reader). The .7z and parallel bz2
+    streams only support forward seeks.
+    """
+    if dump_file.endswith('.zst'):
+        return ZstdDumpReader(dump_file, workers=workers)
+    if dump_file.endswith('.7z'):
+        return SevenZipStream(dump_file)
+    if workers and workers > 1:
+        logging.debug("Decompressing {} with {} worker processes".format(dump_file, workers))
+        return ParallelBZ2Reader(dump_file, workers=workers)
+    return bz2.open(dump_file, "rb")
+
+
+def prefer_transcoded(dump_file):
+    """Returns the transcoded .zst file of dump_file if it exists, dump_file otherwise"""
+    zstd_file = transcoded_file(dump_file)
+    if zstd_file != dump_file and os.path.exists(zstd_file):
+        logging.info("Using transcoded dump file " + zstd_file)
+        return zstd_file
+    return dump_file
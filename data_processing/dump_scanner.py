@@ -0,0 +1,833 @@
+"""
+Byte-level scanner over decompressed MediaWiki XML dump streams.
+
+The scanner keeps a single bytearray buffer, locates <page>, <revision> and </revision>
+by byte search and only decodes the (small) fields that are actually used. Consumed input
+is dropped from the front of the buffer, which bytearray does without moving the remainder.
+"""
+
+import os
+import re
+import bz2
+import io
+import logging
+
+PAGE_START = b"<page>"
+PAGE_END = b"</page>"
+REVISION_START = b"<revision>"
+REVISION_END = b"</revision>"
+
+DEFAULT_CHUNK_SIZE = 150 * 1024
+
+_TEXT_BYTES = re.compile(rb'\sbytes="(\d+)"')
+
+
+def extract_bytes_with_delims(buffer, start_delim, end_delim, start_idx=0, end_idx=None):
+    """Byte version of wiki_util.extract_with_delims. Returns (start, end) offsets of the content or None"""
+    end_idx = len(buffer) if end_idx is None else end_idx
+    delims_start = buffer.find(start_delim, start_idx, end_idx)
+    if delims_start == -1:
+        return None
+
+    delims_start += len(start_delim)
+    delims_end = buffer.find(end_delim, delims_start, end_idx)
+    if delims_end == -1:
+        return None
+
+    return delims_start, delims_end
+
+
+def decode_field(buffer, start_delim, end_delim, start_idx=0, end_idx=None):
+    span = extract_bytes_with_delims(buffer, start_delim, end_delim, start_idx, end_idx)
+    if span is None:
+        return ''
+    return str(memoryview(buffer)[span[0]:span[1]], 'utf-8')
+
+
+class _EncodingReader(io.RawIOBase):
+    """Adapts a text stream (e.g. io.StringIO) to a byte stream"""
+    def __init__(self, text_stream):
+        self.text_stream = text_stream
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self.text_stream.read(size).encode('utf-8')
+
+
+class AzureBlobStream(io.RawIOBase):
+    """Streams a bz2 compressed azure blob as decompressed bytes"""
+    def __init__(self, blob_client, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.blob_client = blob_client
+        self.chunk_size = chunk_size
+        self.blob_size = blob_client.get_blob_properties()['size']
+        self.cur_offset = 0
+        self.decompressor = bz2.BZ2Decompressor()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while self.cur_offset < self.blob_size:
+            bytes_data = self.blob_client.download_blob(offset=self.cur_offset,
+                length=self.chunk_size).content_as_bytes()
+            self.cur_offset += len(bytes_data)
+            chunk = self.decompressor.decompress(bytes_data)
+            if chunk:
+                return chunk
+        return b''
+
+
+def as_byte_stream(wiki_file):
+    """Returns a binary stream for wiki_file, unwrapping text streams such as bz2.open(..., 'rt')"""
+    if isinstance(wiki_file, io.TextIOBase):
+        buffer = getattr(wiki_file, 'buffer', None)
+        return buffer if buffer is not None else _EncodingReader(wiki_file)
+    return wiki_file
+
+
+class ByteScanner:
+    """
+    Buffered byte search over a binary stream. All indices are relative to the start of the
+    buffer, which always starts at the first byte not yet consumed (absolute position: offset).
+    """
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.offset = self._start_offset(stream)
+        self.bytes_read = 0
+        self.eof = False
+
+    @staticmethod
+    def _start_offset(stream):
+        """Absolute position of the stream, e.g. after seeking to a checkpoint"""
+        try:
+            return stream.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return 0
+
+    def fill(self):
+        """Reads the next chunk into the buffer. Returns False once the input is exhausted"""
+        if self.eof:
+            return False
+
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            logging.info("\nStop processing input stream as max_bytes={} was requested and already read a total of {} bytes\n".format(self.max_bytes, self.bytes_read))
+            self.eof = True
+            return False
+
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer += chunk
+        self.bytes_read += len(chunk)
+        return True
+
+    def find(self, pattern, start=0):
+        """Finds pattern at or after start, reading more input as needed. Returns -1 at end of input"""
+        search_from = start
+        while True:
+            idx = self.buffer.find(pattern, search_from)
+            if idx != -1:
+                return idx
+            # only re-scan the part that could still contain a match
+            search_from = max(start, len(self.buffer) - len(pattern) + 1)
+            if not self.fill():
+                return -1
+
+    def find_bounded(self, pattern, start, limit):
+        """
+        Like find, but gives up (returning None) once the buffer holds limit bytes without a match,
+        instead of buffering an arbitrarily long stretch of input
+        """
+        search_from = start
+        while True:
+            idx = self.buffer.find(pattern, search_from)
+            if idx != -1:
+                return idx
+            if len(self.buffer) >= limit:
+                return None
+            search_from = max(start, len(self.buffer) - len(pattern) + 1)
+            if not self.fill():
+                return -1
+
+    def ensure(self, size):
+        """Makes sure at least size bytes are buffered (unless the input ends earlier)"""
+        while len(self.buffer) < size and self.fill():
+            pass
+        return len(self.buffer) >= size
+
+    def startswith(self, pattern, start):
+        self.ensure(start + len(pattern))
+        return self.buffer.startswith(pattern, start)
+
+    def consume(self, size):
+        """Drops the first size bytes from the buffer"""
+        del self.buffer[:size]
+        self.offset += size
+
+    def take(self, size):
+        """Copies out the first size bytes and consumes them"""
+        data = bytes(self.buffer[:size])
+        self.consume(size)
+        return data
+
+    def skip_past(self, pattern):
+        """
+        Consumes input up to and including the next occurrence of pattern, without buffering
+        the skipped bytes. Returns the number of bytes skipped.
+        """
+        skipped = 0
+        while True:
+            idx = self.buffer.find(pattern)
+            if idx != -1:
+                self.consume(idx + len(pattern))
+                return skipped + idx + len(pattern)
+            # keep a tail that could be the start of pattern
+            drop = max(0, len(self.buffer) - len(pattern) + 1)
+            self.consume(drop)
+            skipped += drop
+            if not self.fill():
+                return skipped
+
+
+class OversizedRevisionLog:
+    """
+    Side file listing the revisions skipped for exceeding max_revision_bytes, as page_id, rev_id, size lines.
+    With append (a resumed job), the revisions already listed are not listed again, since the pages after
+    the last checkpoint are scanned a second time.
+    """
+    def __init__(self, log_file, append=False):
+        self.log_file = log_file
+        self.count = 0
+        self.logged = set()
+        if append and os.path.exists(log_file):
+            with open(log_file, "r+b") as f:
+                lines = f.read().split(b"\n")
+                # a line cut off by the kill is dropped, it is written again when its page is scanned
+                f.truncate(sum(len(line) + 1 for line in lines[:-1]))
+            self.logged = {tuple(line.decode('utf-8').split("\t")[:2]) for line in lines[:-1]}
+        elif not append:
+            open(log_file, "w").close()
+
+    def __call__(self, page_id, rev_id, size):
+        if (str(page_id), str(rev_id)) in self.logged:
+            return
+        with open(self.log_file, "a", encoding='utf-8') as f:
+            f.write("{}\t{}\t{}\n".format(page_id, rev_id, size))
+        self.count += 1
+
+
+class DumpScanner(ByteScanner):
+    """
+    Walks the <page>/<revision> structure of a MediaWiki XML dump.
+
+    Revisions larger than max_revision_bytes (e.g. a vandalism paste of 100 MB) are never buffered:
+    the scanner streams past them to </revision> and reports them with on_oversized(page_id,
+    rev_id, size). The revision following a skipped one has no previous revision to pair with.
+    """
+    page_offset = None  # absolute offset of the current <page>
+    page_id = None
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None, max_revision_bytes=None, on_oversized=None):
+        super().__init__(stream, chunk_size, max_bytes)
+        self.max_revision_bytes = max_revision_bytes
+        self.on_oversized = on_oversized
+
+    def find_revision_end(self, tag_start):
+        """
+        Returns the index of the </revision> closing the revision that starts at tag_start, or -1 at
+        end of input. A revision larger than max_revision_bytes is skipped instead: the buffer is
+        consumed up to its end and None is returned.
+        """
+        search_from = tag_start + len(REVISION_START)
+        if self.max_revision_bytes is None:
+            return self.find(REVISION_END, search_from)
+        revision_end = self.find_bounded(REVISION_END, search_from, tag_start + self.max_revision_bytes)
+        if revision_end == -1 or (revision_end is not None and
+                                  revision_end + len(REVISION_END) - tag_start <= self.max_revision_bytes):
+            return revision_end
+
+        # the revision header lies well within the limit
+        id_end = self.buffer.find(b"</id>", tag_start)
+        rev_id = decode_field(self.buffer, b"<id>", b"</id>", tag_start, id_end + len(b"</id>")) if id_end != -1 else ''
+        self.consume(tag_start)
+        size = self.skip_past(REVISION_END)
+        logging.warning("Skipped revision {} of page {}: {} bytes exceed max_revision_bytes={}".format(
+            rev_id, self.page_id, size, self.max_revision_bytes))
+        if self.on_oversized is not None:
+            self.on_oversized(self.page_id, rev_id, size)
+        return None
+
+    def next_page(self):
+        """
+        Positions the scanner inside the next page and returns its header as (title, ns, id),
+        or None at end of input.
+        """
+        page_start = self.find(PAGE_START)
+        if page_start == -1:
+            self.consume(max(0, len(self.buffer) - len(PAGE_START) + 1))
+            return None
+        self.page_offset = self.offset + page_start
+        self.consume(page_start + len(PAGE_START))
+
+        # the page id is the first <id> of the page, title and ns come before it
+        id_end = self.find(b"</id>")
+        if id_end == -1:
+            return None
+
+        header = self.buffer
+        page_title = decode_field(header, b"<title>", b"</title>", 0, id_end)
+        page_ns = decode_field(header, b"<ns>", b"</ns>", 0, id_end)
+        page_id = decode_field(header, b"<id>", b"</id>", 0, id_end + len(b"</id>"))
+        self.consume(id_end + len(b"</id>"))
+        self.page_id = page_id
+        return page_title, page_ns, page_id
+
+    def next_revision(self):
+        """Returns the raw bytes of the next revision of the current page, or None at the end of the page"""
+        while True:
+            tag_start = self.find(b"<")
+            if tag_start == -1:
+                return None
+
+            if self.startswith(REVISION_START, tag_start):
+                revision_end = self.find_revision_end(tag_start)
+                if revision_end is None:
+                    continue
+                if revision_end == -1:
+                    return None
+                self.consume(tag_start)
+                return self.take(revision_end - tag_start + len(REVISION_END))
+
+            if self.startswith(PAGE_END, tag_start):
+                self.consume(tag_start + len(PAGE_END))
+                return None
+
+            # any other element of the page (e.g. <redirect/>, <upload>): step over its tags
+            self.consume(tag_start + 1)
+
+    def next_revision_header(self):
+        """
+        Like next_revision, but only keeps the revision header: returns (the bytes before <text>, the
+        text length from the bytes="..." attribute, the sha1), or None at the end of the page.
+        The text body is streamed past without being buffered.
+        """
+        while True:
+            tag_start = self.find(b"<")
+            if tag_start == -1:
+                return None
+
+            if self.startswith(REVISION_START, tag_start):
+                self.consume(tag_start)
+                text_start = self.find(b"<text")
+                if text_start == -1:
+                    return None
+                revision_end = self.buffer.find(REVISION_END, 0, text_start)
+                if revision_end != -1:
+                    # revision without a <text> element
+                    header = self.take(revision_end)
+                    self.consume(len(REVISION_END))
+                    return header, None, decode_field(header, b"<sha1>", b"</sha1>")
+                header = self.take(text_start)
+
+                tag_end = self.find(b">")
+                if tag_end == -1:
+                    return None
+                match = _TEXT_BYTES.search(self.buffer, 0, tag_end)
+                text_bytes = int(match.group(1)) if match else None
+                self_closing = self.buffer[tag_end - 1] == ord('/')
+                self.consume(tag_end + 1)
+                if not self_closing:
+                    skipped = self.skip_past(b"</text>") - len(b"</text>")
+                    if text_bytes is None:
+                        # older dumps: the length of the (escaped) text as stored
+                        text_bytes = skipped
+
+                revision_end = self.find(REVISION_END)
+                if revision_end == -1:
+                    return None
+                sha1 = decode_field(self.buffer, b"<sha1>", b"</sha1>", 0, revision_end)
+                self.consume(revision_end + len(REVISION_END))
+                return header, text_bytes, sha1
+
+            if self.startswith(PAGE_END, tag_start):
+                self.consume(tag_start + len(PAGE_END))
+                return None
+
+            # any other element of the page (e.g. <redirect/>, <upload>): step over its tags
+            self.consume(tag_start + 1)
+
+    def revision_views(self, page_title, page_id, revision_filter=None, on_skip=None):
+        """
+        Yields a RevisionView for every revision of the current page that passes revision_filter.
+
+        revision_filter is called with a transient view over the scan buffer (only header fields
+        should be read) and returns None to accept, or the name of the rejecting predicate. The body
+        of a rejected revision is never copied: it stays at the front of the buffer until the next
+        revision is read, and is only materialized if that revision is accepted and needs it as
+        its `previous` revision.
+        """
+        previous = None
+        pending = 0  # size of the rejected previous revision kept at the front of the buffer
+        pos = pending
+        while True:
+            tag_start = self.find(b"<", pos)
+            if tag_start == -1:
+                return
+
+            if self.startswith(REVISION_START, tag_start):
+                revision_end = self.find_revision_end(tag_start)
+                if revision_end is None:
+                    # skipped (together with any pending revision), the next revision is unpaired
+                    previous = None
+                    pending = pos = 0
+                    continue
+                if revision_end == -1:
+                    return
+                end = revision_end + len(REVISION_END)
+
+                if revision_filter is not None:
+                    rejected_by = revision_filter(RevisionView(page_title, page_id, self.buffer, tag_start, end))
+                    if rejected_by:
+                        if on_skip is not None:
+                            on_skip(rejected_by, end - tag_start)
+                        # the rejected revision replaces any earlier one as the page's previous revision
+                        self.consume(tag_start)
+                        pending = pos = end - tag_start
+                        previous = None
+                        continue
+
+                if pending:
+                    previous = RevisionView(page_title, page_id, bytes(self.buffer[:pending]))
+                view = RevisionView(page_title, page_id, bytes(self.buffer[tag_start:end]))
+                self.consume(end)
+                pending = pos = 0
+
+                view.previous = previous
+                if previous is not None:
+                    # don't chain up the whole page history
+                    previous.previous = None
+                previous = view
+                yield view
+                continue
+
+            if self.startswith(PAGE_END, tag_start):
+                self.consume(tag_start + len(PAGE_END))
+                return
+
+            # any other element of the page (e.g. <redirect/>, <upload>): step over its tags
+            pos = tag_start + 1
+
+    def read_page_body(self, pos=0):
+        """
+        Consumes the rest of the current page, from buffer index pos on, through </page>. Returns
+        (the bytes up to </page>, the indices of revisions following a skipped oversized revision),
+        or None at end of input. The bytes before pos are included.
+        """
+        if self.max_revision_bytes is None:
+            page_end = self.find(PAGE_END, pos)
+            if page_end == -1:
+                return None
+            body = self.take(page_end)
+            self.consume(len(PAGE_END))
+            return body, ()
+
+        body = bytearray()
+        unpaired = set()
+        revisions = 0
+        while True:
+            tag_start = self.find(b"<", pos)
+            if tag_start == -1:
+                return None
+
+            if self.startswith(PAGE_END, tag_start):
+                body += self.take(tag_start)
+                self.consume(len(PAGE_END))
+                return bytes(body), unpaired
+
+            if self.startswith(REVISION_START, tag_start):
+                body += self.take(tag_start)
+                revision_end = self.find_revision_end(0)
+                if revision_end == -1:
+                    return None
+                if revision_end is None:
+                    unpaired.add(revisions)
+                else:
+                    body += self.take(revision_end + len(REVISION_END))
+                    revisions += 1
+                pos = 0
+                continue
+
+            pos = tag_start + 1
+
+    def next_page_history(self, page_filter=None, on_skip=None):
+        """
+        Returns a PageHistory over the rest of the next page that passes page_filter, or None at
+        end of input. page_filter and on_skip are as in scan_revision_views.
+        """
+        while True:
+            header = self.next_page()
+            if header is None:
+                return None
+            page_title, page_ns, page_id = header
+            page_offset = self.page_offset
+
+            if page_filter is not None:
+                rejected_by = page_filter(page_title, page_ns, page_id)
+                if rejected_by:
+                    skipped = self.skip_past(PAGE_END)
+                    if on_skip is not None:
+                        on_skip(rejected_by, skipped)
+                    continue
+
+            page = self.read_page_body()
+            if page is None:
+                return None
+            body, unpaired = page
+            return PageHistory(page_title, page_ns, page_id, body, page_offset, unpaired)
+
+    def next_page_bytes(self, page_filter=None, on_skip=None):
+        """
+        Returns the raw bytes of the next complete <page> ... </page> element that passes page_filter,
+        or None at end of input. page_filter and on_skip are as in scan_revision_views: rejected pages
+        are skipped right after their <id>, without being buffered.
+        """
+        while True:
+            page_start = self.find(PAGE_START)
+            if page_start == -1:
+                self.consume(max(0, len(self.buffer) - len(PAGE_START) + 1))
+                return None
+            self.consume(page_start)
+
+            id_end = self.find(b"</id>")
+            if id_end != -1:
+                self.page_id = decode_field(self.buffer, b"<id>", b"</id>", 0, id_end + len(b"</id>"))
+                if page_filter is not None:
+                    rejected_by = page_filter(decode_field(self.buffer, b"<title>", b"</title>", 0, id_end),
+                        decode_field(self.buffer, b"<ns>", b"</ns>", 0, id_end), self.page_id)
+                    if rejected_by:
+                        skipped = self.skip_past(PAGE_END)
+                        if on_skip is not None:
+                            on_skip(rejected_by, skipped)
+                        continue
+
+            page = self.read_page_body(len(PAGE_START))
+            if page is None:
+                return None
+            return page[0] + PAGE_END
+
+
+def scan_revisions(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None, max_revision_bytes=None, on_oversized=None):
+    """Yields (page_title, page_id, raw_revision_bytes) for every revision in the dump"""
+    scanner = DumpScanner(as_byte_stream(wiki_file), chunk_size, max_bytes, max_revision_bytes, on_oversized)
+    while True:
+        header = scanner.next_page()
+        if header is None:
+            break
+
+        page_title, _, page_id = header
+        if not page_title:
+            logging.error("Error: missing page title. This should never happen!")
+
+        while True:
+            revision = scanner.next_revision()
+            if revision is None:
+                break
+            yield page_title, page_id, revision
+
+
+def scan_pages(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None, max_revision_bytes=None, on_oversized=None,
+               page_filter=None, on_skip=None):
+    """
+    Yields the raw bytes of every <page> element in the dump that passes page_filter, without
+    revisions over max_revision_bytes
+    """
+    scanner = DumpScanner(as_byte_stream(wiki_file), chunk_size, max_bytes, max_revision_bytes, on_oversized)
+    while True:
+        page = scanner.next_page_bytes(page_filter, on_skip)
+        if page is None:
+            break
+        yield page
+
+
+def scan_revision_headers(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None):
+    """
+    Yields (page_offset, page_ns, header, text_bytes, sha1) for every revision in the dump, where
+    header is a RevisionView over the revision header only (its text is empty). Text bodies are
+    never buffered, see DumpScanner.next_revision_header.
+    """
+    scanner = DumpScanner(as_byte_stream(wiki_file), chunk_size, max_bytes)
+    while True:
+        header = scanner.next_page()
+        if header is None:
+            break
+
+        page_title, page_ns, page_id = header
+        page_offset = scanner.page_offset
+        while True:
+            revision = scanner.next_revision_header()
+            if revision is None:
+                break
+            revision_header, text_bytes, sha1 = revision
+            yield page_offset, page_ns, RevisionView(page_title, page_id, revision_header), text_bytes, sha1
+
+
+def _header_field(slot, start_delim, end_delim, in_contributor=False):
+    """Property decoding a revision header field (everything before <text>) on first access"""
+    def getter(self):
+        value = getattr(self, slot)
+        if value is None:
+            start = self.contributor_start if in_contributor else self.start
+            value = decode_field(self.buffer, start_delim, end_delim, start, self.header_end)
+            setattr(self, slot, value)
+        return value
+    getter.__name__ = slot.lstrip('_')
+    return property(getter)
+
+
+class RevisionView:
+    """
+    A lazily parsed <revision> element. Holds the raw buffer and the byte offsets of the revision
+    within it; every field is located and decoded only on first access, so the (potentially
+    multi-megabyte) <text> body is never copied for revisions that are dropped on metadata alone.
+    """
+    __slots__ = ('page_title', 'page_id', 'buffer', 'start', 'end', 'previous',
+                 '_header_end', '_contributor_start', '_text_span',
+                 '_rev_id', '_parent_id', '_timestamp', '_username', '_userid', '_userip',
+                 '_comment', '_text', '_sha1')
+
+    def __init__(self, page_title, page_id, buffer, start=0, end=None):
+        self.page_title = page_title
+        self.page_id = page_id
+        self.buffer = buffer
+        self.start = start
+        self.end = len(buffer) if end is None else end
+        # the preceding revision of the same page, as set by the scanner
+        self.previous = None
+        self._header_end = None
+        self._contributor_start = None
+        self._text_span = None
+        self._rev_id = self._parent_id = self._timestamp = None
+        self._username = self._userid = self._userip = None
+        self._comment = self._text = self._sha1 = None
+
+    @property
+    def header_end(self):
+        """Offset of the <text> element, all metadata fields except sha1 come before it"""
+        if self._header_end is None:
+            idx = self.buffer.find(b"<text", self.start, self.end)
+            self._header_end = self.end if idx == -1 else idx
+        return self._header_end
+
+    @property
+    def contributor_start(self):
+        if self._contributor_start is None:
+            idx = self.buffer.find(b"<contributor", self.start, self.header_end)
+            self._contributor_start = self.header_end if idx == -1 else idx
+        return self._contributor_start
+
+    rev_id = _header_field('_rev_id', b"<id>", b"</id>")
+    parent_id = _header_field('_parent_id', b"<parentid>", b"</parentid>")
+    timestamp = _header_field('_timestamp', b"<timestamp>", b"</timestamp>")
+    username = _header_field('_username', b"<username>", b"</username>", in_contributor=True)
+    userid = _header_field('_userid', b"<id>", b"</id>", in_contributor=True)
+    # For annoymous user, the ip address will be used instead of the user name and id
+    userip = _header_field('_userip', b"<ip>", b"</ip>", in_contributor=True)
+    comment = _header_field('_comment', b"<comment>", b"</comment>")
+
+    @property
+    def text_span(self):
+        """(start, end) offsets of the text body within buffer, without decoding it"""
+        if self._text_span is None:
+            tag_end = self.buffer.find(b">", self.header_end, self.end)
+            if self.header_end == self.end or tag_end == -1 or self.buffer[tag_end - 1] == ord('/'):
+                # missing or self-closing (deleted) text
+                self._text_span = (tag_end, tag_end)
+            else:
+                text_end = self.buffer.find(b"</text>", tag_end, self.end)
+                self._text_span = (tag_end + 1, tag_end + 1 if text_end == -1 else text_end)
+        return self._text_span
+
+    @property
+    def text_bytes(self):
+        start, end = self.text_span
+        return end - start
+
+    @property
+    def raw_text(self):
+        """The undecoded (utf-8) text body, as a memoryview into buffer"""
+        start, end = self.text_span
+        return memoryview(self.buffer)[start:end]
+
+    @property
+    def text(self):
+        if self._text is None:
+            start, end = self.text_span
+            self._text = str(memoryview(self.buffer)[start:end], 'utf-8')
+        return self._text
+
+    @property
+    def sha1(self):
+        if self._sha1 is None:
+            # <sha1> follows the text body, so search backwards from the end of the revision
+            idx = self.buffer.rfind(b"<sha1>", self.header_end, self.end)
+            self._sha1 = '' if idx == -1 else decode_field(self.buffer, b"<sha1>", b"</sha1>", idx, self.end)
+        return self._sha1
+
+    def fields(self):
+        """Same tuple as wiki_util.extract_data"""
+        return (self.rev_id, self.parent_id, self.timestamp, self.username, self.userid,
+                self.userip, self.comment, self.text)
+
+
+class PageHistory:
+    """
+    All revisions of one page: the page header and the raw bytes of the page body (everything after
+    the page <id>), with the revisions addressable by index. Revision spans are located lazily, on
+    first access, and revisions are handed out as RevisionViews over the shared page buffer, so
+    nothing is copied or decoded up front. Picklable, to dispatch whole pages to worker processes.
+
+    unpaired holds the indices of revisions that followed an oversized revision dropped by the
+    scanner; they have no previous revision.
+    """
+    __slots__ = ('page_title', 'page_ns', 'page_id', 'page_offset', 'buffer', 'unpaired', '_spans', '_scan_pos')
+
+    def __init__(self, page_title, page_ns, page_id, buffer, page_offset=None, unpaired=()):
+        self.page_title = page_title
+        self.page_ns = page_ns
+        self.page_id = page_id
+        self.page_offset = page_offset
+        self.buffer = buffer
+        self.unpaired = unpaired
+        self._spans = []
+        self._scan_pos = 0  # buffer offset up to which revision spans have been located, None when done
+
+    def _scan_to(self, index):
+        """Locates revision spans until index is known or the page is exhausted"""
+        while self._scan_pos is not None and len(self._spans) <= index:
+            start = self.buffer.find(REVISION_START, self._scan_pos)
+            end = -1 if start == -1 else self.buffer.find(REVISION_END, start + len(REVISION_START))
+            if end == -1:
+                self._scan_pos = None
+                break
+            end += len(REVISION_END)
+            self._spans.append((start, end))
+            self._scan_pos = end
+        return index < len(self._spans)
+
+    def span(self, index):
+        """(start, end) of the index-th <revision> element within buffer"""
+        if index < 0:
+            index += len(self)
+        if index < 0 or not self._scan_to(index):
+            raise IndexError("page {} has no revision {}".format(self.page_id, index))
+        return self._spans[index]
+
+    def revision(self, index, previous=None):
+        """The index-th revision as a RevisionView, with `previous` set to the given view (unless it is unpaired)"""
+        view = RevisionView(self.page_title, self.page_id, self.buffer, *self.span(index))
+        view.previous = None if index in self.unpaired else previous
+        return view
+
+    def chunk(self, start, stop):
+        """
+        A PageHistory over a copy of the revisions start..stop-1 only, preceded by revision start-1
+        (if start > 0) so that the pair at the chunk boundary can still be formed.
+        """
+        first = max(0, start - 1)
+        begin = self.span(first)[0]
+        end = self.span(stop - 1)[1]
+        unpaired = {index - first for index in self.unpaired if first < index < stop}
+        return PageHistory(self.page_title, self.page_ns, self.page_id, self.buffer[begin:end], self.page_offset, unpaired)
+
+    def __len__(self):
+        self._scan_to(float('inf'))
+        return len(self._spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        previous = self.revision(index - 1) if index > 0 else None
+        return self.revision(index, previous)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start, stop=None):
+        """
+        Yields the revisions start..stop-1 with `previous` linked as in scan_revision_views; the
+        first one is linked to revision start-1 (if any), so pairs at the boundary are kept.
+        """
+        previous = self.revision(start - 1) if start > 0 else None
+        index = start
+        while (stop is None or index < stop) and self._scan_to(index):
+            view = self.revision(index, previous)
+            if previous is not None:
+                previous.previous = None
+            previous = view
+            index += 1
+            yield view
+
+
+def scan_page_histories(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None,
+                        page_filter=None, on_skip=None, on_page=None, max_revision_bytes=None, on_oversized=None):
+    """
+    Yields a PageHistory for every page in the dump, with the same page_filter, on_skip, on_page,
+    max_revision_bytes and on_oversized arguments as scan_revision_views.
+    """
+    scanner = DumpScanner(as_byte_stream(wiki_file), chunk_size, max_bytes, max_revision_bytes, on_oversized)
+    while True:
+        history = scanner.next_page_history(page_filter, on_skip)
+        if history is None:
+            break
+        if not history.page_title:
+            logging.error("Error: missing page title. This should never happen!")
+        if on_page is not None:
+            on_page(history.page_offset, history.page_id)
+        yield history
+
+
+def scan_revision_views(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=None,
+                        page_filter=None, revision_filter=None, on_skip=None, on_page=None,
+                        max_revision_bytes=None, on_oversized=None):
+    """
+    Yields a RevisionView for every revision in the dump, with `previous` set to the preceding
+    revision of the same page (None for the first one).
+
+    page_filter(page_title, page_ns, page_id) and revision_filter(view) are pushed down predicates
+    returning None to accept or the name of the rejecting predicate. Rejected pages are skipped to
+    </page> without buffering, rejected revisions are not copied. on_skip(name, bytes) is called
+    with the number of bytes each rejection skipped. on_page(page_offset, page_id) is called before
+    a page is scanned, i.e. once everything yielded for the earlier pages has been consumed.
+    max_revision_bytes and on_oversized are as in DumpScanner.
+    """
+    scanner = DumpScanner(as_byte_stream(wiki_file), chunk_size, max_bytes, max_revision_bytes, on_oversized)
+    while True:
+        header = scanner.next_page()
+        if header is None:
+            break
+
+        page_title, page_ns, page_id = header
+        if not page_title:
+            logging.error("Error: missing page title. This should never happen!")
+
+        if on_page is not None:
+            on_page(scanner.page_offset, page_id)
+
+        if page_filter is not None:
+            rejected_by = page_filter(page_title, page_ns, page_id)
+            if rejected_by:
+                skipped = scanner.skip_past(PAGE_END)
+                if on_skip is not None:
+                    on_skip(rejected_by, skipped)
+                continue
+
+        yield from scanner.revision_views(page_title, page_id, revision_filter, on_skip)
@@ -0,0 +1,256 @@
+"""
+Header-only statistics of history dump files for capacity planning: revisions per page, comment
+length and text size histograms, the namespace mix and the number of distinct users. Text bodies
+are never materialized (see dump_scanner.scan_revision_headers), everything is aggregated into
+fixed-size histograms and a HyperLogLog sketch, so memory use doesn't grow with the dump.
+
+Writes one compact JSON file per dump file (<dump_file>.stats.json); --merge combines such files,
+e.g. of all dump files of a wiki, into one.
+"""
+
+import os
+import sys
+import json
+import math
+import glob
+import time
+import base64
+import hashlib
+import argparse
+import logging
+from collections import Counter
+
+from dump_io import open_dump, prefer_transcoded
+from dump_scanner import scan_revision_headers
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+HLL_PRECISION = 12
+
+
+def stable_hash64(value):
+    """64 bit hash of a string, the same on every machine and run (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class Log2Histogram:
+    """Counts of values in the buckets [0], [1], [2, 4), [4, 8), ... [2^62, 2^63)"""
+    BUCKETS = 64
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * self.BUCKETS
+
+    def add(self, value, n=1):
+        self.counts[min(int(value).bit_length(), self.BUCKETS - 1)] += n
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def total(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        target = q * self.total()
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return (1 << bucket) - 1 if bucket else 0
+        return 0
+
+    def to_json(self):
+        # trailing empty buckets are left out
+        last = max((i for i, count in enumerate(self.counts) if count), default=-1)
+        return self.counts[:last + 1]
+
+    @classmethod
+    def from_json(cls, counts):
+        return cls(counts + [0] * (cls.BUCKETS - len(counts)))
+
+
+class HyperLogLog:
+    """Distinct count sketch with 2^precision one-byte registers (standard error 1.04 / sqrt(2^precision))"""
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, value):
+        h = stable_hash64(value)
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLog sketches of precision {} and {}".format(self.precision, other.precision))
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_json(self):
+        return {"precision": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["precision"], base64.b64decode(data["registers"]))
+
+
+class DumpStats:
+    """The statistics of one or more dump files"""
+    HISTOGRAMS = ("revisions_per_page", "comment_length", "text_bytes")
+
+    def __init__(self):
+        self.dump_files = []
+        self.pages = 0
+        self.revisions = 0
+        self.total_text_bytes = 0
+        self.anonymous_revisions = 0
+        self.pages_by_ns = Counter()
+        self.revisions_by_ns = Counter()
+        self.revisions_by_year = Counter()
+        self.histograms = {name: Log2Histogram() for name in self.HISTOGRAMS}
+        self.users = HyperLogLog()
+
+    def add_page(self, ns, revisions):
+        self.pages += 1
+        self.pages_by_ns[ns] += 1
+        self.revisions_by_ns[ns] += revisions
+        self.histograms["revisions_per_page"].add(revisions)
+
+    def add_revision(self, header, text_bytes):
+        self.revisions += 1
+        self.total_text_bytes += text_bytes or 0
+        self.histograms["text_bytes"].add(text_bytes or 0)
+        self.histograms["comment_length"].add(len(header.comment))
+        self.revisions_by_year[header.timestamp[:4]] += 1
+        if header.userip:
+            self.anonymous_revisions += 1
+            self.users.add("ip:" + header.userip)
+        elif header.username:
+            self.users.add("user:" + header.username)
+
+    def merge(self, other):
+        self.dump_files += other.dump_files
+        self.pages += other.pages
+        self.revisions += other.revisions
+        self.total_text_bytes += other.total_text_bytes
+        self.anonymous_revisions += other.anonymous_revisions
+        self.pages_by_ns.update(other.pages_by_ns)
+        self.revisions_by_ns.update(other.revisions_by_ns)
+        self.revisions_by_year.update(other.revisions_by_year)
+        for name in self.HISTOGRAMS:
+            self.histograms[name].merge(other.histograms[name])
+        self.users.merge(other.users)
+
+    def to_json(self):
+        return {
+            "dump_files": self.dump_files,
+            "pages": self.pages,
+            "revisions": self.revisions,
+            "total_text_bytes": self.total_text_bytes,
+            "anonymous_revisions": self.anonymous_revisions,
+            "distinct_users_estimate": self.users.count(),
+            "pages_by_ns": dict(self.pages_by_ns),
+            "revisions_by_ns": dict(self.revisions_by_ns),
+            "revisions_by_year": dict(sorted(self.revisions_by_year.items())),
+            "log2_histograms": {name: self.histograms[name].to_json() for name in self.HISTOGRAMS},
+            "users_sketch": self.users.to_json()
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls()
+        stats.dump_files = data["dump_files"]
+        stats.pages = data["pages"]
+        stats.revisions = data["revisions"]
+        stats.total_text_bytes = data["total_text_bytes"]
+        stats.anonymous_revisions = data["anonymous_revisions"]
+        stats.pages_by_ns = Counter(data["pages_by_ns"])
+        stats.revisions_by_ns = Counter(data["revisions_by_ns"])
+        stats.revisions_by_year = Counter(data["revisions_by_year"])
+        stats.histograms = {name: Log2Histogram.from_json(data["log2_histograms"][name]) for name in cls.HISTOGRAMS}
+        stats.users = HyperLogLog.from_json(data["users_sketch"])
+        return stats
+
+    def summary(self):
+        lines = ["{} pages, {} revisions ({:.1f}% anonymous), {:.1f} GB of text, ~{} distinct users".format(
+            self.pages, self.revisions, 100 * self.anonymous_revisions / max(1, self.revisions),
+            self.total_text_bytes / 1024**3, self.users.count())]
+        for name in self.HISTOGRAMS:
+            histogram = self.histograms[name]
+            lines.append("- {}: median <= {}, p90 <= {}, p99 <= {}".format(
+                name, histogram.quantile(0.5), histogram.quantile(0.9), histogram.quantile(0.99)))
+        lines.append("- revisions by namespace: {}".format(dict(self.revisions_by_ns.most_common())))
+        return "\n".join(lines)
+
+
+def collect_stats(dump_file, workers=None, max_bytes=None):
+    """Scans the revision headers of dump_file (or of its transcoding) into a DumpStats"""
+    stats = DumpStats()
+    stats.dump_files.append(os.path.basename(dump_file))
+    start_time = time.time()
+
+    page_offset, page_ns, page_revisions = None, None, 0
+    with open_dump(prefer_transcoded(dump_file), workers=workers) as stream:
+        for offset, ns, header, text_bytes, _ in scan_revision_headers(stream, SCAN_CHUNK_SIZE, max_bytes):
+            if offset != page_offset:
+                if page_offset is not None:
+                    stats.add_page(page_ns, page_revisions)
+                page_offset, page_ns, page_revisions = offset, ns, 0
+            page_revisions += 1
+            stats.add_revision(header, text_bytes)
+    if page_offset is not None:
+        stats.add_page(page_ns, page_revisions)
+
+    logging.info("Collected statistics of {} revisions of {} in {:.0f}s".format(stats.revisions, dump_file, time.time() - start_time))
+    return stats
+
+
+def merge_stats(stats_files):
+    merged = DumpStats()
+    for stats_file in stats_files:
+        with open(stats_file, "r", encoding='utf-8') as f:
+            merged.merge(DumpStats.from_json(json.load(f)))
+    return merged
+
+
+def write_stats(stats, output_file):
+    with open(output_file, "w", encoding='utf-8') as f:
+        json.dump(stats.to_json(), f, separators=(',', ':'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-path', type=str, default="./data/raw/", help='the data directory with the downloaded dump files')
+    parser.add_argument('--dump_file', type=str, default=None, help='only scan this file instead of all .bz2/.7z files in --data-path')
+    parser.add_argument('--decompress-workers', type=int, default=1, help='number of processes decompressing the bz2 input')
+    parser.add_argument('--max_mb', type=int, default=None, help='if given, only scans the first max_mb MByte of each file')
+    parser.add_argument('--merge', type=str, nargs='+', default=None, help='merge these .stats.json files into --output instead of scanning')
+    parser.add_argument('--output', type=str, default=None, help='output file of --merge')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    if args.merge:
+        if not args.output:
+            parser.error("--merge requires --output")
+        stats = merge_stats(args.merge)
+        write_stats(stats, args.output)
+        logging.info(stats.summary())
+        sys.exit(0)
+
+    dump_files = [args.dump_file] if args.dump_file else sorted(
+        glob.glob(os.path.join(args.data_path, "*.bz2")) + glob.glob(os.path.join(args.data_path, "*.7z")))
+    for dump_file in dump_files:
+        stats = collect_stats(dump_file, workers=args.decompress_workers, max_bytes=args.max_mb and args.max_mb * 1024 * 1024)
+        write_stats(stats, dump_file + ".stats.json")
+        logging.info(stats.summary())
@@ -16,50 +16,318 @@ from nltk.tokenize import word_tokenize, sent_tokenize
 
 from wiki_util import *
 from profiling import Profiled
+from custom_filters import prefilter, raw_field, raw_nonspace_length, raw_texts_differ
+from revision_cache import RevisionTextCache
+from markup_cleaners import markup_cleaner, section_cache
+from revision_memo import revision_memo
+
+class LazyTextInstance(dict):
+    """
+    Instance dict whose values may be RevisionViews: they are replaced by the decoded revision text
+    on first read, so text is only decoded for pairs that make it past the metadata filters.
+    """
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, RevisionView):
+            value = value.text
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    # overriding __iter__ makes dict(instance) and json.dumps go through items()/__getitem__
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+def revision_header(revision):
+    """Metadata of a revision as seen by pushed down predicates, computed from header fields only"""
+    comment = cleanCmntText(revision.comment)
+    sect_title, comment = extractSectionTitle(comment)
+    return {
+        "rev_id": revision.rev_id,
+        "page_id": revision.page_id,
+        "parent_id": revision.parent_id,
+        "comment_text": comment,
+        "section_title": sect_title,
+        "page_title": revision.page_title,
+        "timestamp": revision.timestamp,
+        "username": revision.username,
+        "userip": revision.userip
+    }
+
+def pushdown_filters(processors):
+    """
+    Collects the pushdown predicates of the leading metadata-only processors (see custom_filters.pushdown)
+    and returns them as (page_filter, revision_filter) for the dump scanner. Either may be None.
+    """
+    predicates = {'page': [], 'revision': []}
+    for processor in processors:
+        if not hasattr(processor, 'pushdown'):
+            break
+        level, predicate = processor.pushdown
+        predicates[level].append((processor.__name__, predicate))
+
+    def page_filter(page_title, page_ns, page_id):
+        header = {"page_title": page_title, "page_ns": page_ns, "page_id": page_id}
+        for name, predicate in predicates['page']:
+            if not predicate(header):
+                return name
+        return None
+
+    def revision_filter(revision):
+        header = revision_header(revision)
+        for name, predicate in predicates['revision']:
+            if not predicate(header):
+                return name
+        return None
+
+    return (page_filter if predicates['page'] else None,
+            revision_filter if predicates['revision'] else None)
+
+def insert_prefilters(processors):
+    """
+    Returns processors with one admissible_prefilters step running the prefilters declared by the
+    processors (see custom_filters.prefilter), placed right after the leading pushdown filters, which
+    are evaluated by the scanner. Rejections are counted per declaring processor.
+    """
+    prefilters = [(p.__name__, p.prefilter) for p in processors if hasattr(p, 'prefilter')]
+    if not prefilters:
+        return processors
 
-def generate_revision_pairs(wiki_stream, max_bytes=None):
+    @Profiled.generator
+    def admissible_prefilters(instance):
+        for name, predicate in prefilters:
+            if not predicate(instance):
+                Profiled.record_prefilter(name, sum(text.text_bytes for text in
+                    (raw_field(instance, "src_text"), raw_field(instance, "tgt_text")) if isinstance(text, RevisionView)))
+                return
+        yield instance
+
+    n_pushdown = next((i for i, p in enumerate(processors) if not hasattr(p, 'pushdown')), len(processors))
+    return processors[:n_pushdown] + [admissible_prefilters] + processors[n_pushdown:]
+
+def parent_text(revision, cache):
+    """Source of a revision's pair in parent_id mode: its previous revision if that is the parent, else the cached parent text"""
+    parent_id = revision.parent_id
+    if not parent_id:
+        return None
+    previous = revision.previous
+    if previous is not None and previous.rev_id == parent_id:
+        return previous
+    return cache.get(parent_id)
+
+class PageRevisionHashes:
+    """The <sha1> of every revision seen so far on the current page"""
+    def __init__(self):
+        self.page_id = None
+        self.by_rev_id = {}
+        self.seen = set()
+
+    def add(self, revision):
+        if revision.page_id != self.page_id:
+            self.page_id = revision.page_id
+            self.by_rev_id = {}
+            self.seen = set()
+        sha1 = revision.sha1
+        if sha1:
+            self.by_rev_id[revision.rev_id] = sha1
+            self.seen.add(sha1)
+
+    def check_and_add(self, revision, src_rev_id):
+        """
+        Returns 'identical' if revision has the same text as revision src_rev_id, 'revert' if it
+        restores any earlier state of the page, None otherwise. Records the revision afterwards.
+        """
+        result = None
+        sha1 = revision.sha1
+        if sha1 and revision.page_id == self.page_id:
+            if src_rev_id and self.by_rev_id.get(src_rev_id) == sha1:
+                result = 'identical'
+            elif sha1 in self.seen:
+                result = 'revert'
+        self.add(revision)
+        return result
+
+def revision_pair(revision, prev_revision):
+    """The instance for the pair (prev_revision, revision), the text bodies are only decoded once a processor reads them"""
+    header = revision_header(revision)
+    meta = LazyTextInstance({
+        "rev_id": header["rev_id"],
+        "page_id": header["page_id"],
+        "parent_id": header["parent_id"],
+        "src_text": prev_revision,
+        "tgt_text": revision,
+        "comment_text": header["comment_text"],
+        "section_title": header["section_title"],
+        "page_title": header["page_title"],
+        "timestamp": header["timestamp"]
+    })
+
+    meta['diff_url'] = 'https://en.wikipedia.org/w/index.php?title=' + \
+        meta["page_title"].replace(" ",'%20') + '&type=revision&diff=' + meta["rev_id"] + '&oldid=' + meta["parent_id"]
+    return meta
+
+def counting_oversized(on_oversized=None):
+    """on_oversized callback for the scanner, counting skipped revisions in Profiled before passing them on"""
+    def count_oversized(page_id, rev_id, size):
+        Profiled.count("oversized revisions skipped")
+        Profiled.count("oversized revision bytes skipped", size)
+        if on_oversized is not None:
+            on_oversized(page_id, rev_id, size)
+    return count_oversized
+
+def page_revision_pairs(history, revision_filter=None, duplicates=None, first=0, earlier_sha1s=()):
+    """
+    Yields the instances of generate_revision_pairs (with pairing='stream') for a single
+    wiki_util.PageHistory. revision_filter is the revision level pushdown filter (see pushdown_filters).
+
+    For a chunk of a page (see PageHistory.chunk), only the revisions from index first on are
+    paired, the ones before only serve as source, and earlier_sha1s are the <sha1> of the page's
+    revisions before the chunk, for revert detection.
+    """
+    hashes = PageRevisionHashes() if duplicates else None
+    if hashes is not None:
+        hashes.page_id = history.page_id
+        hashes.seen.update(earlier_sha1s)
+
+    for index, revision in enumerate(history):
+        if index < first:
+            if hashes is not None:
+                hashes.add(revision)
+            continue
+
+        duplicate = None
+        if hashes is not None:
+            src_rev_id = revision.previous.rev_id if revision.previous is not None else None
+            duplicate = hashes.check_and_add(revision, src_rev_id)
+
+        if revision_filter is not None:
+            rejected_by = revision_filter(revision)
+            if rejected_by:
+                Profiled.record_pushdown(rejected_by, revision.end - revision.start)
+                continue
+
+        if duplicate and duplicates == 'drop':
+            Profiled.count("{} revision pairs dropped by sha1".format(duplicate))
+            continue
+
+        if revision.previous is None:
+            continue
+
+        meta = revision_pair(revision, revision.previous)
+        if duplicates == 'tag':
+            meta["sha1_duplicate"] = duplicate
+        yield meta
+
+def generate_revision_pairs(wiki_stream, max_bytes=None, pushdown_from=None, pairing='stream',
+        revision_cache_bytes=256 * 1024 * 1024, duplicates=None, checkpointer=None,
+        max_revision_bytes=None, on_oversized=None, watermarks=None, since_watermark=False):
+    """
+    Yields a (src, tgt) instance for every pair of revisions of a page.
+    If pushdown_from is given (usually the processor list), the leading metadata-only filters are
+    evaluated inside the dump scanner, before any revision body is copied.
+
+    pairing='stream' pairs each revision with the one preceding it in the dump. pairing='parent_id'
+    pairs it with the revision named in its <parentid>, looked up in a per-page compressed LRU cache
+    of at most revision_cache_bytes, so reverts and edit conflicts produce correct pairs.
+
+    duplicates='drop' drops pairs whose target has the same <sha1> as the source ('identical') or as
+    any earlier revision of the page ('revert') before any processor runs; duplicates='tag' keeps them
+    and sets "sha1_duplicate" on every instance instead.
+
+    If a checkpointing.Checkpointer is given, it is notified at every page boundary.
+
+    Revisions larger than max_revision_bytes are skipped by the scanner without being buffered and
+    reported to on_oversized(page_id, rev_id, size), e.g. a wiki_util.OversizedRevisionLog. They
+    produce no pair, and neither does the revision following them (it has no known source text).
+
+    If a watermarks.WatermarkStore is given, every scanned revision is recorded in it. With
+    since_watermark, only pairs whose target is newer than the page's watermark are generated: older
+    revisions are rejected in the scanner, the newest of them is kept as the source of the first pair.
+    """
     logger=logging.getLogger(__name__)
     start_time = datetime.datetime.now()
 
     revision_count = 0
     page_count = 0
-    prev_text = '' # changed from None!
-    prev_page_title = ''
-
-    records = split_records(wiki_stream, max_bytes=max_bytes)
-
-    for page_title, page_id, revision in records:
+    prev_page_id = None
+
+    page_filter, revision_filter = pushdown_filters(pushdown_from or [])
+    if watermarks is not None:
+        revision_filter = watermarks.revision_filter(since_watermark, revision_filter)
+    by_parent_id = pairing == 'parent_id'
+    if by_parent_id:
+        # every revision may be a parent, so bodies have to be cached before filtering on metadata
+        cache = RevisionTextCache(revision_cache_bytes)
+        scanner_revision_filter = None
+    else:
+        scanner_revision_filter = revision_filter
+
+    hashes = PageRevisionHashes() if duplicates else None
+    if hashes is not None and scanner_revision_filter is not None:
+        # revisions rejected inside the scanner still count as earlier states of the page
+        def scanner_revision_filter(revision, revision_filter=revision_filter):
+            rejected_by = revision_filter(revision)
+            if rejected_by:
+                hashes.add(revision)
+            return rejected_by
+
+    revisions = split_revision_views(wiki_stream, max_bytes=max_bytes,
+        page_filter=page_filter, revision_filter=scanner_revision_filter, on_skip=Profiled.record_pushdown,
+        on_page=checkpointer.page_boundary if checkpointer else None,
+        max_revision_bytes=max_revision_bytes, on_oversized=counting_oversized(on_oversized))
+
+    for revision in revisions:
         revision_count += 1
-
-        # fields 
-        rev_id, parent_id, timestamp, username, userid, userip, comment, text = extract_data(revision)
-        comment = cleanCmntText(comment)
-        sect_title, comment = extractSectionTitle(comment)
-        if prev_page_title != page_title:
+        if prev_page_id != revision.page_id:
             page_count += 1
-            prev_page_title = page_title
-            prev_text = text
-
-        else:
-            meta = {
-                "rev_id": rev_id,
-                "page_id": page_id,
-                "parent_id": parent_id,
-                "src_text": prev_text,
-                "tgt_text": text,
-                "comment_text":comment,
-                "section_title":sect_title,
-                "page_title": page_title,
-                "timestamp": timestamp
-            }
-
-            meta['diff_url'] = 'https://en.wikipedia.org/w/index.php?title=' + \
-                meta["page_title"].replace(" ",'%20') + '&type=revision&diff=' + meta["rev_id"] + '&oldid=' + meta["parent_id"]
-
-            # for next iteration, current text becomes prev_text
-            prev_text = text
-
-            yield meta
+            prev_page_id = revision.page_id
+            if by_parent_id:
+                cache.clear()
+
+        duplicate = None
+        if hashes is not None:
+            if by_parent_id:
+                src_rev_id = revision.parent_id
+            else:
+                src_rev_id = revision.previous.rev_id if revision.previous is not None else None
+            duplicate = hashes.check_and_add(revision, src_rev_id)
+
+        if by_parent_id:
+            cache.put(revision.rev_id, revision.raw_text)
+            if revision_filter is not None:
+                rejected_by = revision_filter(revision)
+                if rejected_by:
+                    Profiled.record_pushdown(rejected_by, revision.end - revision.start)
+                    continue
+
+        if duplicate and duplicates == 'drop':
+            Profiled.count("{} revision pairs dropped by sha1".format(duplicate))
+            continue
+
+        prev_revision = parent_text(revision, cache) if by_parent_id else revision.previous
+
+        # the first revision of a page has no previous revision to pair with
+        if prev_revision is None:
+            continue
+
+        meta = revision_pair(revision, prev_revision)
+        if duplicates == 'tag':
+            meta["sha1_duplicate"] = duplicate
+
+        yield meta
+
+    if by_parent_id:
+        Profiled.count("revision cache hits", cache.hits)
+        Profiled.count("revision cache misses", cache.misses)
+        Profiled.count("revision cache evictions", cache.evictions)
 
     time_elapsed = datetime.datetime.now() - start_time
     logger.debug("=== iterated through " + str(revision_count) + " revisions " \
@@ -86,24 +354,137 @@ def restrict_to_section(meta):
         return
 
 
-@Profiled.generator
-def clean_markup_mediawikiparser(instance):
-    def remove_refs(s): return re.sub(r"</?ref[^>]*>", "", s)
-    def remove_misc(s): return re.sub(r"``|''", "", s)
-    def parse(s): return remove_misc(remove_refs(str(mwparserfromhell.parse(s).strip_code())))
+def common_prefix_length(a, b):
+    """Length of the common prefix of two strings (or bytes), by comparing ever smaller slices"""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def common_suffix_length(a, b, max_length=None):
+    """Length of the common suffix of two strings (or bytes), at most max_length"""
+    lo, hi = 0, min(len(a), len(b)) if max_length is None else min(len(a), len(b), max_length)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+_NESTED_TAGS = "ref|gallery|math|chem|pre|nowiki|syntaxhighlight|source|blockquote|poem|timeline|score|table|div|code"
+_MARKUP = re.compile(r"(<!--)|(-->)|(\{\{|\[\[|\{\||<(?:" + _NESTED_TAGS + r")\b[^>]*(?<!/)>)"
+                     r"|(\}\}|\]\]|\|\}(?!\})|</(?:" + _NESTED_TAGS + r")\s*>)|(\n)", flags=re.IGNORECASE)
+
+def markup_safe_boundaries(text):
+    """
+    Offsets of the line starts in wikitext that are not inside a template, link, table, comment or
+    block tag such as <ref>, i.e. where the text can be cut without breaking any markup apart
+    """
+    boundaries = [0]
+    depth = 0
+    in_comment = False
+    for match in _MARKUP.finditer(text):
+        opens_comment, closes_comment, opens, closes, newline = match.groups()
+        if in_comment:
+            in_comment = closes_comment is None
+        elif opens_comment:
+            in_comment = True
+        elif opens:
+            depth += 1
+        elif closes:
+            depth = max(0, depth - 1)
+        elif newline and depth == 0:
+            boundaries.append(match.end())
+    return boundaries
+
+def edit_window(src_text, tgt_text, context_lines=2, min_context_chars=2000):
+    """
+    The region of src_text and tgt_text around their difference, as (start, src_end, tgt_end), or
+    None if the texts are identical. The changed region (everything between the common prefix and
+    the common suffix) is widened to markup-safe line boundaries (see markup_safe_boundaries),
+    plus at least context_lines lines and min_context_chars characters of unchanged context on
+    either side. start is the same in both texts, the windows end at the same distance from the end.
+    """
+    if src_text == tgt_text:
+        return None
+    prefix = common_prefix_length(src_text, tgt_text)
+    suffix = common_suffix_length(src_text, tgt_text, min(len(src_text), len(tgt_text)) - prefix)
+
+    # below the common prefix, both texts have the same boundaries
+    starts = markup_safe_boundaries(src_text[:prefix])
+    i = max(0, len(starts) - 1 - context_lines)
+    while i > 0 and prefix - starts[i] < min_context_chars:
+        i -= 1
+
+    # in the common suffix, a cut has to be safe in both texts: distances from the end
+    src_boundaries = markup_safe_boundaries(src_text)
+    tgt_boundaries = markup_safe_boundaries(tgt_text)
+    src_ends = {len(src_text) - b for b in src_boundaries if len(src_text) - b <= suffix}
+    tgt_ends = {len(tgt_text) - b for b in tgt_boundaries if len(tgt_text) - b <= suffix}
+    ends = sorted((src_ends & tgt_ends) | {0}, reverse=True)
+    j = min(len(ends) - 1, context_lines)
+    while j < len(ends) - 1 and suffix - ends[j] < min_context_chars:
+        j += 1
+
+    return starts[i], len(src_text) - ends[j], len(tgt_text) - ends[j]
+
+def restrict_to_edit_window(context_lines=2, min_context_chars=2000, url_replacement_str="URL"):
+    """
+    Cuts src_text and tgt_text down to the window around the edit (see edit_window), so that the
+    cleaning, tokenization and diff stages only process the part of the article that ends up in
+    the output. Meant to run right after clean_urls / has_urls_in_text. Not part of the processing
+    chain of run_all_processing.py: its output differs from the full text path, see
+    regression_edit_window.py, which has to pass before it can be added. The character offsets of
+    the windows are kept in src_window / tgt_window, token indices of later stages (e.g.
+    tgt_token_diff) are relative to the window. src_url_offset / tgt_url_offset are the number of
+    URLs before the window, for mapping URL tokens back to src_urls / tgt_urls. Only whole words
+    count, as restrict_grounding_to_max_distance only matches whole URL tokens (not e.g. CURL).
+    """
+    url_token_regex = re.compile(r"(?<!\w){}(?!\w)".format(re.escape(url_replacement_str)))
 
-    try:
-        instance['src_text'] = parse(instance['src_text'])
-        instance['tgt_text'] = parse(instance['tgt_text'])
+    @Profiled.generator
+    def restrict_to_edit_window(instance):
+        src_text, tgt_text = instance["src_text"], instance["tgt_text"]
+        window = edit_window(src_text, tgt_text, context_lines, min_context_chars)
+        if window is not None:
+            start, src_end, tgt_end = window
+            instance["src_window"] = (start, src_end)
+            instance["tgt_window"] = (start, tgt_end)
+            instance["src_url_offset"] = len(url_token_regex.findall(src_text, 0, start))
+            instance["tgt_url_offset"] = len(url_token_regex.findall(tgt_text, 0, start))
+            instance["src_text"] = src_text[start:src_end]
+            instance["tgt_text"] = tgt_text[start:tgt_end]
         yield instance
-    except Exception as e:
-        logging.error("Could not run mwparserfromhell: " + str(e))
-        return
+    return restrict_to_edit_window
+
+def clean_markup(cleaner="mwparserfromhell"):
+    """Strips the markup from src_text and tgt_text with the named backend of markup_cleaners"""
+    clean = markup_cleaner(cleaner)
+
+    @Profiled.generator
+    def clean_markup(instance):
+        section_cache.start_page(instance.get("page_id"))
+        try:
+            instance['src_text'], instance['tgt_text'] = revision_memo.process_pair(
+                ("clean_markup", cleaner), clean, instance['src_text'], instance['tgt_text'])
+            yield instance
+        except Exception as e:
+            logging.error("Could not run the {} markup cleaner: {}".format(cleaner, e))
+            return
+
+    return clean_markup
+
+clean_markup_mediawikiparser = clean_markup("mwparserfromhell")
 
 @Profiled.generator
 def clean_markup_custom(instance):
-    instance['src_text'] = cleanWikiText(instance['src_text'])
-    instance['tgt_text'] = cleanWikiText(instance['tgt_text'])
+    instance['src_text'], instance['tgt_text'] = revision_memo.process_pair(
+        "clean_markup_custom", cleanWikiText, instance['src_text'], instance['tgt_text'])
     yield instance
 
 def tokenize(mode):
@@ -116,8 +497,8 @@ def tokenize(mode):
     
     @Profiled.generator
     def tokenize(instance):
-        instance['src_sents'], instance['src_tokens'] = tokenize_impl(instance['src_text'])
-        instance['tgt_sents'], instance['tgt_tokens'] = tokenize_impl(instance['tgt_text'])
+        (instance['src_sents'], instance['src_tokens']), (instance['tgt_sents'], instance['tgt_tokens']) = \
+            revision_memo.process_pair(("tokenize", mode), tokenize_impl, instance['src_text'], instance['tgt_text'])
         if instance['src_sents'] == None or instance['tgt_sents'] == None:
             return
         yield instance
@@ -126,9 +507,11 @@ def tokenize(mode):
 
 @Profiled.generator
 def prune_to_sentence_diff(instance):
+    def join_sentences(sents): return [" ".join(x) for x in sents]
+
     # create single-string sentence as a first step
-    src_sents = [" ".join(x) for x in instance['src_sents']]
-    tgt_sents = [" ".join(x) for x in instance['tgt_sents']]
+    src_sents, tgt_sents = revision_memo.process_pair(
+        "prune_to_sentence_diff", join_sentences, instance['src_sents'], instance['tgt_sents'])
     src_sent_diff, tgt_sent_diff = diffRevision(src_sents, tgt_sents)
     if len(src_sent_diff) == 0 and len(tgt_sent_diff) == 0:
         return
@@ -140,6 +523,7 @@ def prune_to_sentence_diff(instance):
 
     yield instance
 
+@prefilter(lambda instance: raw_texts_differ(raw_field(instance, "src_text"), raw_field(instance, "tgt_text")))
 @Profiled.generator
 def compute_diff(instance):
     """Given src_tokens and tgt_tokens, computes a token-level diff"""
@@ -203,6 +587,12 @@ def split_into_continuous_edits(instance):
 def filter_additions(min_length, max_length):
     """Filters down to items where text has been ADDED, given a minimum and maximum token length"""
 
+    def may_add_tokens(instance):
+        # at least min_length target tokens, and a diff at all
+        tgt_text = raw_field(instance, "tgt_text")
+        return raw_nonspace_length(tgt_text) >= min_length and raw_texts_differ(raw_field(instance, "src_text"), tgt_text)
+
+    @prefilter(may_add_tokens)
     @Profiled.generator
     def filter_additions(instance):
         len_tgt_diff = len(instance['tgt_token_diff'])
@@ -292,6 +682,11 @@ def extract_sentence_context_around_target(left_sentences=1, right_sentences=1):
 
 def filter_to_min_context(min_left_tokens = None, min_right_tokens = None):
 
+    def may_have_context(instance):
+        # the context tokens are target tokens
+        return raw_nonspace_length(raw_field(instance, "tgt_text")) >= (min_left_tokens or 0) + (min_right_tokens or 0)
+
+    @prefilter(may_have_context)
     @Profiled.generator
     def filter_to_min_context(instance):
         if min_left_tokens:
@@ -0,0 +1,66 @@
+"""
+Interchangeable backends for stripping the markup from wikitext, selected by name (e.g. with
+--markup-cleaner of run_all_processing.py, see generic_extractor.clean_markup). Every backend is
+loaded on first use, so only the libraries of the selected ones need to be installed.
+benchmark_markup_cleaners.py compares their speed and output.
+"""
+
+import re
+
+from wiki_util import cleanWikiText
+from section_cache import SectionCleaningCache
+
+# per page cache of the sections cleaned by mwparserfromhell, max_bytes = 0 parses every text as a whole
+section_cache = SectionCleaningCache()
+
+
+def remove_refs(s): return re.sub(r"</?ref[^>]*>", "", s)
+def remove_misc(s): return re.sub(r"``|''", "", s)
+
+
+def load_mwparserfromhell():
+    """mwparserfromhell's strip_code, through the section cache"""
+    return lambda text: remove_misc(remove_refs(section_cache.strip_code(text)))
+
+
+def load_wiki_util():
+    """The regex passes of wiki_util.cleanWikiText"""
+    return cleanWikiText
+
+
+def load_wikiextractor():
+    """The WikiExtractor port of wikitext_processing, one line per paragraph"""
+    from wikitext_processing import clean_wiki_text
+    return lambda text: "\n".join(clean_wiki_text(text))
+
+
+def load_wikitextparser():
+    """The plain text of wikitextparser's parse tree"""
+    from wikitextparser import parse
+    return lambda text: parse(text).plain_text()
+
+
+def load_mediawiki_parser():
+    """The PEG grammar of mediawiki_parser, see wikihelpers.parse_wikimarkup"""
+    from wikihelpers import parse_wikimarkup
+    return lambda text: str(parse_wikimarkup(text))
+
+
+MARKUP_CLEANERS = {
+    "mwparserfromhell": load_mwparserfromhell,
+    "wiki_util": load_wiki_util,
+    "wikiextractor": load_wikiextractor,
+    "wikitextparser": load_wikitextparser,
+    "mediawiki_parser": load_mediawiki_parser,
+}
+
+loaded_cleaners = {}
+
+
+def markup_cleaner(name):
+    """The function text -> text without markup of the named backend, loading it on first use"""
+    if name not in loaded_cleaners:
+        if name not in MARKUP_CLEANERS:
+            raise ValueError("Unknown markup cleaner {}, choose one of {}".format(name, ", ".join(MARKUP_CLEANERS)))
+        loaded_cleaners[name] = MARKUP_CLEANERS[name]()
+    return loaded_cleaners[name]
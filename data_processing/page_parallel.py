@@ -0,0 +1,86 @@
+"""
+Whole pages (wiki_util.PageHistory) as units of work for a pool of worker processes. Every page is
+processed start to end by one worker, so per-page state (previous texts, revision caches, sha1s)
+stays local to that worker, and results come back in page order. Pages with very many revisions
+can be cut into chunks that are processed in parallel as well.
+"""
+
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from generator_chaining import chain_generators
+from generic_extractor import page_revision_pairs
+
+_page_function = None
+
+
+def _init_worker(page_function):
+    global _page_function
+    _page_function = page_function
+
+
+def _run_page_function(args):
+    return _page_function(*args)
+
+
+def page_chunks(histories, chunk_revisions=None, with_sha1s=False):
+    """
+    Units of work for map_pages: (history, first, earlier_sha1s) for every page, where pages with
+    more than chunk_revisions revisions are cut into chunks overlapping by one revision (see
+    PageHistory.chunk, first=1 for all but the first chunk). With with_sha1s, earlier_sha1s holds
+    the <sha1> of all revisions of the page before the chunk, for revert detection.
+    """
+    for history in histories:
+        if not chunk_revisions or len(history) <= chunk_revisions:
+            yield history, 0, ()
+            continue
+
+        sha1s = set()
+        for start in range(0, len(history), chunk_revisions):
+            stop = min(len(history), start + chunk_revisions)
+            yield history.chunk(start, stop), 1 if start else 0, frozenset(sha1s)
+            if with_sha1s:
+                sha1s.update(history.revision(index).sha1 for index in range(start, stop))
+
+
+def map_pages(page_function, histories, workers=None, prefetch=None, chunk_revisions=None, with_sha1s=False):
+    """
+    Applies page_function(history, first, earlier_sha1s) to every PageHistory (or chunk of one,
+    see page_chunks) in a pool of worker processes and yields (page_offset, page_id, result) in
+    revision order, with at most prefetch units of work in flight. page_offset is None for all but
+    the first chunk of a page.
+    page_function is inherited by the forked workers rather than pickled, so it may be a closure
+    (e.g. over the processor chain). Its results must be picklable.
+    """
+    workers = workers or os.cpu_count() or 1
+    prefetch = prefetch or 4 * workers
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(page_function,)) as executor:
+        pending = deque()
+        for history, first, earlier_sha1s in page_chunks(histories, chunk_revisions, with_sha1s):
+            page_offset = history.page_offset if first == 0 else None
+            future = executor.submit(_run_page_function, (history, first, earlier_sha1s))
+            pending.append((page_offset, history.page_id, future))
+            if len(pending) >= prefetch:
+                page_offset, page_id, future = pending.popleft()
+                yield page_offset, page_id, future.result()
+
+        while pending:
+            page_offset, page_id, future = pending.popleft()
+            yield page_offset, page_id, future.result()
+
+
+def page_processor(processors, revision_filter=None, duplicates=None):
+    """
+    Returns a page function for map_pages, running the revision pairs of a page (see
+    generic_extractor.page_revision_pairs) through processors and returning the list of results.
+    Note that Profiled statistics of the processors are collected in the workers.
+    """
+    def process_page(history, first=0, earlier_sha1s=()):
+        pairs = page_revision_pairs(history, revision_filter, duplicates, first, earlier_sha1s)
+        results = chain_generators(pairs, processors)
+        # resolve lazily decoded texts, only plain values are sent back
+        return [dict(result.items()) if isinstance(result, dict) else result for result in results]
+    return process_page
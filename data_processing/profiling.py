@@ -9,11 +9,62 @@ class StepStats:
         self.elapsed = 0.0
         self.count_in = 0
         
+class PushdownStats:
+    def __init__(self):
+        self.rejected = 0
+        self.bytes_skipped = 0
+
+class PrefilterStats:
+    def __init__(self):
+        self.rejected = 0
+        self.text_bytes = 0
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.evictions = 0
+
 class Profiled:
     """Helper class to add static profiling of functions and generators"""
     perf_stats = OrderedDict()
+    pushdown_stats = OrderedDict()
+    prefilter_stats = OrderedDict()
+    cache_stats = OrderedDict()
+    counters = OrderedDict()
     total_count = 0
 
+    @classmethod
+    def count(cls, name, n=1):
+        """Increments a named counter reported in the summary, e.g. for work skipped by the base generator"""
+        cls.counters[name] = cls.counters.get(name, 0) + n
+
+    @classmethod
+    def record_pushdown(cls, step_name, bytes_skipped):
+        """Records a revision/page rejected by a filter that was pushed down into the dump scanner"""
+        stats = cls.pushdown_stats.setdefault(step_name, PushdownStats())
+        stats.rejected += 1
+        stats.bytes_skipped += bytes_skipped
+
+    @classmethod
+    def record_prefilter(cls, step_name, text_bytes):
+        """Records a revision pair rejected by the admissible pre-filter of step_name, before its texts were decoded"""
+        stats = cls.prefilter_stats.setdefault(step_name, PrefilterStats())
+        stats.rejected += 1
+        stats.text_bytes += text_bytes
+
+    @classmethod
+    def record_cache(cls, cache_name, hits, misses, hit_bytes, miss_bytes, evictions=0):
+        """Records the lookups of a memoizing cache, e.g. the section cache of clean_markup_mediawikiparser"""
+        stats = cls.cache_stats.setdefault(cache_name, CacheStats())
+        stats.hits += hits
+        stats.misses += misses
+        stats.hit_bytes += hit_bytes
+        stats.miss_bytes += miss_bytes
+        stats.evictions += evictions
+
     @classmethod
     def generator(cls, gen_func):
         """Decorate an instance generator with this to add profiling output"""
@@ -50,6 +101,7 @@ class Profiled:
 
         # fix elapsed: generators are nested
         elapsed = [e - e_next for (e, e_next) in zip(elapsed, elapsed[1:] + [timedelta()])]
+        ms_per_item = [e.total_seconds() * 1000 / c if c else 0.0 for (e, c) in zip(elapsed, counts)]
 
         total_elapsed = sum(elapsed, timedelta(0))
         per_item = total_elapsed / total_in
@@ -63,6 +115,41 @@ class Profiled:
             line = "- {}: {:.5f} ms per item / {} total ({:.1f}%)".format(step, elapsed_per_item, elapsed, percent_total)
             summary.append(line)
 
+        if cls.pushdown_stats:
+            summary.append("============================")
+            summary.append("=== Pushdown statistics ====")
+            for step, stats in cls.pushdown_stats.items():
+                line = "- {}: rejected {} in scanner, skipped {:.1f} MB".format(step, stats.rejected, stats.bytes_skipped / (1024 * 1024))
+                summary.append(line)
+
+        if cls.prefilter_stats:
+            # an instance rejected by a prefilter would have run through every step up to the one declaring it
+            first = step_names.index('admissible_prefilters') + 1 if 'admissible_prefilters' in step_names else 0
+            summary.append("============================")
+            summary.append("=== Prefilter statistics ===")
+            for step, stats in cls.prefilter_stats.items():
+                last = step_names.index(step) if step in step_names else first
+                saved = timedelta(milliseconds=stats.rejected * sum(ms_per_item[first:last + 1]))
+                line = "- {}: rejected {} before the chain, {:.1f} MB of text not decoded, ~{} of downstream work saved".format(
+                    step, stats.rejected, stats.text_bytes / (1024 * 1024), saved)
+                summary.append(line)
+
+        if cls.cache_stats:
+            summary.append("============================")
+            summary.append("===== Cache statistics =====")
+            for name, stats in cls.cache_stats.items():
+                lookups = stats.hits + stats.misses
+                line = "- {}: hit rate {:.1f}% ({} of {}), {:.1f} of {:.1f} MB served from cache, {} evictions".format(
+                    name, 100 * stats.hits / max(1, lookups), stats.hits, lookups, stats.hit_bytes / (1024 * 1024),
+                    (stats.hit_bytes + stats.miss_bytes) / (1024 * 1024), stats.evictions)
+                summary.append(line)
+
+        if cls.counters:
+            summary.append("============================")
+            summary.append("===== Other statistics =====")
+            for name, value in cls.counters.items():
+                summary.append("- {}: {}".format(name, value))
+
         summary.append("")
         summary.append(json.dumps(dict((k, v.__dict__) for k,v in cls.perf_stats.items())))
 
@@ -0,0 +1,109 @@
+"""
+Regression check for the block scanning of bz2_blocks.py: writes a synthetic multistream bz2 file
+and decompresses it with iter_blocks (used by the page index of dump_index.py) and with
+ParallelBZ2Reader, first as it is and then with a spurious block magic or end-of-stream magic
+injected into the middle of every block in turn, as if the 48 bits occurred by chance in the
+compressed data. Every run must give the bytes of bz2.decompress.
+
+A real occurrence in a test file cannot be constructed, so the spurious magic is injected by
+wrapping bz2_blocks.find_markers, with a chunk size beyond the file size so that the whole file is
+scanned in one piece. The file without a spurious magic is also scanned in small chunks.
+"""
+
+import bz2
+import sys
+import random
+import argparse
+import logging
+
+import bz2_blocks
+from bz2_blocks import BLOCK, EOS, iter_blocks, ParallelBZ2Reader
+
+find_markers = bz2_blocks.find_markers
+
+
+def synthetic_file(streams, stream_kb, seed=0):
+    """A bz2 file of the given number of streams, each compressed at level 1 (100 KB blocks) from stream_kb KB of text"""
+    rng = random.Random(seed)
+    words = ["river", "bridge", "council", "station", "harbour", "market", "library", "tower", "museum", "park"]
+    parts = []
+    for _ in range(streams):
+        text = []
+        size = 0
+        while size < stream_kb * 1024:
+            line = " ".join(rng.choice(words) + str(rng.randrange(1000)) for _ in range(12)) + "\n"
+            text.append(line)
+            size += len(line)
+        parts.append(bz2.compress("".join(text).encode('utf-8'), 1))
+    return b"".join(parts)
+
+
+def injecting(fake_bit, fake_kind):
+    """find_markers with an additional (fake_bit, fake_kind) marker on the scan from the start of the file"""
+    def find_markers_with_fake(data, start=0):
+        markers = find_markers(data, start)
+        if start == 0 and fake_bit + bz2_blocks.MAGIC_BITS <= len(data) * 8:
+            markers = sorted(markers + [(fake_bit, fake_kind)])
+        return markers
+    return find_markers_with_fake
+
+
+def decompress_with_iter_blocks(path, chunk_size):
+    with open(path, "rb") as f:
+        return b"".join(decompressed for _, _, decompressed in iter_blocks(f, chunk_size))
+
+
+def decompress_with_parallel_reader(path, chunk_size, workers):
+    reader = ParallelBZ2Reader(path, workers=workers, chunk_size=chunk_size)
+    try:
+        return b"".join(iter(reader.read, b""))
+    finally:
+        reader.close()
+
+
+def check(name, decompress, expected):
+    try:
+        data = decompress()
+    except OSError as e:
+        logging.error("{}: {}".format(name, e))
+        return False
+    if data != expected:
+        logging.error("{}: {} bytes decompressed instead of {}".format(name, len(data), len(expected)))
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--streams', type=int, default=2, help='number of bz2 streams of the synthetic file')
+    parser.add_argument('--stream_kb', type=int, default=300, help='KB of text per stream, compressed in 100 KB blocks')
+    parser.add_argument('--small_chunk_size', type=int, default=4096, help='chunk size of the scan in small chunks')
+    parser.add_argument('--workers', type=int, default=2, help='worker processes of the ParallelBZ2Reader')
+    parser.add_argument('--file', type=str, default='./data/regression_bz2_blocks.bz2', help='where to write the synthetic file')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    compressed = synthetic_file(args.streams, args.stream_kb)
+    with open(args.file, "wb") as f:
+        f.write(compressed)
+    expected = bz2.decompress(compressed)
+    chunk_size = len(compressed) + 1
+    blocks = [(bit, next_bit) for (bit, kind), (next_bit, _) in zip(find_markers(compressed), find_markers(compressed)[1:]) if kind == BLOCK]
+    logging.info("{} streams, {} blocks, {} bytes compressed".format(args.streams, len(blocks), len(compressed)))
+
+    failures = 0
+    cases = [("no spurious magic", None, None, chunk_size), ("no spurious magic, small chunks", None, None, args.small_chunk_size)] + [
+        ("spurious {} magic in block {}".format(kind, i + 1), (start + end) // 2, kind, chunk_size)
+        for i, (start, end) in enumerate(blocks) for kind in (BLOCK, EOS)]
+    for name, fake_bit, fake_kind, chunk_size in cases:
+        bz2_blocks.find_markers = find_markers if fake_bit is None else injecting(fake_bit, fake_kind)
+        try:
+            for path_name, decompress in (
+                    ("iter_blocks", lambda: decompress_with_iter_blocks(args.file, chunk_size)),
+                    ("ParallelBZ2Reader", lambda: decompress_with_parallel_reader(args.file, chunk_size, args.workers))):
+                if not check("{}, {}".format(name, path_name), decompress, expected):
+                    failures += 1
+        finally:
+            bz2_blocks.find_markers = find_markers
+    print("{}: {} of {} cases failed".format("FAILED" if failures else "OK", failures, 2 * len(cases)))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,90 @@
+"""
+Regression check and benchmark for the linear-time cleanWikiText: cleans the revision texts at the
+beginning of a dump file with it and with the original chain of re.sub passes (cleanWikiTextRegex),
+both on the raw wikitext and on the mwparserfromhell output that clean_markup_custom gets in the
+processing chain, and compares outputs and running times.
+
+With --adversarial, it also times both on inputs that make the original passes backtrack (unclosed
+tables, links with many pipes) at growing sizes: the original time grows quadratically, the new
+one linearly.
+"""
+
+import re
+import time
+import argparse
+import logging
+
+import mwparserfromhell
+
+from dump_io import open_dump
+from dump_scanner import scan_revision_views
+from wiki_util import cleanWikiText, cleanWikiTextRegex
+
+ADVERSARIAL_INPUTS = {
+    "unclosed tables": lambda n: "<table x" * (n // 8) + "</table",
+    "link with many pipes": lambda n: "[[" + "a|" * (n // 2),
+    "unclosed links": lambda n: "[[a|b" * (n // 5),
+    "unclosed comments": lambda n: "<!--" + "-" * n,
+}
+
+
+def strip_code(text):
+    """The text as clean_markup_mediawikiparser passes it on"""
+    text = str(mwparserfromhell.parse(text).strip_code())
+    return re.sub(r"``|''", "", re.sub(r"</?ref[^>]*>", "", text))
+
+
+def compare(texts, name):
+    """Logs the texts cleaned differently, prints the timings, returns the number of mismatches"""
+    timings = []
+    outputs = []
+    for clean in (cleanWikiTextRegex, cleanWikiText):
+        start_time = time.perf_counter()
+        outputs.append([clean(text) for text in texts])
+        timings.append(time.perf_counter() - start_time)
+
+    mismatches = 0
+    for text, expected, cleaned in zip(texts, *outputs):
+        if expected != cleaned:
+            mismatches += 1
+            logging.warning("{} text cleaned differently: {!r}\n  original: {!r}\n  linear:   {!r}".format(
+                name, text[:200], expected[:200], cleaned[:200]))
+    print("{}: {} of {} texts ({:.1f} MB) differ, original {:.2f}s, linear {:.2f}s ({:.1f}x)".format(
+        name, mismatches, len(texts), sum(map(len, texts)) / 1024**2, timings[0], timings[1], timings[0] / timings[1]))
+    return mismatches
+
+
+def time_adversarial(sizes):
+    for name, make_input in ADVERSARIAL_INPUTS.items():
+        row = []
+        for n in sizes:
+            text = make_input(n)
+            start_time = time.perf_counter()
+            expected = cleanWikiTextRegex(text)
+            original_seconds = time.perf_counter() - start_time
+            cleaned = cleanWikiText(text)
+            row.append("n={}: original {:.3f}s, linear {:.4f}s{}".format(
+                n, original_seconds, time.perf_counter() - start_time - original_seconds, "" if cleaned == expected else " (differs)"))
+        print("{:<22} {}".format(name, " | ".join(row)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dump_file', type=str, required=True)
+    parser.add_argument('--max_mb', type=int, default=20, help='MByte of XML to read texts from')
+    parser.add_argument('--max_texts', type=int, default=2000, help='number of revision texts to compare')
+    parser.add_argument('--adversarial', action='store_true', help='also time the adversarial inputs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='(%(threadName)s) %(message)s')
+
+    texts = []
+    with open_dump(args.dump_file) as stream:
+        for view in scan_revision_views(stream, max_bytes=args.max_mb * 1024 * 1024):
+            texts.append(view.text)
+            if len(texts) >= args.max_texts:
+                break
+
+    compare(texts, "raw wikitext")
+    compare([strip_code(text) for text in texts], "mwparserfromhell output")
+    if args.adversarial:
+        time_adversarial([5000, 10000, 20000])
@@ -0,0 +1,96 @@
+"""
+Regression check for restrict_to_edit_window: runs the processing chain of run_all_processing.py
+over the beginning of a dump file once on the full texts and once with the edit window, and
+compares every field of the outputs apart from WINDOW_FIELDS, which only exist on the windowed path
+or hold indices relative to the window. It fails on any instance that differs or that only one of
+the two paths outputs. The edit window is not part of run_all_processing.py until this passes.
+
+It does not pass yet. Texts and sentences around the edit come out the same on both paths, but
+several full-text results depend on text far from the edit. prune_to_sentence_diff prunes the
+tokens, but extract_sentence_context_around_target then looks those token indices up in the
+unpruned sentences. restrict_grounding_to_max_distance pairs URL tokens with URLs by position, and
+cleaning drops some URL tokens. diffRevision uses difflib, whose junk heuristic for sequences of
+200 or more items depends on the token counts of the whole text.
+"""
+
+import sys
+import time
+import argparse
+import logging
+
+from dump_io import open_dump
+from custom_filters import *
+from generic_extractor import *
+from generator_chaining import chain_generators
+
+WINDOW_FIELDS = {"src_window", "tgt_window", "src_url_offset", "tgt_url_offset",
+                 "src_token_diff", "tgt_token_diff", "src_token_diffs", "tgt_token_diffs"}
+
+
+def processing_chain(edit_window):
+    """The processors of run_all_processing.py up to filter_to_min_context, with or without the edit window"""
+    return list(filter(None, [
+        comment_length(5, 200),
+        exclude_page_types(["Talk:", "User talk:", "Wikipedia talk:", "Template talk:", "User:", "Wikipedia:"]),
+        comment_blocklist_filter(["[[Project:AWB|AWB]]", "[[Project:AutoWikiBrowser|AWB]]", "Undid revision"]),
+        comment_token_length(2, 1000),
+        text_length(5, 10000000),
+        clean_urls(replacement='URL'),
+        has_urls_in_text(look_in_src=True, look_in_tgt=True),
+        edit_window and restrict_to_edit_window(context_lines=2, min_context_chars=2000),
+        clean_markup_mediawikiparser,
+        clean_markup_custom,
+        clean_newlines,
+        tokenize(mode='nltk'),
+        prune_to_sentence_diff,
+        compute_diff,
+        find_continous_edits,
+        filter_single_edit_span,
+        filter_additions(min_length=3, max_length=100),
+        restrict_grounding_to_max_distance(max_token_distance = 20),
+        has_grounding(),
+        extract_sentence_context_around_target(1, 1),
+        filter_to_min_context(min_left_tokens=10),
+    ]))
+
+
+def run(dump_file, edit_window, max_mb):
+    """Returns ({rev_id: fields apart from WINDOW_FIELDS}, seconds)"""
+    start_time = time.perf_counter()
+    with open_dump(dump_file) as stream:
+        pairs = generate_revision_pairs(stream, max_bytes=max_mb * 1024 * 1024)
+        results = {}
+        for instance in chain_generators(pairs, processing_chain(edit_window)):
+            fields = {field: value for field, value in instance.items() if field not in WINDOW_FIELDS}
+            fields["grounding_urls"] = sorted(fields.get("grounding_urls") or [])
+            results[instance["rev_id"]] = fields
+    return results, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dump_file', type=str, required=True)
+    parser.add_argument('--max_mb', type=int, default=100, help='MByte of XML to process')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='(%(threadName)s) %(message)s')
+
+    full, full_seconds = run(args.dump_file, False, args.max_mb)
+    windowed, window_seconds = run(args.dump_file, True, args.max_mb)
+
+    differing = one_sided = 0
+    for rev_id in sorted(set(full) | set(windowed), key=int):
+        if full.get(rev_id) != windowed.get(rev_id):
+            full_fields, windowed_fields = full.get(rev_id) or {}, windowed.get(rev_id) or {}
+            if not full_fields or not windowed_fields:
+                one_sided += 1
+                logging.warning("rev_id {} only in the {} output".format(rev_id, "full text" if full_fields else "edit window"))
+                continue
+            differing += 1
+            fields = [f for f in sorted(set(full_fields) | set(windowed_fields)) if full_fields.get(f) != windowed_fields.get(f)]
+            logging.warning("rev_id {} differs in {}".format(rev_id, ", ".join(fields)))
+
+    print("full text:   {} instances in {:.1f}s".format(len(full), full_seconds))
+    print("edit window: {} instances in {:.1f}s ({:.1f}x)".format(len(windowed), window_seconds, full_seconds / window_seconds))
+    print("{}: {} of {} instances differ, {} only in one output".format(
+        "FAILED" if differing or one_sided else "OK", differing, len(set(full) | set(windowed)), one_sided))
+    sys.exit(1 if differing or one_sided else 0)
@@ -0,0 +1,163 @@
+"""
+Regression check for --resume of run_all_processing.py (see checkpointing.py): writes a synthetic
+bz2 dump with a dump status file pointing to it, processes it once without interruption, and once
+with frequent checkpoints, killing the job (SIGKILL) kills times at evenly spaced shares of
+the output and resuming it each time. The output and the <output>.oversized.tsv of both runs must
+be byte for byte the same, and so must the page watermarks. All jobs run with the same PYTHONHASHSEED,
+as some processors (e.g. restrict_grounding_to_max_distance) emit URLs in set order.
+"""
+
+import os
+import sys
+import bz2
+import time
+import json
+import random
+import signal
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import logging
+import tempfile
+import subprocess
+from xml.sax.saxutils import escape
+
+DUMP_NAME = "synthwiki-20200101-pages-meta-history1.xml-p1p1000.bz2"
+WATERMARKS_NAME = "1.watermarks.sqlite"
+COMMENTS = ["/* History */ added the founding date from the archive", "/* Lead */ copyedit of the lead section",
+            "fix", "Undid revision 123 by Someone", "added a reference to the city council report"]
+
+
+def synthetic_dump(pages, revisions, oversized_every, seed=0):
+    """XML of a dump whose pages grow a sentence with a URL per revision, every oversized_every-th revision is padded to 2 MB"""
+    rng = random.Random(seed)
+    words = ["river", "bridge", "council", "station", "harbour", "market", "library", "tower", "museum", "park"]
+    parts = ["<mediawiki>\n"]
+    rev_id = 0
+    for page in range(pages):
+        parts.append("  <page>\n    <title>{}Synthetic {}</title>\n    <ns>0</ns>\n    <id>{}</id>\n".format(
+            "Talk:" if page % 7 == 0 else "", page, page + 1))
+        sentences = []
+        for revision in range(revisions):
+            rev_id += 1
+            sentences.append("The {} of {} is described at http://example.org/{}/{} and [[{}]].".format(
+                rng.choice(words), rng.choice(words), page, revision, rng.choice(words)))
+            text = "== Section ==\n" + "\n".join(sentences)
+            if oversized_every and rev_id % oversized_every == 0:
+                text += "\n" + "x" * (2 * 1024 * 1024)
+            parts.append(
+                "    <revision>\n      <id>{}</id>\n      <timestamp>2020-01-01T00:{:02d}:00Z</timestamp>\n"
+                "      <contributor>\n        <username>Editor{}</username>\n        <id>{}</id>\n      </contributor>\n"
+                "      <comment>{}</comment>\n      <text xml:space=\"preserve\">{}</text>\n      <sha1>{}</sha1>\n"
+                "    </revision>\n".format(rev_id, revision % 60, rev_id % 5, rev_id % 5, rng.choice(COMMENTS),
+                    escape(text), hashlib.sha1(text.encode('utf-8')).hexdigest()))
+        parts.append("  </page>\n")
+    parts.append("</mediawiki>\n")
+    return "".join(parts).encode('utf-8')
+
+
+def prepare(work_dir, args):
+    """Writes the dump and its dump status file to work_dir, returns the dump status file"""
+    raw_path = os.path.join(work_dir, "raw") + os.sep
+    os.makedirs(raw_path)
+    with bz2.open(os.path.join(raw_path, DUMP_NAME), "wb") as f:
+        f.write(synthetic_dump(args.pages, args.revisions, args.oversized_every))
+    dumpstatus_file = os.path.join(work_dir, "dumpstatus.json")
+    with open(dumpstatus_file, "w") as f:
+        json.dump({"jobs": {"metahistorybz2dump": {"files": {DUMP_NAME: {"url": "/synthwiki/" + DUMP_NAME}}}}}, f)
+    return dumpstatus_file, raw_path
+
+
+def command(dumpstatus_file, raw_path, output_path, checkpoint_interval, resume=False):
+    return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_all_processing.py"),
+            "--index", "1", "--dumpstatus_path", dumpstatus_file, "--temp-path", raw_path,
+            "--output-path", output_path, "--watermarks", os.path.join(output_path, WATERMARKS_NAME),
+            "--checkpoint-interval", str(checkpoint_interval), "--max-revision-mb", "1"] + (["--resume"] if resume else [])
+
+
+def job_environment():
+    return dict(os.environ, PYTHONHASHSEED="0")
+
+
+def run_killed(dumpstatus_file, raw_path, output_path, checkpoint_interval, kill_sizes):
+    """Runs the job, killing it once its output reaches each of kill_sizes and resuming it, returns the number of kills"""
+    output_file = os.path.join(output_path, "1.json")
+    kills = 0
+    for kill_size in kill_sizes + [None]:
+        job = subprocess.Popen(command(dumpstatus_file, raw_path, output_path, checkpoint_interval, resume=kills > 0),
+                               env=job_environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while kill_size is not None and job.poll() is None:
+            if os.path.exists(output_file) and os.path.getsize(output_file) >= kill_size:
+                job.send_signal(signal.SIGKILL)
+                job.wait()
+                kills += 1
+                logging.info("Killed the job at {} bytes of output".format(os.path.getsize(output_file)))
+                break
+            time.sleep(0.01)
+        if job.wait() not in (0, -signal.SIGKILL):
+            raise RuntimeError("The job failed with exit code {}".format(job.returncode))
+    return kills
+
+
+def read_bytes(file_name):
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def read_watermarks(output_path):
+    connection = sqlite3.connect(os.path.join(output_path, WATERMARKS_NAME))
+    try:
+        return connection.execute("SELECT * FROM watermarks ORDER BY page_id").fetchall()
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=300, help='number of pages of the synthetic dump')
+    parser.add_argument('--revisions', type=int, default=12, help='number of revisions per page')
+    parser.add_argument('--oversized_every', type=int, default=97, help='every n-th revision exceeds --max-revision-mb, 0 for none')
+    parser.add_argument('--checkpoint_interval', type=int, default=1, help='seconds between checkpoints, the output and side files after the last one are written again on resume')
+    parser.add_argument('--kills', type=int, default=3, help='number of times the job is killed and resumed')
+    parser.add_argument('--work_dir', type=str, default=None, help='directory for the dump and outputs, kept afterwards [default: a temporary directory]')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="regression_resume_")
+    try:
+        dumpstatus_file, raw_path = prepare(work_dir, args)
+        full_path, resumed_path = os.path.join(work_dir, "full"), os.path.join(work_dir, "resumed")
+        os.makedirs(full_path)
+        os.makedirs(resumed_path)
+
+        start_time = time.perf_counter()
+        subprocess.run(command(dumpstatus_file, raw_path, full_path, args.checkpoint_interval), check=True, env=job_environment(),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        full_output = read_bytes(os.path.join(full_path, "1.json"))
+        logging.info("Uninterrupted run: {} bytes of output in {:.1f}s".format(len(full_output), time.perf_counter() - start_time))
+
+        kill_sizes = [len(full_output) * (i + 1) // (args.kills + 1) for i in range(args.kills)]
+        kills = run_killed(dumpstatus_file, raw_path, resumed_path, args.checkpoint_interval, kill_sizes)
+        if kills < args.kills:
+            logging.warning("The job finished before it was killed {} times, only {} kills".format(args.kills, kills))
+
+        failures = 0
+        for name in ("1.json", "1.json.oversized.tsv"):
+            full, resumed = read_bytes(os.path.join(full_path, name)), read_bytes(os.path.join(resumed_path, name))
+            if full != resumed:
+                failures += 1
+                logging.error("{} differs: {} bytes uninterrupted, {} bytes resumed".format(
+                    name, len(full or b""), len(resumed or b"")))
+            else:
+                logging.info("{} is the same ({} bytes, {} lines)".format(name, len(full or b""), (full or b"").count(b"\n")))
+        if read_watermarks(full_path) != read_watermarks(resumed_path):
+            failures += 1
+            logging.error("The page watermarks differ")
+        print("{} after {} kills".format("FAILED" if failures else "OK", kills))
+        sys.exit(1 if failures else 0)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
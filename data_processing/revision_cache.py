@@ -0,0 +1,56 @@
+"""
+Bounded, compressed LRU cache of revision texts, used to pair revisions with their <parentid>
+"""
+
+import zlib
+from collections import OrderedDict
+
+
+class RevisionTextCache:
+    """
+    Maps rev_id -> zlib compressed revision text (utf-8 bytes). Entries are evicted in least recently
+    used order once the compressed size exceeds max_bytes, so memory stays bounded even for pages
+    with tens of thousands of revisions. Meant to be cleared at every page boundary.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, compression_level=1):
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, rev_id, text_bytes):
+        """Stores text_bytes (any bytes-like object) for rev_id"""
+        compressed = zlib.compress(text_bytes, self.compression_level)
+        if len(compressed) > self.max_bytes:
+            return
+
+        if rev_id in self.entries:
+            self.size -= len(self.entries.pop(rev_id))
+        self.entries[rev_id] = compressed
+        self.size += len(compressed)
+
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def get(self, rev_id):
+        """Returns the decoded text for rev_id, or None if it is not (or no longer) cached"""
+        compressed = self.entries.get(rev_id)
+        if compressed is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(rev_id)
+        self.hits += 1
+        return zlib.decompress(compressed).decode('utf-8')
+
+    def __contains__(self, rev_id):
+        return rev_id in self.entries
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
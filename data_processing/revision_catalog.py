@@ -0,0 +1,164 @@
+"""
+Metadata-only catalog of the revisions in the history dump files, stored in SQLite.
+
+Building the catalog reads the revision headers only: text bodies are streamed past without being
+buffered or decoded (their byte length comes from the bytes="..." attribute of <text>), and nothing
+is paired or cleaned. Experiments can then choose candidate revisions by comment, section title,
+user, timestamp or text length with a query instead of rescanning the dumps, e.g.
+
+    SELECT rev_id FROM revision_catalog WHERE ns = 0 AND comment LIKE '%cite%' AND text_bytes < 100000
+"""
+
+import os
+import time
+import glob
+import sqlite3
+import argparse
+import logging
+
+from dump_io import open_dump, prefer_transcoded
+from dump_scanner import scan_revision_headers
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dumps (
+    dump_file TEXT PRIMARY KEY,
+    revisions INTEGER,
+    uncompressed_bytes INTEGER,
+    complete INTEGER
+);
+CREATE TABLE IF NOT EXISTS pages (
+    page_id INTEGER,
+    dump_file TEXT,
+    page_offset INTEGER,
+    ns INTEGER,
+    title TEXT,
+    PRIMARY KEY (dump_file, page_id)
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    rev_id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    page_id INTEGER,
+    dump_file TEXT,
+    timestamp TEXT,
+    username TEXT,
+    userip TEXT,
+    comment TEXT,
+    text_bytes INTEGER,
+    sha1 TEXT
+);
+CREATE INDEX IF NOT EXISTS pages_by_id ON pages (page_id);
+CREATE INDEX IF NOT EXISTS revisions_by_page ON revisions (dump_file, page_id);
+CREATE VIEW IF NOT EXISTS revision_catalog AS
+    SELECT r.*, p.ns, p.title, p.page_offset FROM revisions r JOIN pages p ON r.dump_file = p.dump_file AND r.page_id = p.page_id;
+"""
+
+# the tables of catalogs written before pages were keyed per dump file, which are catalogued again
+OUTDATED_SCHEMA = """
+DROP VIEW IF EXISTS revision_catalog;
+DROP TABLE IF EXISTS revisions;
+DROP TABLE IF EXISTS pages;
+DELETE FROM dumps;
+"""
+
+
+def _int_or_none(value):
+    return int(value) if value else None
+
+
+class RevisionCatalog:
+    """The catalog database: one row per revision, and one per page with its dump file and offset"""
+
+    def __init__(self, catalog_file):
+        self.catalog_file = catalog_file
+        self.connection = sqlite3.connect(catalog_file)
+        self.connection.row_factory = sqlite3.Row
+        revision_columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(revisions)")]
+        if revision_columns and "dump_file" not in revision_columns:
+            logging.warning("The catalog {} lists pages without their dump file, all dump files are catalogued again".format(catalog_file))
+            self.connection.executescript(OUTDATED_SCHEMA)
+        self.connection.executescript(SCHEMA)
+
+    def contains(self, dump_file):
+        """Whether the revisions of dump_file have been catalogued completely"""
+        row = self.connection.execute("SELECT complete FROM dumps WHERE dump_file = ?",
+            (os.path.basename(dump_file),)).fetchone()
+        return bool(row and row["complete"])
+
+    def remove(self, dump_file):
+        dump_name = os.path.basename(dump_file)
+        with self.connection:
+            self.connection.execute("DELETE FROM revisions WHERE dump_file = ?", (dump_name,))
+            self.connection.execute("DELETE FROM pages WHERE dump_file = ?", (dump_name,))
+            self.connection.execute("DELETE FROM dumps WHERE dump_file = ?", (dump_name,))
+
+    def add_dump(self, dump_file, workers=None, max_bytes=None):
+        """Catalogs the revisions of dump_file (read from its transcoding if there is one), returns the revision count"""
+        dump_name = os.path.basename(dump_file)
+        self.remove(dump_file)
+        start_time = time.time()
+
+        revisions = []
+        last_page_offset = None
+        count = 0
+        with open_dump(prefer_transcoded(dump_file), workers=workers) as stream:
+            for page_offset, page_ns, header, text_bytes, sha1 in scan_revision_headers(stream, SCAN_CHUNK_SIZE, max_bytes):
+                if page_offset != last_page_offset:
+                    # INSERT OR IGNORE: a page listed twice in a dump file keeps the offset of its first part
+                    self.connection.execute("INSERT OR IGNORE INTO pages VALUES (?, ?, ?, ?, ?)",
+                        (int(header.page_id), dump_name, page_offset, _int_or_none(page_ns), header.page_title))
+                    last_page_offset = page_offset
+
+                revisions.append((int(header.rev_id), _int_or_none(header.parent_id), int(header.page_id), dump_name,
+                    header.timestamp, header.username or None, header.userip or None, header.comment,
+                    text_bytes, sha1 or None))
+                if len(revisions) >= BATCH_SIZE:
+                    count += self._insert_revisions(revisions)
+            uncompressed_bytes = stream.tell()
+
+        count += self._insert_revisions(revisions)
+        with self.connection:
+            # a catalog built from the first max_bytes only is not complete
+            self.connection.execute("INSERT INTO dumps VALUES (?, ?, ?, ?)", (dump_name, count, uncompressed_bytes, int(max_bytes is None)))
+        logging.info("Catalogued {} revisions of {} in {:.0f}s".format(count, dump_file, time.time() - start_time))
+        return count
+
+    def _insert_revisions(self, revisions):
+        with self.connection:
+            # INSERT OR REPLACE: a revision listed twice (e.g. at the boundary of two dump files) is kept once
+            self.connection.executemany("INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", revisions)
+        n = len(revisions)
+        revisions.clear()
+        return n
+
+    def query(self, sql, params=()):
+        """Runs a query, e.g. against the revision_catalog view, returning sqlite3.Row objects"""
+        return self.connection.execute(sql, params)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-path', type=str, default="./data/raw/", help='the data directory with the downloaded dump files')
+    parser.add_argument('--dump_file', type=str, default=None, help='catalog only this file instead of all .bz2/.7z files in --data-path')
+    parser.add_argument('--catalog', type=str, default="./data/revision_catalog.sqlite", help='the catalog database file')
+    parser.add_argument('--decompress-workers', type=int, default=1, help='number of processes decompressing the bz2 input')
+    parser.add_argument('--max_mb', type=int, default=None, help='if given, only catalogs the first max_mb MByte of each file')
+    parser.add_argument('--overwrite', action='store_true', help='catalog again even if the file is in the catalog')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    dump_files = [args.dump_file] if args.dump_file else sorted(
+        glob.glob(os.path.join(args.data_path, "*.bz2")) + glob.glob(os.path.join(args.data_path, "*.7z")))
+    catalog = RevisionCatalog(args.catalog)
+    for dump_file in dump_files:
+        if catalog.contains(dump_file) and not args.overwrite:
+            logging.info("Already catalogued, Skip: " + dump_file)
+            continue
+        catalog.add_dump(dump_file, workers=args.decompress_workers,
+            max_bytes=args.max_mb and args.max_mb * 1024 * 1024)
+    catalog.close()
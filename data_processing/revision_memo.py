@@ -0,0 +1,47 @@
+"""
+Reuse of the per-revision processing between adjacent revision pairs. With pairing by stream order,
+revision N is the tgt_text of pair N-1 and the src_text of pair N, so every stage that processes
+the two sides independently (URL cleaning, markup cleaning, newline cleaning, tokenization, sentence
+joining) would otherwise do the same work on it twice.
+"""
+
+from profiling import Profiled
+
+
+class AdjacentRevisionMemo:
+    """
+    Keeps, for every stage, the output computed for the tgt side of the latest pair together with
+    its input. The src side of the next pair takes that output when its input is equal, so reuse
+    never changes results: pairs dropped in between, parent_id pairing, or src/tgt edit windows that
+    differ only turn hits into misses. Stage outputs are shared between the two instances and must
+    not be modified in place by later stages.
+    """
+    def __init__(self, enabled=True, name="adjacent revisions"):
+        self.enabled = enabled
+        self.name = name
+        self.latest = {}
+
+    def process_pair(self, stage, process, src_input, tgt_input):
+        """Returns (process(src_input), process(tgt_input)), reusing the previous tgt output for src"""
+        if not self.enabled:
+            return process(src_input), process(tgt_input)
+
+        latest = self.latest.get(stage)
+        size = len(src_input) if isinstance(src_input, str) else 0
+        if latest is not None and (latest[0] is src_input or latest[0] == src_input):
+            src_output = latest[1]
+            Profiled.record_cache(self.name, 1, 0, size, 0)
+        else:
+            src_output = process(src_input)
+            Profiled.record_cache(self.name, 0, 1, 0, size)
+
+        tgt_output = src_output if tgt_input is src_input or tgt_input == src_input else process(tgt_input)
+        self.latest[stage] = (tgt_input, tgt_output)
+        return src_output, tgt_output
+
+    def clear(self):
+        self.latest.clear()
+
+
+# shared by the stages of generic_extractor and custom_filters, enabled = False processes both sides
+revision_memo = AdjacentRevisionMemo()
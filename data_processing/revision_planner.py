@@ -0,0 +1,150 @@
+"""
+Two-phase processing of a selection of revisions: the selection is resolved against the revision
+catalog (see revision_catalog.py), grouped by dump file and page, and only the pages holding selected
+revisions are decompressed, through the page index of the transcoded .zst file (see zstd_dump.py) or
+of the .bz2 file (see dump_index.py, built on first use). The revision pairs of the selected
+revisions then run through the processor chain of run_all_processing.py.
+
+A selection is a SQL condition on the revision_catalog view, a pandas DataFrame.query expression
+over the same view (loads the whole catalog, requires pandas), or a file with one rev_id per line.
+"""
+
+import os
+import io
+import time
+import argparse
+import logging
+from collections import OrderedDict
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+from tqdm import tqdm
+
+from profiling import Profiled
+from dump_io import prefer_transcoded
+from dump_index import Bz2PageIndex
+from zstd_dump import ZstdDumpReader
+from dump_scanner import DumpScanner
+from revision_catalog import RevisionCatalog
+from generator_chaining import chain_generators
+from generic_extractor import page_revision_pairs, insert_prefilters
+
+SELECTED_COLUMNS = "dump_file, page_offset, page_id, rev_id"
+
+
+def select_revisions(catalog, where=None, pandas_query=None, rev_ids=None):
+    """Returns the (dump_file, page_offset, page_id, rev_id) of the selected revisions"""
+    if rev_ids is not None:
+        catalog.query("CREATE TEMP TABLE IF NOT EXISTS selected_revisions (rev_id INTEGER PRIMARY KEY)")
+        catalog.query("DELETE FROM selected_revisions")
+        catalog.connection.executemany("INSERT OR IGNORE INTO selected_revisions VALUES (?)", ((int(r),) for r in rev_ids))
+        rows = catalog.query("SELECT {} FROM revision_catalog WHERE rev_id IN (SELECT rev_id FROM selected_revisions)".format(SELECTED_COLUMNS))
+    elif pandas_query is not None:
+        if pandas is None:
+            raise ImportError("Selecting revisions with a pandas query requires pandas (pip install pandas)")
+        frame = pandas.read_sql_query("SELECT * FROM revision_catalog", catalog.connection).query(pandas_query)
+        rows = frame[SELECTED_COLUMNS.split(", ")].itertuples(index=False)
+    else:
+        rows = catalog.query("SELECT {} FROM revision_catalog WHERE {}".format(SELECTED_COLUMNS, where or "1"))
+    return [tuple(row) for row in rows]
+
+
+def plan(selected):
+    """Groups selected revisions by dump file, then page: {dump_file: [(page_offset, page_id, rev_ids)]} in file order"""
+    pages = {}
+    for dump_file, page_offset, page_id, rev_id in selected:
+        pages.setdefault((dump_file, page_offset, page_id), set()).add(str(rev_id))
+
+    grouped = OrderedDict()
+    for (dump_file, page_offset, page_id), rev_ids in sorted(pages.items()):
+        grouped.setdefault(dump_file, []).append((page_offset, page_id, rev_ids))
+    return grouped
+
+
+def open_page_source(dump_file):
+    """Random access to the pages of dump_file: an object with get_page(page_id) and bytes_decompressed"""
+    dump_file = prefer_transcoded(dump_file)
+    if dump_file.endswith('.zst'):
+        return ZstdDumpReader(dump_file)
+    if dump_file.endswith('.bz2'):
+        return Bz2PageIndex(dump_file)
+    raise ValueError("No random access to the pages of {}, transcode it first (wiki_dump_transcode.py)".format(dump_file))
+
+
+def selected_revision_pairs(data_path, planned, duplicates=None, stats=None):
+    """
+    Yields the instances of generate_revision_pairs (pairing='stream') for the planned revisions,
+    fetching only their pages. stats, if given, is updated with the bytes decompressed per dump file.
+    """
+    for dump_file, pages in planned.items():
+        source = open_page_source(os.path.join(data_path, dump_file))
+        try:
+            for page_offset, page_id, rev_ids in tqdm(pages, dump_file, mininterval=3.0):
+                page = source.get_page(page_id)
+                history = DumpScanner(io.BytesIO(page), chunk_size=len(page) + 1).next_page_history()
+                # all revisions of the page are scanned (for sha1 duplicates), only the selected ones are decoded
+                for instance in page_revision_pairs(history, duplicates=duplicates):
+                    if instance["rev_id"] in rev_ids:
+                        yield instance
+        finally:
+            if stats is not None:
+                stats[dump_file] = source.bytes_decompressed
+            if hasattr(source, 'close'):
+                source.close()
+
+
+def report(catalog, planned, stats):
+    """Logs the bytes decompressed compared to a full scan of the same dump files"""
+    total_decompressed = total_full = 0
+    for dump_file, decompressed in stats.items():
+        row = catalog.query("SELECT uncompressed_bytes FROM dumps WHERE dump_file = ?", (dump_file,)).fetchone()
+        full = row["uncompressed_bytes"] if row and row["uncompressed_bytes"] else 0
+        total_decompressed += decompressed
+        total_full += full
+        logging.info("{}: {} pages, decompressed {:.1f} MB of {:.1f} MB".format(
+            dump_file, len(planned[dump_file]), decompressed / 1024**2, full / 1024**2))
+    if total_full:
+        logging.info("Decompressed {:.1f} MB instead of {:.1f} MB for a full scan ({:.2f}%)".format(
+            total_decompressed / 1024**2, total_full / 1024**2, 100 * total_decompressed / total_full))
+
+
+if __name__ == '__main__':
+    from run_all_processing import processing_chain
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--catalog', type=str, default="./data/revision_catalog.sqlite", help='the catalog database file')
+    parser.add_argument('--data-path', type=str, default="./data/raw/", help='the data directory with the dump files')
+    parser.add_argument('--output_file', type=str, required=True)
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--where', type=str, help="SQL condition on the revision_catalog view, e.g. \"ns = 0 AND comment LIKE '%%cite%%'\"")
+    selection.add_argument('--pandas-query', type=str, help='pandas DataFrame.query expression on the revision_catalog view')
+    selection.add_argument('--rev_ids', type=str, help='file with one rev_id per line')
+    parser.add_argument('--sha1-duplicates', type=str, default='keep', choices=['drop', 'tag', 'keep'], help='as in run_all_processing.py')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    catalog = RevisionCatalog(args.catalog)
+    rev_ids = None
+    if args.rev_ids:
+        with open(args.rev_ids, "r", encoding='utf-8') as f:
+            rev_ids = [line.strip() for line in f if line.strip()]
+    start_time = time.time()
+    selected = select_revisions(catalog, where=args.where, pandas_query=args.pandas_query, rev_ids=rev_ids)
+    planned = plan(selected)
+    logging.info("Selected {} revisions on {} pages of {} dump files in {:.1f}s".format(
+        len(selected), sum(map(len, planned.values())), len(planned), time.time() - start_time))
+
+    stats = OrderedDict()
+    with open(args.output_file, "w", buffering=1, encoding='utf-8') as json_output_stream:
+        processors = insert_prefilters(processing_chain(json_output_stream))
+        duplicates = None if args.sha1_duplicates == 'keep' else args.sha1_duplicates
+        pairs = selected_revision_pairs(args.data_path, planned, duplicates=duplicates, stats=stats)
+        for _ in chain_generators(pairs, processors):
+            Profiled.total_count += 1
+
+    report(catalog, planned, stats)
+    logging.info(Profiled.summarize(processors))
+    catalog.close()
@@ -2,7 +2,7 @@
 Downloads (on-demand) a range of dump files and processes them according to filters and processors specified below.
 """
 
-import os, io, argparse
+import os, io, sys, argparse
 import logging
 import urllib
 
@@ -13,10 +13,15 @@ from wiki_dump_download import existFile, get_dump_task
 from wikihelpers import estimate_article_count_from_filename
 
 from profiling import Profiled
+from dump_io import open_dump, prefer_transcoded
+from page_parallel import map_pages, page_processor
+from checkpointing import Checkpointer, load_checkpoint, resume_from_checkpoint
+from watermarks import WatermarkStore
 from generator_chaining import chain_generators
 from custom_filters import *
 from custom_extractors import *
 from generic_extractor import *
+from markup_cleaners import MARKUP_CLEANERS
 
 def download_on_demand(url, dump_file, temp_path, compress_type):
     # Hack for HPC: cert verification issues
@@ -31,44 +36,13 @@ def download_on_demand(url, dump_file, temp_path, compress_type):
 def scriptdir(filename):
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
 
-def process(input_stream, base_generator, processors):
-    """Applies the base_generator on input_stream, then chains processor steps in processors, finally uses extractor to write to output_stream"""
-    iterable = tqdm(base_generator(input_stream), "baseline generator", mininterval=3.0)
-    results = chain_generators(iterable, processors)
-    for _ in tqdm(results, "final results", mininterval=3.0):
-        Profiled.total_count += 1
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('--index', type=int, help='the index of the file (within the dump status file) to download and process')
-    parser.add_argument('--dumpstatus_path', type=str, default='./data/dumpstatus.json')
-    parser.add_argument('--temp-path', type=str, default="./data/raw/", help='the temp / data directory, used to download wiki dump files')
-    parser.add_argument('--output-path', type=str, default="./data/out/", help='the output directory')
-    parser.add_argument('--compress-type', type=str, default='bz2', help='the compressed file type to download: 7z or bz2 [default: bz2]')
-    parser.add_argument('--max_mb', type=int, default=None, help='if given, only processes the first max_mb MByte from the file and then stops')
-
-    parser.add_argument('--azure', action='store_true')
-    args = parser.parse_args()
-    logging.basicConfig(level=logging.DEBUG, format='(%(threadName)s) %(message)s')
-
-    logging.info("Determining dump task..")
-    dump_tasks = get_dump_task(args.dumpstatus_path, args.temp_path, args.compress_type, args.index, args.index, azure=False)
-    url, dump_file, cur_progress, total_num = dump_tasks.assign_task()
-    article_count = estimate_article_count_from_filename(dump_file)
-
-    download_on_demand(url, dump_file, args.temp_path, args.compress_type)
-    output_file = os.path.join(args.output_path, "{}.json".format(args.index))
-    logging.info("Dumped to " + dump_file + " processing to " + output_file)
-    if article_count: logging.info("Estimating count of {} articles".format(article_count))
-    if args.max_mb: logging.info("Restricting to the first {} MByte of the raw XML".format(args.max_mb))
-
-    wiki_input_stream = open_azure_input_stream() if args.azure else bz2.open(dump_file, "rt", encoding='utf-8')
-    json_output_stream = io.StringIO() if args.azure else open(output_file, "w", buffering=1, encoding='utf-8')
-
-    max_bytes = args.max_mb and 1024*1024* args.max_mb
-
+def processing_chain(json_output_stream, markup_cleaner="mwparserfromhell"):
+    """
+    The filters and processors applied to every revision pair, ending with the extractor writing to json_output_stream.
+    markup_cleaner names the backend stripping the wikitext markup (see markup_cleaners.py).
+    """
     ### chose processing and filtering steps here:
-    processors = [
+    return [
         ## has_section_title,
         comment_length(5, 200),
         exclude_page_types(["Talk:", "User talk:", "Wikipedia talk:", "Template talk:", "User:", "Wikipedia:"]),
@@ -79,7 +53,7 @@ if __name__ == "__main__":
         clean_urls(replacement='URL'),
         has_urls_in_text(look_in_src=True, look_in_tgt=True),
         ## grounding_domain_whitelist(file=scriptdir("domains-official.txt")), ## NOTE: disabled for now
-        clean_markup_mediawikiparser,
+        clean_markup(markup_cleaner),
         clean_markup_custom,
         clean_newlines,
         tokenize(mode='nltk'), ## NOTE: mode can be 'spacy' or 'nltk'
@@ -108,14 +82,138 @@ if __name__ == "__main__":
         #     'grounding_urls', "grounding_docs", "grounding_canonical_urls", "grounding_snippets"]),
         save_to_disk(json_output_stream, NDJsonExtractor()) # chose extractor here
     ]
-    
-    process(
-        wiki_input_stream,
-        base_generator = partial(generate_revision_pairs, max_bytes=max_bytes), # chose base generator here
-        processors=processors
-    )
-    
+
+def process(input_stream, base_generator, processors):
+    """Applies the base_generator on input_stream, then chains processor steps in processors, finally uses extractor to write to output_stream"""
+    iterable = tqdm(base_generator(input_stream), "baseline generator", mininterval=3.0)
+    results = chain_generators(iterable, processors)
+    for _ in tqdm(results, "final results", mininterval=3.0):
+        Profiled.total_count += 1
+
+def process_pages(input_stream, processors, workers, max_bytes=None, duplicates=None, checkpointer=None, chunk_revisions=None,
+        max_revision_bytes=None, on_oversized=None, watermarks=None):
+    """
+    Like process, but dispatches whole pages (or chunks of chunk_revisions revisions of large pages)
+    to worker processes. Only the final step (the extractor) runs here, and the page watermarks
+    are recorded here once the output of a page has been written
+    """
+    page_filter, revision_filter = pushdown_filters(processors)
+    histories = split_page_histories(input_stream, max_bytes=max_bytes, page_filter=page_filter, on_skip=Profiled.record_pushdown,
+        max_revision_bytes=max_revision_bytes, on_oversized=counting_oversized(on_oversized))
+    last_revisions = {}
+    if watermarks is not None:
+        def remember_last_revision(histories):
+            for history in histories:
+                if len(history):
+                    last_revisions[history.page_id] = (history[-1].rev_id, history[-1].timestamp)
+                yield history
+        histories = remember_last_revision(histories)
+    *page_steps, extractor = processors
+    results = map_pages(page_processor(page_steps, revision_filter, duplicates), histories, workers,
+        chunk_revisions=chunk_revisions, with_sha1s=bool(duplicates))
+    for page_offset, page_id, instances in tqdm(results, "pages", mininterval=3.0):
+        if checkpointer and page_offset is not None: checkpointer.page_boundary(page_offset, page_id)
+        for _ in chain_generators(instances, [extractor]):
+            Profiled.total_count += 1
+        if page_id in last_revisions:
+            watermarks.record(page_id, *last_revisions.pop(page_id))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--index', type=int, help='the index of the file (within the dump status file) to download and process')
+    parser.add_argument('--dumpstatus_path', type=str, default='./data/dumpstatus.json')
+    parser.add_argument('--temp-path', type=str, default="./data/raw/", help='the temp / data directory, used to download wiki dump files')
+    parser.add_argument('--output-path', type=str, default="./data/out/", help='the output directory')
+    parser.add_argument('--compress-type', type=str, default='bz2', help='the compressed file type to download: 7z or bz2 [default: bz2]')
+    parser.add_argument('--max_mb', type=int, default=None, help='if given, only processes the first max_mb MByte from the file and then stops')
+    parser.add_argument('--pairing', type=str, default='stream', choices=['stream', 'parent_id'], help='pair revisions with their predecessor in the dump (stream) or with their <parentid> revision (parent_id)')
+    parser.add_argument('--sha1-duplicates', type=str, default='keep', choices=['drop', 'tag', 'keep'], help='drop/tag revision pairs whose target text is identical to the source or restores an earlier revision (by <sha1>) [default: keep, no check]')
+    parser.add_argument('--revision-cache-mb', type=int, default=256, help='memory ceiling of the compressed per-page revision cache used by --pairing parent_id')
+    parser.add_argument('--section-cache-mb', type=int, default=64, help='memory ceiling of the per-page cache of sections cleaned by mwparserfromhell, 0 disables it')
+    parser.add_argument('--markup-cleaner', type=str, default='mwparserfromhell', choices=sorted(MARKUP_CLEANERS), help='the backend stripping the wikitext markup, see benchmark_markup_cleaners.py for their speed and output [default: mwparserfromhell]')
+    parser.add_argument('--no-revision-reuse', action='store_true', help='process the source revision of every pair again instead of reusing its processing as the target of the previous pair')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint of a killed run instead of starting over')
+    parser.add_argument('--checkpoint-interval', type=int, default=300, help='seconds between checkpoints of the output/input position')
+    parser.add_argument('--max-revision-mb', type=float, default=None, help='skip revisions larger than this without buffering them, they are listed in <output>.oversized.tsv')
+    parser.add_argument('--page-workers', type=int, default=1, help='number of processes running the processors on whole pages in parallel [default: 1, no pool]')
+    parser.add_argument('--page-chunk-revisions', type=int, default=None, help='with --page-workers, cut pages with more revisions than this into chunks processed in parallel')
+    parser.add_argument('--decompress-workers', type=int, default=1, help='number of processes decompressing bz2 blocks / zstd frames in parallel [default: 1, sequential]')
+    parser.add_argument('--watermarks', type=str, default=None, help='record the last processed revision of every page in this store [default: none, or <output-path>/<index>.watermarks.sqlite with --since-watermark]')
+    parser.add_argument('--since-watermark', action='store_true', help='only process revision pairs whose target is newer than the page watermark, e.g. for a new monthly dump, and record the new watermarks')
+
+    parser.add_argument('--azure', action='store_true')
+    args = parser.parse_args()
+    if args.page_workers > 1 and args.pairing != 'stream':
+        parser.error("--page-workers only supports --pairing stream")
+    if args.page_workers > 1 and args.since_watermark:
+        parser.error("--since-watermark is not supported with --page-workers")
+    logging.basicConfig(level=logging.DEBUG, format='(%(threadName)s) %(message)s')
+
+    logging.info("Determining dump task..")
+    dump_tasks = get_dump_task(args.dumpstatus_path, args.temp_path, args.compress_type, args.index, args.index, azure=False)
+    url, dump_file, cur_progress, total_num = dump_tasks.assign_task()
+    article_count = estimate_article_count_from_filename(dump_file)
+
+    dump_file = prefer_transcoded(dump_file)
+    if dump_file.endswith("." + args.compress_type):
+        download_on_demand(url, dump_file, args.temp_path, args.compress_type)
+    output_file = os.path.join(args.output_path, "{}.json".format(args.index))
+    logging.info("Dumped to " + dump_file + " processing to " + output_file)
+    if article_count: logging.info("Estimating count of {} articles".format(article_count))
+    if args.max_mb: logging.info("Restricting to the first {} MByte of the raw XML".format(args.max_mb))
+
+    checkpoint_file = output_file + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_file) if args.resume and not args.azure else None
+    if checkpoint and checkpoint["done"]:
+        logging.info("Task %d was already completed according to %s" % (args.index, checkpoint_file))
+        sys.exit(0)
+
+    sequential_bz2 = not args.azure and args.decompress_workers <= 1 and dump_file.endswith(".bz2")
+    compressed_input_stream = open(dump_file, "rb") if sequential_bz2 else None
+    if args.azure:
+        wiki_input_stream = open_azure_input_stream()
+    elif not sequential_bz2:
+        wiki_input_stream = open_dump(dump_file, workers=args.decompress_workers)
+    else:
+        wiki_input_stream = bz2.open(compressed_input_stream, "rb")
+    if checkpoint:
+        json_output_stream = resume_from_checkpoint(checkpoint, wiki_input_stream, output_file)
+    else:
+        json_output_stream = io.StringIO() if args.azure else open(output_file, "w", buffering=1, encoding='utf-8')
+    # one store per task by default, the jobs of a cluster run would contend for a shared SQLite file
+    watermarks_file = args.watermarks or (args.since_watermark and os.path.join(args.output_path, "{}.watermarks.sqlite".format(args.index)))
+    watermarks = None if args.azure or not watermarks_file else WatermarkStore(watermarks_file)
+    checkpointer = None if args.azure else Checkpointer(checkpoint_file, json_output_stream,
+        compressed_input_stream, interval_seconds=args.checkpoint_interval, watermarks=watermarks)
+
+    max_bytes = args.max_mb and 1024*1024* args.max_mb
+    max_revision_bytes = args.max_revision_mb and int(1024*1024* args.max_revision_mb)
+    oversized_log = None if args.azure else OversizedRevisionLog(output_file + ".oversized.tsv", append=bool(checkpoint))
+
+    section_cache.max_bytes = 1024*1024*args.section_cache_mb
+    revision_memo.enabled = not args.no_revision_reuse
+    processors = processing_chain(json_output_stream, args.markup_cleaner)
+    processors = insert_prefilters(processors) # cheap, admissible pre-filters derived from the expensive filters
+    duplicates = None if args.sha1_duplicates == 'keep' else args.sha1_duplicates
+    if args.page_workers > 1:
+        process_pages(wiki_input_stream, processors, args.page_workers, max_bytes=max_bytes,
+            duplicates=duplicates, checkpointer=checkpointer, chunk_revisions=args.page_chunk_revisions,
+            max_revision_bytes=max_revision_bytes, on_oversized=oversized_log, watermarks=watermarks)
+    else:
+        process(
+            wiki_input_stream,
+            base_generator = partial(generate_revision_pairs, max_bytes=max_bytes, pushdown_from=processors,
+                pairing=args.pairing, revision_cache_bytes=1024*1024*args.revision_cache_mb,
+                duplicates=duplicates, checkpointer=checkpointer,
+                max_revision_bytes=max_revision_bytes, on_oversized=oversized_log,
+                watermarks=watermarks, since_watermark=args.since_watermark), # chose base generator here
+            processors=processors
+        )
+
+    if checkpointer: checkpointer.finish()
+    if watermarks: watermarks.close()
     wiki_input_stream.close()
+    if compressed_input_stream: compressed_input_stream.close()
     json_output_stream.close()
     logging.info("Done with task %d" % args.index)
     logging.info(Profiled.summarize(processors))
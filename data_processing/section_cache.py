@@ -0,0 +1,172 @@
+"""
+Section-level memoization of the mwparserfromhell cleaning in clean_markup_mediawikiparser.
+Consecutive revisions of a page share most of their sections, and every revision is cleaned twice
+(as tgt_text of one pair and src_text of the next), so only sections whose wikitext changed are parsed.
+"""
+
+import re
+import sys
+import hashlib
+from collections import OrderedDict
+
+import mwparserfromhell
+
+from profiling import Profiled
+
+HEADING_PATTERN = re.compile(r"^=+.+=+[ \t]*$", re.MULTILINE)
+OPENING_TAG_PATTERN = r"<(?!(?:br|hr|wbr|img|meta|link)\b)([A-Za-z][^\s<>/]*)[^<>]*(?<!/)>"
+CLOSING_TAG_PATTERN = r"</([A-Za-z][^\s<>/]*)[^<>]*>"
+# the delimiters that can leave a node open at a heading, numbered by their group; the lookahead on
+# their first characters lets the regex skip ahead over plain text
+DELIMITER_PATTERN = re.compile(r"(?=[<\-{}\n\[\]'])(?:(<!--)|(-->)|(\{\{)|(\}\})|(\n\{\|)|(\n\|\})|(\[\[)|(\]\])|('{2,})|(" +
+                               OPENING_TAG_PATTERN + r")|(" + CLOSING_TAG_PATTERN + r"))", re.IGNORECASE)
+COMMENT_OPEN, COMMENT_CLOSE, QUOTE_RUN, OPENING_TAG, CLOSING_TAG = 1, 2, 9, 10, 12
+# group of a closing delimiter -> group of its opening delimiter
+CLOSING_GROUPS = {4: 3, 6: 5, 8: 7}
+
+
+class _Balance:
+    """
+    The templates, tables, links and tags (by name) left open by the text scanned so far, counted in
+    order and skipping comments. It is broken once something is closed that is not open (e.g. a
+    stray "-->"), as the nodes mwparserfromhell makes of the rest can then span headings. Italic and
+    bold quote runs are tracked by parity, since an open one also carries over a heading.
+    """
+    def __init__(self):
+        self.open = dict.fromkeys(CLOSING_GROUPS.values(), 0)
+        self.open_tags = {}
+        self.in_comment = False
+        self.italic = self.bold = False
+        self.broken = False
+
+    def scan(self, segment):
+        for match in DELIMITER_PATTERN.finditer(segment):
+            group = match.lastindex
+            if self.in_comment:
+                self.in_comment = group != COMMENT_CLOSE
+            elif group == COMMENT_OPEN:
+                self.in_comment = True
+            elif group == COMMENT_CLOSE:
+                self.broken = True
+            elif group == QUOTE_RUN:
+                run = len(match.group(group))
+                self.italic ^= run == 2 or run >= 5
+                self.bold ^= run >= 3
+            elif group == OPENING_TAG:
+                name = match.group(OPENING_TAG + 1).lower()
+                self.open_tags[name] = self.open_tags.get(name, 0) + 1
+            elif group == CLOSING_TAG:
+                name = match.group(CLOSING_TAG + 1).lower()
+                self.open_tags[name] = self.open_tags.get(name, 0) - 1
+                self.broken |= self.open_tags[name] < 0
+            elif group in CLOSING_GROUPS:
+                self.open[CLOSING_GROUPS[group]] -= 1
+                self.broken |= self.open[CLOSING_GROUPS[group]] < 0
+            else:
+                self.open[group] += 1
+
+    def closed(self):
+        return not (self.in_comment or self.italic or self.bold or any(self.open.values()) or any(self.open_tags.values()))
+
+
+def split_sections(text):
+    """
+    Splits text before the heading lines at which nothing is left open, so that every section parses
+    into the same nodes as it does as part of the whole text. Returns [text] if a delimiter anywhere
+    is closed without being open.
+    """
+    sections = []
+    section_start = checked = 0
+    balance = _Balance()
+    for match in HEADING_PATTERN.finditer(text):
+        split = match.start()
+        balance.scan(text[checked:split])
+        checked = split
+        if balance.broken:
+            return [text]
+        if split > section_start and balance.closed():
+            sections.append(text[section_start:split])
+            section_start = split
+    if sections:
+        balance.scan(text[checked:])
+        if balance.broken:
+            return [text]
+    sections.append(text[section_start:])
+    return sections
+
+
+def strip_nodes(text):
+    """Wikicode.strip_code() up to its final collapsing: the joined strip of every top-level node"""
+    stripped = (node.__strip__(normalize=True, collapse=True, keep_template_params=False)
+                for node in mwparserfromhell.parse(text).nodes)
+    return "".join(str(s) for s in stripped if s)
+
+
+def collapse(text):
+    """The final whitespace collapsing of Wikicode.strip_code(collapse=True)"""
+    text = text.strip("\n")
+    while "\n\n\n" in text:
+        text = text.replace("\n\n\n", "\n\n")
+    return text
+
+
+class SectionCleaningCache:
+    """
+    Maps a hash of a section's wikitext -> its strip_nodes output, so that the stitched sections
+    collapse to exactly what strip_code returns for the whole text. Entries are evicted in
+    least recently used order once they take more than max_bytes, and cleared at every page boundary.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, name="mediawikiparser sections"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self.entries = OrderedDict()
+        self.size = 0
+        self.page_id = None
+
+    def start_page(self, page_id):
+        if page_id != self.page_id:
+            self.clear()
+            self.page_id = page_id
+
+    def strip_code(self, text):
+        """mwparserfromhell.parse(text).strip_code(), parsing only the sections that are not cached"""
+        if not self.max_bytes:
+            return str(mwparserfromhell.parse(text).strip_code())
+
+        parts = []
+        hits = misses = hit_bytes = miss_bytes = evictions = 0
+        for section in split_sections(text):
+            key = hashlib.blake2b(section.encode('utf-8'), digest_size=16).digest()
+            stripped = self.entries.get(key)
+            if stripped is not None:
+                self.entries.move_to_end(key)
+                hits += 1
+                hit_bytes += len(section)
+            else:
+                stripped = strip_nodes(section)
+                misses += 1
+                miss_bytes += len(section)
+                evictions += self._put(key, stripped)
+            parts.append(stripped)
+
+        Profiled.record_cache(self.name, hits, misses, hit_bytes, miss_bytes, evictions)
+        return collapse("".join(parts))
+
+    def _put(self, key, stripped):
+        """Stores an entry, returns the number of entries evicted for it"""
+        size = sys.getsizeof(stripped) + len(key)
+        if size > self.max_bytes:
+            return 0
+        self.entries[key] = stripped
+        self.size += size
+
+        evictions = 0
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= sys.getsizeof(evicted) + len(evicted_key)
+            evictions += 1
+        return evictions
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
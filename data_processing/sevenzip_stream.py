@@ -0,0 +1,87 @@
+"""
+Streaming input from the .7z history dumps (metahistory7zdump), which are much smaller to download
+and much faster to decompress than the bz2 dumps. Python has no 7z container support in the
+standard library, so the archive is decompressed by the 7z command line tool (p7zip) to a pipe.
+"""
+
+import io
+import shutil
+import logging
+import tempfile
+import subprocess
+
+SEVENZIP_EXECUTABLES = ('7z', '7za', '7zr')
+READ_SIZE = 1024 * 1024
+STDERR_TAIL_SIZE = 4096
+
+
+def find_7z_executable():
+    for executable in SEVENZIP_EXECUTABLES:
+        path = shutil.which(executable)
+        if path:
+            return path
+    raise FileNotFoundError("Reading .7z dump files requires one of {} on the PATH (e.g. apt install p7zip-full)".format(
+        ", ".join(SEVENZIP_EXECUTABLES)))
+
+
+class SevenZipStream(io.RawIOBase):
+    """
+    Decompressed bytes of the (single) file in a .7z archive, read from `7z e -so`. Only forward
+    seeks are supported, by reading and discarding (e.g. to resume from a checkpoint).
+    """
+    def __init__(self, dump_file, executable=None):
+        self.dump_file = dump_file
+        command = [executable or find_7z_executable(), 'e', '-so', '-bd', dump_file]
+        logging.debug("Streaming {} from {}".format(dump_file, " ".join(command)))
+        # stderr goes to a file, a pipe nobody reads while 7z runs could fill up and block it
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self.stderr, bufsize=0)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.process.stdout.read() if size is None or size < 0 else self.process.stdout.read(size)
+        if not data:
+            self._check_exit()
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _check_exit(self):
+        returncode = self.process.wait()
+        if returncode != 0:
+            # the end of the output has the error, a damaged archive can produce a warning per block before it
+            self.stderr.seek(max(0, self.stderr.seek(0, io.SEEK_END) - STDERR_TAIL_SIZE))
+            raise OSError("7z failed on {} (exit code {}): {}".format(
+                self.dump_file, returncode, self.stderr.read().decode('utf-8', 'replace').strip()))
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET or offset < self.position:
+            raise io.UnsupportedOperation("SevenZipStream can only seek forward")
+        while self.position < offset:
+            if not self.read(min(offset - self.position, READ_SIZE)):
+                break
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.stderr.close()
+        super().close()
@@ -0,0 +1,77 @@
+"""
+Per-page watermarks for incremental processing of new history dumps: the last rev_id (and its
+timestamp) of every page that run_all_processing.py has processed. Every history dump holds the
+complete history again, with --since-watermark only the pairs whose target revision is newer than
+the page's watermark are processed, older revisions are rejected inside the scanner.
+"""
+
+import sqlite3
+import logging
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    page_id INTEGER PRIMARY KEY,
+    rev_id INTEGER,
+    timestamp TEXT
+);
+"""
+
+
+class WatermarkStore:
+    """
+    SQLite store of the page watermarks. Updates are recorded in memory and only written by flush(),
+    which the Checkpointer calls together with every checkpoint: at that point, all output of the
+    recorded pages has been written, so a killed job never leaves watermarks ahead of its output.
+    """
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self.connection = sqlite3.connect(store_file, timeout=60)
+        self.connection.executescript(SCHEMA)
+        self.pending = {}
+        self._page_id = None
+        self._page_rev_id = None
+
+    def get(self, page_id):
+        """(rev_id, timestamp) of the page's watermark as of the last flush, or None"""
+        row = self.connection.execute("SELECT rev_id, timestamp FROM watermarks WHERE page_id = ?", (int(page_id),)).fetchone()
+        return tuple(row) if row else None
+
+    def record(self, page_id, rev_id, timestamp):
+        page_id, rev_id = int(page_id), int(rev_id)
+        current = self.pending.get(page_id)
+        if current is None or rev_id > current[0]:
+            self.pending[page_id] = (rev_id, timestamp)
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany("""
+                INSERT INTO watermarks VALUES (?, ?, ?) ON CONFLICT(page_id) DO UPDATE
+                SET rev_id = excluded.rev_id, timestamp = excluded.timestamp WHERE excluded.rev_id > watermarks.rev_id""",
+                ((page_id, rev_id, timestamp) for page_id, (rev_id, timestamp) in self.pending.items()))
+        logging.debug("Wrote watermarks of {} pages".format(len(self.pending)))
+        self.pending.clear()
+
+    def revision_filter(self, since_watermark=False, revision_filter=None):
+        """
+        Wraps a pushdown revision filter (see generic_extractor.pushdown_filters, may be None): every
+        revision it sees is recorded, and with since_watermark, revisions up to the page's watermark
+        are rejected as 'since_watermark' before revision_filter is asked.
+        """
+        def watermark_filter(revision):
+            rev_id = int(revision.rev_id)
+            self.record(revision.page_id, rev_id, revision.timestamp)
+            if since_watermark:
+                if revision.page_id != self._page_id:
+                    self._page_id = revision.page_id
+                    watermark = self.get(revision.page_id)
+                    self._page_rev_id = watermark[0] if watermark else None
+                if self._page_rev_id is not None and rev_id <= self._page_rev_id:
+                    return 'since_watermark'
+            return revision_filter(revision) if revision_filter is not None else None
+        return watermark_filter
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,73 @@
+"""
+One-time transcoding of downloaded .bz2 (or .7z) history dumps into seekable, page-aligned zstd
+files with an embedded page index (see zstd_dump.py). The transcoded file is written next to the
+dump and is picked up by run_all_processing.py and the samplers (through dump_io.open_dump)
+instead of the original.
+"""
+
+import os
+import time
+import glob
+import argparse
+import logging
+
+from dump_io import open_dump
+from dump_scanner import ByteScanner, PAGE_START, decode_field
+from zstd_dump import ZstdDumpWriter, transcoded_file, DEFAULT_FRAME_SIZE
+
+SCAN_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def transcode(dump_file, output_file=None, frame_size=DEFAULT_FRAME_SIZE, level=10, workers=None):
+    """Transcodes dump_file into output_file (default: transcoded_file(dump_file)), returns output_file"""
+    output_file = output_file or transcoded_file(dump_file)
+    temp_file = output_file + ".tmp"
+    start_time = time.time()
+
+    writer = ZstdDumpWriter(temp_file, frame_size=frame_size, level=level)
+    with open_dump(dump_file, workers=workers) as stream:
+        scanner = ByteScanner(stream, SCAN_CHUNK_SIZE)
+        while True:
+            page_start = scanner.buffer.find(PAGE_START)
+            if page_start == -1:
+                # pass everything on except a tail that could be the start of <page>
+                writer.write(scanner.take(max(0, len(scanner.buffer) - len(PAGE_START) + 1)))
+                if not scanner.fill():
+                    writer.write(scanner.take(len(scanner.buffer)))
+                    break
+                continue
+
+            writer.write(scanner.take(page_start))
+            id_end = scanner.find(b"</id>")
+            if id_end == -1:
+                raise ValueError("Truncated page header at offset {} of {}".format(scanner.offset, dump_file))
+            writer.page_start(int(decode_field(scanner.buffer, b"<id>", b"</id>", 0, id_end + len(b"</id>"))))
+            writer.write(scanner.take(len(PAGE_START)))
+    uncompressed_bytes = writer.close()
+
+    # only expose complete files, consumers pick up the transcoded file whenever it exists
+    os.replace(temp_file, output_file)
+    logging.info("Transcoded {} ({:.1f} MB) to {} ({:.1f} MB): {} pages in {} frames, {:.1f} MB XML in {:.0f}s".format(
+        dump_file, os.path.getsize(dump_file) / 1024**2, output_file, os.path.getsize(output_file) / 1024**2,
+        len(writer.page_ids), len(writer.frame_offsets), uncompressed_bytes / 1024**2, time.time() - start_time))
+    return output_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-path', type=str, default="./data/raw/", help='the data directory with the downloaded dump files')
+    parser.add_argument('--dump_file', type=str, default=None, help='transcode only this file instead of all .bz2/.7z files in --data-path')
+    parser.add_argument('--frame-mb', type=int, default=DEFAULT_FRAME_SIZE // (1024 * 1024), help='uncompressed size of the zstd frames (pages are never split across frames)')
+    parser.add_argument('--level', type=int, default=10, help='zstd compression level')
+    parser.add_argument('--decompress-workers', type=int, default=1, help='number of processes decompressing the bz2 input (ignored for .7z)')
+    parser.add_argument('--overwrite', action='store_true', help='transcode again even if the .zst file exists')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='(%(threadName)s) %(message)s')
+
+    dump_files = [args.dump_file] if args.dump_file else sorted(
+        glob.glob(os.path.join(args.data_path, "*.bz2")) + glob.glob(os.path.join(args.data_path, "*.7z")))
+    for dump_file in dump_files:
+        if os.path.exists(transcoded_file(dump_file)) and not args.overwrite:
+            logging.info("File Exists, Skip: " + transcoded_file(dump_file))
+            continue
+        transcode(dump_file, frame_size=args.frame_mb * 1024 * 1024, level=args.level, workers=args.decompress_workers)
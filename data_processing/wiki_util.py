@@ -1,6 +1,7 @@
 import difflib
 import glob
 import html
+import hashlib
 import random
 import re
 import bz2
@@ -17,6 +18,7 @@ import mwparserfromhell
 #nlp = spacy.load('en_core_web_sm') # was: 'en'
 
 from tqdm import tqdm
+from dump_scanner import DEFAULT_CHUNK_SIZE, AzureBlobStream, RevisionView, PageHistory, scan_pages, scan_revisions, scan_revision_views, scan_page_histories, OversizedRevisionLog
 import nltk
 nltk.data.path.append('./nltk_data/')
 from nltk.translate.bleu_score import sentence_bleu
@@ -60,181 +62,54 @@ def extract_data(revision_part):
     return (rev_id, parent_id, timestamp, username, userid, userip, comment, text)
 
 
-def split_pages(wiki_file, chunk_size=1024):
-
-    text_buffer = ""
-    cur_index = 0
-    cursor = 0
-    page_start_index = -1
-    page_end_index = -1
-
-    while True:
-        try:
-            chunk = wiki_file.read(chunk_size)
-           # print('split_pages l65')
-
-            if chunk:
-                text_buffer += chunk
-        except MemoryError:
-            # if memory error, abandon current buffer and restart
-            text_buffer = ""
-            page_start_index = -1
-            page_end_index = -1
-            cursor = 0
-            cur_index = 0
-            continue
-
-        #print(len(text_buffer))
-        cur_index = 0
-        PAGE_START = "<page>"
-        PAGE_END = "</page>"
-        
-        while True:
-            if page_start_index == -1:
-                page_start_index = text_buffer.find(PAGE_START, cursor)
-                if page_start_index == -1:
-                    cursor = len(text_buffer) - 1 # set cursor to last index
-                    break
-                cursor = page_start_index + len(PAGE_START)
-           
-            if page_end_index == -1:
-                page_end_index = text_buffer.find(PAGE_END, cursor)
-                if page_end_index == -1:
-                    cursor = len(text_buffer) - 1
-                    break
-                cursor = page_end_index + len(PAGE_END)
-
-            yield text_buffer[page_start_index:page_end_index + len(PAGE_END)]
-
-            cur_index = page_end_index + len(PAGE_END)
-            page_start_index = -1
-            page_end_index = -1
-
-        if chunk == "":
-            break
-
-        if cur_index == -1:
-            text_buffer = ""
-        else:
-            text_buffer = text_buffer[cur_index:]
-            cursor -= cur_index
-            if page_start_index != -1:
-                page_start_index -= cur_index 
-            if page_end_index != -1:
-                page_end_index -= cur_index
+def split_pages(wiki_file, chunk_size=DEFAULT_CHUNK_SIZE, max_revision_bytes=None, on_oversized=None, page_filter=None, on_skip=None):
+    '''
+    Extract the page text buffer, which has the format "<page> ... </page>".
+    Pages rejected by page_filter(page_title, page_ns, page_id) are skipped without being buffered.
+    '''
+    for page in scan_pages(wiki_file, chunk_size=chunk_size, max_revision_bytes=max_revision_bytes, on_oversized=on_oversized,
+            page_filter=page_filter, on_skip=on_skip):
+        yield page.decode('utf-8')
 
 
 '''
 Extract the revision text buffer, which has the format "<revision> ... </revision>".
 '''
-def split_records(wiki_file, azure=False, chunk_size=150 * 1024, max_bytes=None):
-    
-    text_buffer = ""    
-    cur_index = 0
+def split_records(wiki_file, azure=False, chunk_size=150 * 1024, max_bytes=None, max_revision_bytes=None, on_oversized=None):
     if azure:
-        blob_size = wiki_file.get_blob_properties()['size']
-        cur_offset = 0 
+        wiki_file = AzureBlobStream(wiki_file, chunk_size)
 
-        decompressor = bz2.BZ2Decompressor()
-        decoder = codecs.getincrementaldecoder('utf-8')()
+    for page_title, page_id, revision in scan_revisions(wiki_file, chunk_size=chunk_size, max_bytes=max_bytes,
+            max_revision_bytes=max_revision_bytes, on_oversized=on_oversized):
+        yield page_title, page_id, revision.decode('utf-8')
 
-    page_title = ""
-    page_id = ""
-    
-    next_page_start = None
-    next_page_title_id = None
-
-    total_bytes_read = 0
-    while True:
-        if not azure:
-            chunk = wiki_file.read(chunk_size)
-            total_bytes_read += chunk_size
-        else:
-            if cur_offset < blob_size:
-                bytes_data = wiki_file.download_blob(offset=cur_offset,
-                    length=chunk_size).content_as_bytes()
-                cur_offset += len(bytes_data)
-                chunk = decompressor.decompress(bytes_data)
-                chunk = decoder.decode(input=chunk)
-                total_bytes_read += chunk_size
-            else:
-                chunk = ''
-                
-        if chunk:
-            text_buffer += chunk
-
-        cur_index = 0
-        REVISION_START = "<revision>"
-        REVISION_END = "</revision>"
-        PAGE_START = "<page>"
-        PAGE_TITLE_START = "<title>"
-        PAGE_TITLE_END = "</title>"
-        
-        while True:
-
-            if next_page_start is None:
-                # we did not yet find where the next page starts, keep looking for it..
-                page_start_index = text_buffer.find(PAGE_START, cur_index)
-                found_new_page_start_in_buffer = page_start_index != -1
-                if found_new_page_start_in_buffer:
-                    # we found the start of the next page, store it so that we notice once a revision passes over it
-                    next_page_title, _ = extract_with_delims(text_buffer, PAGE_TITLE_START, PAGE_TITLE_END, page_start_index)
-                    next_page_id, _ = extract_with_delims(text_buffer, "<id>", "</id>", page_start_index)
-                    
-                    # there is a chance that the page title and id are not yet in this buffer/chunk. only set of we could parse them correctly
-                    if next_page_title and next_page_id:
-                        next_page_title_id = (next_page_title, next_page_id)
-                        next_page_start = page_start_index
-
-            # find the revision start position
-            revision_start_index = text_buffer.find(REVISION_START, cur_index)
-
-            passed_page = next_page_start is not None and revision_start_index > next_page_start
-            if passed_page:
-                # the current revision passed over the next pagebreak. update the current page_title, page_id and start looking for the next new page!
-                page_title, page_id = next_page_title_id
-                next_page_title_id = None
-                next_page_start = None
-
-            # No revision in the buffer, continue loading data
-            if revision_start_index == -1:
-                break
-
-            # find the revision end position
-            revision_end_index = text_buffer.find(REVISION_END, revision_start_index)
-
-            # No complete page in buffer
-            if revision_end_index == -1:
-                break
-
-            if next_page_start is not None and revision_end_index > next_page_start:
-                logging.error("Error: the revision ends at {} but next page was scheduled to start at {}. This should never happen!".format(revision_end_index, next_page_start))
-
-            if not page_title:
-                logging.error("Error: missing page title. This should never happen!")
-
-            revision_text = text_buffer[revision_start_index:revision_end_index + len(REVISION_END)]
-            yield page_title, page_id, revision_text
-
-            cur_index = revision_end_index + len(REVISION_END)
+'''
+Like split_records, but yields lazily parsed RevisionView records instead of revision strings.
+Optional page/revision filters are evaluated on the headers by the scanner (see scan_revision_views).
+Revisions larger than max_revision_bytes are skipped without buffering and reported to on_oversized
+(e.g. an OversizedRevisionLog); the revision after a skipped one is left unpaired.
+'''
+def split_revision_views(wiki_file, azure=False, chunk_size=150 * 1024, max_bytes=None,
+        page_filter=None, revision_filter=None, on_skip=None, on_page=None, max_revision_bytes=None, on_oversized=None):
+    if azure:
+        wiki_file = AzureBlobStream(wiki_file, chunk_size)
 
-        if max_bytes is not None and total_bytes_read > max_bytes:
-            logging.info("\nStop processing input stream as max_bytes={} was requested and already read a total of {} bytes\n".format(max_bytes, total_bytes_read))
-            break
+    return scan_revision_views(wiki_file, chunk_size=chunk_size, max_bytes=max_bytes,
+        page_filter=page_filter, revision_filter=revision_filter, on_skip=on_skip, on_page=on_page,
+        max_revision_bytes=max_revision_bytes, on_oversized=on_oversized)
 
-        # No more datA
-        if chunk == "":
-            break
+'''
+Yields one PageHistory (page header plus index-addressable revisions) per page, so that whole
+pages can be handed to worker processes as units of work.
+'''
+def split_page_histories(wiki_file, azure=False, chunk_size=150 * 1024, max_bytes=None,
+        page_filter=None, on_skip=None, on_page=None, max_revision_bytes=None, on_oversized=None):
+    if azure:
+        wiki_file = AzureBlobStream(wiki_file, chunk_size)
 
-        if cur_index == -1:
-            text_buffer = ""
-        else:
-            text_buffer = text_buffer[cur_index:]
-            if next_page_start is not None:
-                next_page_start -= cur_index
-                if next_page_start < 0:
-                    next_page_start = None
-                    logging.error("Error: the text buffer was clipped in a way that the page title was cut. This should never happen!")
+    return scan_page_histories(wiki_file, chunk_size=chunk_size, max_bytes=max_bytes,
+        page_filter=page_filter, on_skip=on_skip, on_page=on_page,
+        max_revision_bytes=max_revision_bytes, on_oversized=on_oversized)
 
 def split_into_sections(text):
     section_title_pattern = '(^=+\s*.+\s*=+$)'
@@ -315,6 +190,31 @@ def split_edits(source_text, target_text, k=5):
 def sampleNext(sample_ratio):
     return random.random() < sample_ratio
 
+def pageHash(page_id, seed=''):
+    '''
+    Deterministic 64 bit hash of a page id: the same on every machine and run (unlike random() or
+    hash()), different seeds give independent samples.
+    '''
+    digest = hashlib.blake2b((seed + ':' + str(page_id)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def samplePage(page_id, sample_ratio, seed=''):
+    '''Decides from the upper half of pageHash, so the pages sampled at a lower ratio are a subset of those at a higher one'''
+    return (pageHash(page_id, seed) >> 32) / 2**32 < sample_ratio
+
+def pageShard(page_id, shards, seed=''):
+    '''
+    Assigns a page to one of shards, a list of (name, fraction) e.g. [('train', 0.8), ('dev', 0.1),
+    ('test', 0.1)]. Decides from the lower half of pageHash, independent of samplePage: shards never
+    overlap, and a page stays in the same shard for every sample ratio and dump file.
+    '''
+    position = (pageHash(page_id, seed) & 0xFFFFFFFF) / 2**32 * sum(share for _, share in shards)
+    for name, share in shards:
+        if position < share:
+            return name
+        position -= share
+    return shards[-1][0]
+
 def cleanCmntText(comment):
     filter_words = []
     comment = comment.replace("(edited with [[User:ProveIt_GT|ProveIt]]", "")
@@ -333,13 +233,46 @@ def checkComment(comment, comment_tokens, min_comment_length):
 
     return True
 
+# the passes of cleanWikiTextRegex, rewritten so that none of them backtracks more than linearly:
+# the last pipe of a link is found without retrying every split, tables are cut with find/rfind
+# and the literal passes are str.replace, which removes the same leftmost non-overlapping matches
+PIPED_LINK_PATTERN = re.compile(r'\[\[[^\[\]]+\|([^\[\]|]+\|?|\|)\]\]')
+MARKUP_PATTERNS = [re.compile(pattern, re.DOTALL) for pattern in [
+    r'<!--[^<>]*-->', # comments
+    r'<\w+>[^<>]*</\w+>',
+    r'<\w+>|<\w+/>', # html tags
+    r'{{[^{}]*}}', # wikipedia elements
+]]
+
 '''
 clean the wiki text
 E.g. "[[link name]] a&quot; bds&quot; ''markup''" to "link name a bds markup"
 '''
 def cleanWikiText(wiki_text): # use mwparserfromhell instead
     '''
-    Cleans wikipedia text and retrieves references
+    Cleans wikipedia text and retrieves references. Same output as cleanWikiTextRegex in linear time
+    '''
+
+    # resolve [[Category|name]] links, then [[link_name]] and quotes
+    wiki_text = PIPED_LINK_PATTERN.sub(r'\1', wiki_text)
+    wiki_text = wiki_text.replace("[[", "").replace("]]", "").replace("''", "")
+
+    # tables: from the first <table to the last </table>, if a '>' follows the first one
+    table_start = wiki_text.find("<table")
+    if table_start >= 0:
+        table_end = wiki_text.rfind("</table>")
+        if table_end >= table_start + len("<table") and wiki_text.find(">", table_start + len("<table"), table_end) >= 0:
+            wiki_text = wiki_text[:table_start] + wiki_text[table_end + len("</table>"):]
+
+    for pattern in MARKUP_PATTERNS:
+        wiki_text = pattern.sub('', wiki_text)
+    wiki_text = wiki_text.replace("&nbsp;", "")
+
+    return wiki_text.strip('\n')
+
+def cleanWikiTextRegex(wiki_text):
+    '''
+    The original chain of re.sub passes, kept as the reference of cleanWikiText (see regression_clean_wikitext.py)
     '''
 
     # resolve [[Category|name]] links
@@ -13,6 +13,7 @@ import os
 import io
 
 from wiki_util import *
+from dump_io import open_dump, prefer_transcoded
 from wiki_dump_download import existFile
 
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
@@ -52,7 +53,7 @@ def randSampleRev(task_id, dump_file, output_file, sample_ratio, min_cmnt_length
 
     start_time = datetime.datetime.now()
     if not azure:
-        wiki_file = bz2.open(dump_file, "rt", encoding='utf-8')
+        wiki_file = open_dump(prefer_transcoded(dump_file))
     else:
         wiki_file = blob_service_client.get_blob_client(container=container_name,
                 blob=dump_file)
@@ -73,21 +74,22 @@ def randSampleRev(task_id, dump_file, output_file, sample_ratio, min_cmnt_length
     # print("=== ", i, "/", file_num, ' === ', revision_count, " revisions extracted.", ' Time elapsed (hh:mm:ss.ms) {}'.format(time_elapsed), sep='')
 
     sample_parent_id = None
-    sample_parent_text = None
+    sample_parent_revision = None
     page_comment_list = []
     prev_page_title = '' 
 
     try:
-        for page_title, page_id, revision in split_records(wiki_file, azure):
+        for revision in split_revision_views(wiki_file, azure):
             revision_count += 1
+            page_title = revision.page_title
            
             #if count_revision_only:
             #    if revision_count % 1000 == 0:
             #        logging.info("= revision" + str(revision_count) + " =")
             #    continue
 
-            # fields 
-            rev_id, parent_id, timestamp, username, userid, userip, comment, text = extract_data(revision)
+            # fields, the revision text is only decoded for revisions passing the comment filters
+            rev_id, parent_id, timestamp, comment = revision.rev_id, revision.parent_id, revision.timestamp, revision.comment
 
             if count_revision_only:
                 if prev_page_title != page_title:
@@ -102,7 +104,7 @@ def randSampleRev(task_id, dump_file, output_file, sample_ratio, min_cmnt_length
                 sect_title, comment = extractSectionTitle(comment)
 
                 meta = {"comment_text":comment,
-                        "text_length":len(text), "parent_id":parent_id,
+                        "text_length":len(revision.text), "parent_id":parent_id,
                         "section_title":sect_title, "page_title":page_title}
                         
                 revisions[rev_id] = meta
@@ -151,10 +153,10 @@ def randSampleRev(task_id, dump_file, output_file, sample_ratio, min_cmnt_length
                 # check whether the comment is appropriate by some criteria
                 # check_comment(comment, length_only=True)
                 try:
-                    src_text = extractSectionText(sample_parent_text, sect_title)
-                    tgt_text = extractSectionText(text, sect_title)
+                    src_text = extractSectionText(sample_parent_revision.text, sect_title)
+                    tgt_text = extractSectionText(revision.text, sect_title)
                 except:
-                    print("ERROR-RegularExpression:", sample_parent_text, text, " Skip!!")
+                    print("ERROR-RegularExpression:", sample_parent_revision.text, revision.text, " Skip!!")
                     # skip the revision if any exception happens
                     continue
 
@@ -229,10 +231,10 @@ def randSampleRev(task_id, dump_file, output_file, sample_ratio, min_cmnt_length
             # decide to sample next
             if sampleNext(sample_ratio):
                 sample_parent_id = rev_id
-                sample_parent_text = text
+                sample_parent_revision = revision
             else:
                 sample_parent_id = None
-                sample_parent_text = None
+                sample_parent_revision = None
 
             # if revision_count % 1000 == 0:
             #     print("Finished ", str(revision_count))
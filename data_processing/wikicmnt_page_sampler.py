@@ -7,7 +7,7 @@ import threading
 import multiprocessing
 
 from wiki_util import *
-from wikicmnt_page_sampler_st import randSamplePage
+from wikicmnt_page_sampler_st import randSamplePage, parseShards
 from wikicmnt_extractor import WikiSampleTask
 
 def workerProcess(task_id, dump_list, total_num, lock):
@@ -49,7 +49,7 @@ def worker(work_id, tasks):
                 str(total_num) + '): ' + str(dump_file))
         output_file = args.output_path + 'enwiki-sample-' + \
             os.path.basename(dump_file)[27:-4] + '.txt.bz2'
-        randSamplePage(work_id, dump_file, output_file, args.sample_ratio)
+        randSamplePage(work_id, dump_file, output_file, args.sample_ratio, parseShards(args.shards), args.seed)
     
     logger.debug('Exiting.')
 
@@ -117,6 +117,8 @@ if __name__ == '__main__':
         default='/mnt/nlp-storage/data/raw/wikipedia-subsample/', help='the\
         output directory')
     parser.add_argument('--sample_ratio', type=float, default=0.01)
+    parser.add_argument('--shards', type=str, default=None, help='split the sample into shards, e.g. train=0.8,dev=0.1,test=0.1')
+    parser.add_argument('--seed', type=str, default='', help='pages are sampled by a hash of seed and page id')
     parser.add_argument('--threads', type=int, default=5)
     parser.add_argument('--processes', type=int, default=6)
     parser.add_argument('--overwrite_existing', action='store_true')
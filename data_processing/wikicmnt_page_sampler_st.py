@@ -7,42 +7,62 @@ import os
 import io
 
 from wiki_util import *
+from dump_io import open_dump, prefer_transcoded
 
-def randSamplePage(task_id, dump_file, output_file, sample_ratio):
+def parseShards(shards):
+    '''Parses "train=0.8,dev=0.1,test=0.1" into [('train', 0.8), ('dev', 0.1), ('test', 0.1)]'''
+    if not shards:
+        return None
+    return [(name, float(share)) for name, share in (shard.split('=') for shard in shards.split(','))]
+
+def shardFile(output_file, shard):
+    '''test.txt.bz2 -> test.train.txt.bz2'''
+    directory, name = os.path.split(output_file)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, stem + '.' + shard + dot + extensions)
+
+def randSamplePage(task_id, dump_file, output_file, sample_ratio, shards=None, seed=''):
+    '''
+    Samples pages by a hash of their page id (see wiki_util.samplePage), so a run can be reproduced
+    on any machine. The decision is taken right after the page <id> is read, unsampled pages are
+    skipped by the scanner without being buffered. With shards (see wiki_util.pageShard), every
+    shard is written to its own file, e.g. test.train.txt.bz2.
+    '''
 
     logger = logging.getLogger(__name__)
 
-    out_file = bz2.open(output_file, 'wt', encoding='utf-8')
+    if shards:
+        out_files = dict((shard, bz2.open(shardFile(output_file, shard), 'wt', encoding='utf-8')) for shard, _ in shards)
+    else:
+        out_files = {None: bz2.open(output_file, 'wt', encoding='utf-8')}
 
     start_time = datetime.datetime.now()
-    wiki_file = bz2.open(dump_file, 'rt', encoding='utf-8')
+    wiki_file = open_dump(prefer_transcoded(dump_file))
 
     sample_count = 0
-    page_count = 0
-    cur_page_title = ''
+    skipped = [0]
+
+    def page_filter(page_title, page_ns, page_id):
+        return None if samplePage(page_id, sample_ratio, seed) else 'not sampled'
+
+    def on_skip(rejected_by, skipped_bytes):
+        skipped[0] += 1
 
     try:
-        #for page_title, revision in split_records(wiki_file):
-        #    if page_title != cur_page_title:
-        #        logger.info(page_title)
-        #        cur_page_title = page_title
-
-        for i, page in enumerate(split_pages(wiki_file)):
-#            if i >= 5: break
-
-            page_count += 1
-            if (page_count+1) % 1000 == 0:
-                logger.info('Page {}'.format(page_count))
-
-            #decide to sample
-            if sampleNext(sample_ratio):
-                out_file.write(page + '\n')
-                sample_count += 1
+        for page in split_pages(wiki_file, page_filter=page_filter, on_skip=on_skip):
+            page_id = extract_with_delims(page, "<id>", "</id>", 0)[0]
+            shard = pageShard(page_id, shards, seed) if shards else None
+            out_files[shard].write(page + '\n')
+            sample_count += 1
+            if (sample_count + skipped[0] + 1) % 1000 == 0:
+                logger.info('Page {}'.format(sample_count + skipped[0]))
     finally:
         time_elapsed = datetime.datetime.now() - start_time
-        logger.info("===" + str(sample_count) + " pages sampled. Time elapsed\
+        logger.info("===" + str(sample_count) + " of " + str(sample_count + skipped[0]) + " pages sampled. Time elapsed\
                 (hh:mm:ss.ms) {}".format(time_elapsed) + ' ===')
-        out_file.close()
+        for out_file in out_files.values():
+            out_file.close()
+        wiki_file.close()
 
 if __name__ == '__main__':
 
@@ -52,11 +72,13 @@ if __name__ == '__main__':
     parser.add_argument('--output_file', type=str,
         default='/mnt/nlp-storage/data/raw/wikipedia-subsample/test.txt.bz2')
     parser.add_argument('--sample-ratio', type=float, default=0)
+    parser.add_argument('--shards', type=str, default=None, help='split the sample into shards, e.g. train=0.8,dev=0.1,test=0.1')
+    parser.add_argument('--seed', type=str, default='', help='pages are sampled by a hash of seed and page id')
     args = parser.parse_args()
 
     logging.basicConfig(level = logging.INFO,
             format='(%(threadName)s) (%(name)s) %(message)s',
             )
 
-    randSamplePage(1, args.dump_file, args.output_file, args.sample_ratio)
+    randSamplePage(1, args.dump_file, args.output_file, args.sample_ratio, parseShards(args.shards), args.seed)
     
@@ -46,14 +46,15 @@ def transform(wikitext):
     @see https://www.mediawiki.org/wiki/Help:Formatting
     """
     # look for matching <nowiki>...</nowiki>
-    res = ''
+    res = []
     cur = 0
     for m in nowiki.finditer(wikitext, cur):
-        res += transform1(wikitext[cur:m.start()]) + wikitext[m.start():m.end()]
+        res.append(transform1(wikitext[cur:m.start()]))
+        res.append(wikitext[m.start():m.end()])
         cur = m.end()
     # leftover
-    res += transform1(wikitext[cur:])
-    return res
+    res.append(transform1(wikitext[cur:]))
+    return ''.join(res)
 
 
 def transform1(text):
@@ -80,8 +81,7 @@ def wiki2text(text):
     # Drop tables
     # first drop residual templates, or else empty parameter |} might look like end of table.
     if not options.keep_tables:
-        text = dropNested(text, r'{{', r'}}')
-        text = dropNested(text, r'{\|', r'\|}')
+        text = dropAllNested(text, templatesAndTables)
 
     # Handle bold/italic/quote
     text = bold_italic.sub(r'\1', text)
@@ -105,13 +105,14 @@ def wiki2text(text):
     # ############### Process HTML ###############
 
     # turn into HTML, except for the content of <syntaxhighlight>
-    res = ''
+    res = []
     cur = 0
     for m in syntaxhighlight.finditer(text):
-        res += unescape(text[cur:m.start()]) + m.group(1)
+        res.append(unescape(text[cur:m.start()]))
+        res.append(m.group(1))
         cur = m.end()
-    text = res + unescape(text[cur:])
-    return text
+    res.append(unescape(text[cur:]))
+    return ''.join(res)
 
 
 def clean(text):
@@ -146,8 +147,7 @@ def clean(text):
     text = dropSpans(spans, text)
 
     # Drop discarded elements
-    for tag in options.discardElements:
-        text = dropNested(text, r'<\s*%s\b[^>/]*>' % tag, r'<\s*/\s*%s>' % tag)
+    text = dropAllNested(text, discardedElementDelimiters(options.discardElements))
 
     if not options.toHTML:
         # Turn into text what is left (&amp;nbsp;) and <syntaxhighlight>
@@ -0,0 +1,274 @@
+"""
+Seekable zstd dump files, transcoded once from the .bz2 history dumps (see wiki_dump_transcode.py).
+
+The file is a sequence of independent zstd frames, each holding whole pages (frames only break
+right before a <page> tag, the XML header sits in the first frame), followed by a skippable frame
+with the index: compressed offset/size and uncompressed offset of every frame, and the page ids
+with their uncompressed offsets. Any zstd decompressor (e.g. `zstd -d`) restores the original
+XML, since decompressors ignore skippable frames.
+"""
+
+import io
+import os
+import sys
+import struct
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from dump_scanner import PAGE_START, PAGE_END
+
+SKIPPABLE_FRAME_MAGIC = 0x184D2A5E
+INDEX_MAGIC = b'ZSTPIDX1'
+_FRAME_HEADER = struct.Struct('<II')
+_INDEX_HEADER = struct.Struct('<8sQQ')
+_INDEX_FOOTER = struct.Struct('<Q8s')   # size of the whole skippable frame, INDEX_MAGIC
+
+DEFAULT_FRAME_SIZE = 8 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("Reading and writing .zst dump files requires the zstandard package (pip install zstandard)")
+
+
+def transcoded_file(dump_file):
+    """Name of the zstd transcoding of a .bz2 (or .7z) dump file"""
+    root, ext = os.path.splitext(dump_file)
+    return (root if ext in ('.bz2', '.7z') else dump_file) + '.zst'
+
+
+def _array_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _array_from(data, start, count):
+    values = array('Q')
+    values.frombytes(data[start:start + 8 * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class ZstdDumpWriter:
+    """
+    Writes page-aligned zstd frames: data is fed with write(), and page_start(page_id) is called
+    right before the bytes of every <page>. A new frame is started at a page start once the current
+    frame holds at least frame_size uncompressed bytes. close() appends the index.
+    """
+    def __init__(self, output_file, frame_size=DEFAULT_FRAME_SIZE, level=10, threads=0):
+        _require_zstandard()
+        self.fileobj = open(output_file, "wb")
+        self.frame_size = frame_size
+        self.cctx = zstandard.ZstdCompressor(level=level, threads=threads)
+        self.compressor = None
+        self.frame_offsets, self.frame_sizes, self.frame_uncompressed_offsets = array('Q'), array('Q'), array('Q')
+        self.page_ids, self.page_offsets = array('Q'), array('Q')
+        self.frame_start = 0
+        self.uncompressed_offset = 0
+
+    def _start_frame(self):
+        self.frame_offsets.append(self.fileobj.tell())
+        self.frame_uncompressed_offsets.append(self.uncompressed_offset)
+        self.frame_start = self.uncompressed_offset
+        self.compressor = self.cctx.compressobj()
+
+    def _end_frame(self):
+        self.fileobj.write(self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH))
+        self.frame_sizes.append(self.fileobj.tell() - self.frame_offsets[-1])
+        self.compressor = None
+
+    def write(self, data):
+        if not data:
+            return
+        if self.compressor is None:
+            self._start_frame()
+        self.fileobj.write(self.compressor.compress(data))
+        self.uncompressed_offset += len(data)
+
+    def page_start(self, page_id):
+        if self.compressor is not None and self.uncompressed_offset - self.frame_start >= self.frame_size:
+            self._end_frame()
+        if self.compressor is None:
+            self._start_frame()
+        self.page_ids.append(page_id)
+        self.page_offsets.append(self.uncompressed_offset)
+
+    def close(self):
+        if self.compressor is not None:
+            self._end_frame()
+
+        payload = _INDEX_HEADER.pack(INDEX_MAGIC, len(self.frame_offsets), len(self.page_ids))
+        payload += b''.join(_array_bytes(values) for values in (self.frame_offsets, self.frame_sizes,
+            self.frame_uncompressed_offsets, self.page_ids, self.page_offsets))
+        frame_size = _FRAME_HEADER.size + len(payload) + _INDEX_FOOTER.size
+        self.fileobj.write(_FRAME_HEADER.pack(SKIPPABLE_FRAME_MAGIC, len(payload) + _INDEX_FOOTER.size))
+        self.fileobj.write(payload)
+        self.fileobj.write(_INDEX_FOOTER.pack(frame_size, INDEX_MAGIC))
+        self.fileobj.close()
+        return self.uncompressed_offset
+
+
+def _decompress_frame(data):
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+class ZstdDumpReader(io.RawIOBase):
+    """
+    Stream of the decompressed XML of a transcoded dump file, seekable in both directions through
+    the frame index. With workers > 1, whole frames are decompressed in a process pool and handed
+    out in order. get_page(page_id) only decompresses the frame holding the page.
+    """
+    def __init__(self, dump_file, workers=None, prefetch=None):
+        _require_zstandard()
+        self.dump_file = dump_file
+        self.fileobj = open(dump_file, "rb")
+        self.load_index()
+        self.workers = workers if workers and workers > 1 else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers else None
+        self.prefetch = prefetch or 4 * (self.workers or 1)
+        self.bytes_decompressed = 0     # by get_page
+        self._cached_frame = (None, None)
+        self._start(0)
+
+    def load_index(self):
+        self.fileobj.seek(0, io.SEEK_END)
+        file_size = self.fileobj.tell()
+        if file_size < _INDEX_FOOTER.size:
+            raise ValueError("{} is not a transcoded dump file".format(self.dump_file))
+        self.fileobj.seek(file_size - _INDEX_FOOTER.size)
+        frame_size, magic = _INDEX_FOOTER.unpack(self.fileobj.read(_INDEX_FOOTER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError("{} has no page index, was it written by wiki_dump_transcode.py?".format(self.dump_file))
+
+        self.fileobj.seek(file_size - frame_size + _FRAME_HEADER.size)
+        payload = self.fileobj.read(frame_size - _FRAME_HEADER.size - _INDEX_FOOTER.size)
+        magic, n_frames, n_pages = _INDEX_HEADER.unpack_from(payload)
+        pos = _INDEX_HEADER.size
+        arrays = []
+        for count in (n_frames, n_frames, n_frames, n_pages, n_pages):
+            arrays.append(_array_from(payload, pos, count))
+            pos += 8 * count
+        self.frame_offsets, self.frame_sizes, self.frame_uncompressed_offsets, self.page_ids, self.page_offsets = arrays
+        self.page_lookup = {page_id: i for i, page_id in enumerate(self.page_ids)}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _read_frame(self, frame):
+        self.fileobj.seek(self.frame_offsets[frame])
+        return self.fileobj.read(self.frame_sizes[frame])
+
+    def _sequential_chunks(self, first_frame):
+        dctx = zstandard.ZstdDecompressor()
+        for frame in range(first_frame, len(self.frame_offsets)):
+            decompressor = dctx.decompressobj()
+            remaining = self.frame_sizes[frame]
+            position = self.frame_offsets[frame]
+            while remaining > 0:
+                self.fileobj.seek(position)
+                data = self.fileobj.read(min(READ_SIZE, remaining))
+                position += len(data)
+                remaining -= len(data)
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield chunk
+
+    def _parallel_chunks(self, first_frame):
+        pending = deque()
+        frames = iter(range(first_frame, len(self.frame_offsets)))
+        try:
+            while True:
+                while len(pending) < self.prefetch:
+                    frame = next(frames, None)
+                    if frame is None:
+                        break
+                    pending.append(self.executor.submit(_decompress_frame, self._read_frame(frame)))
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _start(self, position):
+        """Restarts decompression at the frame containing the uncompressed position"""
+        frame = max(0, bisect_right(self.frame_uncompressed_offsets, position) - 1)
+        first_frame_offset = self.frame_uncompressed_offsets[frame] if len(self.frame_offsets) else 0
+        self.chunks = self._parallel_chunks(frame) if self.executor else self._sequential_chunks(frame)
+        self.current = b''
+        self.current_pos = 0
+        self.position = first_frame_offset
+        while self.position < position:
+            if not self.read(min(position - self.position, READ_SIZE)):
+                break
+
+    def read(self, size=-1):
+        while self.current_pos >= len(self.current):
+            self.current = next(self.chunks, None)
+            self.current_pos = 0
+            if self.current is None:
+                self.current = b''
+                return b''
+
+        end = len(self.current) if size is None or size < 0 else self.current_pos + size
+        data = self.current[self.current_pos:end]
+        self.current_pos += len(data)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("ZstdDumpReader only seeks relative to the start or current position")
+        if offset != self.position:
+            self.chunks.close()
+            self._start(offset)
+        return self.position
+
+    def get_ids(self):
+        return self.page_ids
+
+    def __contains__(self, page_id):
+        return int(page_id) in self.page_lookup
+
+    def get_page(self, page_id):
+        """Returns the raw bytes of <page> ... </page>, decompressing only the frame holding it"""
+        page_offset = self.page_offsets[self.page_lookup[int(page_id)]]
+        frame = bisect_right(self.frame_uncompressed_offsets, page_offset) - 1
+        cached_frame, data = self._cached_frame
+        if cached_frame != frame:
+            # the last frame is kept, so pages fetched in file order share their frames
+            data = _decompress_frame(self._read_frame(frame))
+            self.bytes_decompressed += len(data)
+            self._cached_frame = (frame, data)
+        page_start = page_offset - self.frame_uncompressed_offsets[frame]
+        page_end = data.find(PAGE_END, page_start)
+        if not data.startswith(PAGE_START, page_start) or page_end == -1:
+            raise ValueError("Page {} is not where the index of {} says it is".format(page_id, self.dump_file))
+        return data[page_start:page_end + len(PAGE_END)]
+
+    def close(self):
+        if not self.closed:
+            self.chunks.close()
+            if self.executor:
+                self.executor.shutdown(wait=True)
+            self.fileobj.close()
+        super().close()